@@ -1,19 +1,26 @@
-from .intent import (
-    get_intent,
-    actions,
-    isolate_action_data
-)
-from .keyvault import get_secret
-from .regex_fns import (
-    whitespace_regex
-)
-from .openai_fns import (
-    messages_prompt,
-    get_embeddings,
-    summarize
-)
-from .azure_fns import (
-    vector_search,
-    search_kb,
-    get_embeddings
-)
+import importlib
+
+# the names re-exported by the package, by module. They are imported on first
+# access, so importing a single submodule (e.g., fns.benchmark) does not
+# import (and configure) all of them.
+exports = {
+    "intent": ["get_intent", "actions", "isolate_action_data"],
+    "keyvault": ["get_secret"],
+    "regex_fns": ["whitespace_regex"],
+    "openai_fns": [
+        "messages_prompt",
+        "get_embeddings",
+        "get_embeddings_batch",
+        "summarize",
+    ],
+    "azure_fns": ["vector_search", "search_kb"],
+}
+modules = {name: module for module, names in exports.items() for name in names}
+
+__all__ = list(modules)
+
+
+def __getattr__(name):
+    if name not in modules:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(f".{modules[name]}", __name__), name)
@@ -1,7 +1,9 @@
 import xml.etree.ElementTree as etree
+import hashlib
 import json
 import xmltodict
 import os
+import requests
 from artifactory import ArtifactoryPath
 from .utils import RELATIVE_PATH
 
@@ -12,6 +14,8 @@ repository = "knowmgmt-gen-publish"
 content_prefix = "Vertex/content/en/"
 # Path to keep local copy of documents
 downloads_dir = "downloads"
+# Bytes held in memory at once while streaming an artifact to disk
+download_buffer_size = 1024 * 1024
 
 # present / current working dir python
 
@@ -45,6 +49,97 @@ def get_artifactory_metadata(path):
     return artifactory_metadata
 
 
+def hash_file(filename, buffer_size=download_buffer_size):
+    """
+    Stream a file from disk through sha256, returning (hasher, bytes_read)
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with open(filename, "rb") as infile:
+        for block in iter(lambda: infile.read(buffer_size), b""):
+            digest.update(block)
+            size += len(block)
+    return digest, size
+
+
+def download_artifact(
+    path,
+    filename,
+    sha256=None,
+    buffer_size=download_buffer_size,
+    retries=3,
+):
+    """
+    Stream an Artifactory artifact to `filename` in `buffer_size` chunks
+
+    - bytes are written to `<filename>.part` and renamed once complete
+    - an existing `.part` file is resumed with an HTTP Range request
+    - the result is checked against `sha256` (as returned by
+      `get_artifactory_metadata`), a mismatch deletes the partial file and
+      raises a ValueError
+    - if `filename` already exists with the expected hash, nothing is
+      downloaded
+
+    Peak memory is bounded by `buffer_size`, regardless of artifact size.
+    """
+    if sha256 and os.path.exists(filename):
+        digest, _ = hash_file(filename, buffer_size)
+        if digest.hexdigest() == sha256:
+            print(f"Hashes match, skipping download of {path.name}")
+            return filename
+
+    partial = filename + ".part"
+    if os.path.exists(partial):
+        digest, offset = hash_file(partial, buffer_size)
+        print(f"Resuming {path.name} from {offset} bytes")
+    else:
+        digest, offset = hashlib.sha256(), 0
+
+    for attempt in range(retries + 1):
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        try:
+            with path.session.get(
+                str(path),
+                headers=headers,
+                stream=True,
+                verify=path.verify,
+                cert=path.cert,
+                timeout=path.timeout,
+            ) as response:
+                if response.status_code == 416:
+                    # the partial file already holds the whole artifact
+                    break
+                response.raise_for_status()
+                if offset and response.status_code != 206:
+                    # server ignored the Range header, start over
+                    digest, offset = hashlib.sha256(), 0
+                mode = "ab" if offset else "wb"
+                with open(partial, mode) as outfile:
+                    for block in response.iter_content(chunk_size=buffer_size):
+                        outfile.write(block)
+                        digest.update(block)
+                        offset += len(block)
+            break
+        except (
+            requests.ConnectionError,
+            requests.Timeout,
+            # the connection dropped mid-body, while streaming
+            requests.exceptions.ChunkedEncodingError,
+        ) as e:
+            if attempt == retries:
+                raise
+            print(
+                f"Connection dropped downloading {path.name} at {offset} bytes ({e}), resuming...")
+
+    if sha256 and digest.hexdigest() != sha256:
+        os.remove(partial)
+        raise ValueError(
+            f"sha256 mismatch for {path.name}: expected {sha256}, got {digest.hexdigest()}")
+
+    os.replace(partial, filename)
+    return filename
+
+
 def find_variable(root, variable_name):
     """
     Look up the value of a variable in the publication XML
@@ -1,7 +1,10 @@
 import os
 import sys
 import json
+import functools
 import asyncio
+import threading
+import aiohttp
 import requests
 
 from gremlin_python.driver.protocol import GremlinServerError, GremlinServerWSProtocol
@@ -40,7 +43,8 @@ from glom import glom, flatten
 
 from .openai_fns import get_embeddings
 from .keyvault import get_secret
-from .regex_fns import no_special_chars
+from .graph_cache import GraphCache, id_key, vertex_ids
+from .graph_plan import GraphPlan
 from .utils import RELATIVE_PATH
 
 
@@ -53,6 +57,9 @@ with open(f"{RELATIVE_PATH}constants.json") as f:
     config = json.load(f)
     search_api_version = config["search_api_version"]
     search_index_name = config["search_index_name"]
+    gremlin_pool_size = config.get("gremlin_pool_size", 4)
+    graph_cache_size = config.get("graph_cache_size", 1024)
+    graph_cache_ttl = config.get("graph_cache_ttl_seconds", 300)
 
 
 #       /                                888 ,e,
@@ -65,17 +72,32 @@ with open(f"{RELATIVE_PATH}constants.json") as f:
 
 # https://github.com/Azure-Samples/cosmos-notebooks/blob/c8ce5f5319459f2a6a7f8fe55b6c62dd9ee78753/All_API_quickstarts/GremlinIntroduction.ipynb
 
-GREMLIN_ENDPOINT = env["GREMLIN_ENDPOINT"]
-GREMLIN_KEY = env["GREMLIN_KEY"]
-GREMLIN_DB = env["GREMLIN_DB"]
-GREMLIN_GRAPH = env["GREMLIN_GRAPH"]
+# read when the first client is opened (see GremlinPool), so the module can
+# be imported without a .env
+GREMLIN_ENDPOINT = env.get("GREMLIN_ENDPOINT")
+GREMLIN_KEY = env.get("GREMLIN_KEY")
+GREMLIN_DB = env.get("GREMLIN_DB")
+GREMLIN_GRAPH = env.get("GREMLIN_GRAPH")
 ENGLISH_PARTITION = "en"
 PARTITION_KEY = "lang"
+# seconds between websocket pings, so idle connections are kept open (and
+# dead ones are noticed) instead of failing on the next query
+GREMLIN_HEARTBEAT = 30
+
+# errors that mean the connection (not the query) is broken
+gremlin_connection_errors = (
+    OSError,
+    RuntimeError,
+    asyncio.TimeoutError,
+    aiohttp.ClientError,
+)
 
 
 def gremlin_client(
     db=GREMLIN_DB,
     graph=GREMLIN_GRAPH,
+    pool_size=None,
+    heartbeat=GREMLIN_HEARTBEAT,
 ):
     "Spins up a gremlin client for the graph db"
     return gremlin.Client(
@@ -84,11 +106,116 @@ def gremlin_client(
         username=f"/dbs/{db}/colls/{graph}",
         password=GREMLIN_KEY,
         message_serializer=serializer.GraphSONSerializersV2d0(),
+        pool_size=pool_size,
+        transport_factory=lambda: AiohttpTransport(heartbeat=heartbeat),
         # headers={'MaxContentLength': "1000000"}
     )
 
 
-client_gremlin = gremlin_client()
+class GremlinPool:
+    """
+    A pool of pool_size connections to the graph db, shared by threads
+    and coroutines:
+        - the client is only opened on first use (and warmed up: every
+          connection runs a trivial query, so the first real queries don't
+          pay for the handshake)
+        - a query that fails because its connection went stale reopens the
+          client and is retried
+        - `execute` blocks (and is thread-safe), `execute_async` awaits the
+          same client without blocking the event loop, so many queries can
+          be in flight over a few sockets
+        - `submitAsync` has the `gremlin.Client` signature, so a pool can be
+          used wherever a client is expected
+    """
+
+    def __init__(self, pool_size=gremlin_pool_size, warm_up=True, **client_kwargs):
+        self.pool_size = pool_size
+        self.warm_up = warm_up
+        self.client_kwargs = client_kwargs
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = gremlin_client(
+                    pool_size=self.pool_size, **self.client_kwargs)
+                if self.warm_up:
+                    self._warm_up(self._client)
+            return self._client
+
+    def _warm_up(self, client):
+        futures = [client.submitAsync("g.inject(0)")
+                   for _ in range(self.pool_size)]
+        for future in futures:
+            try:
+                future.result().all().result()
+            except Exception as e:
+                print(f"🔥 Gremlin warm up failed: {e}")
+
+    def reset(self, client=None):
+        """
+        Close the client (only if it is still `client`, when given), so the
+        next query opens a new one
+        """
+        with self._lock:
+            if self._client is None or (client is not None and client is not self._client):
+                return
+            stale, self._client = self._client, None
+        try:
+            stale.close()
+        except Exception:
+            pass
+
+    def close(self):
+        self.reset()
+
+    def submitAsync(self, message, bindings=None, request_options=None):
+        client = self.client
+        try:
+            return client.submitAsync(
+                message, bindings=bindings, request_options=request_options)
+        except gremlin_connection_errors:
+            self.reset(client)
+            return self.client.submitAsync(
+                message, bindings=bindings, request_options=request_options)
+
+    def execute(self, query, bindings=None, retries=1):
+        """
+        Execute a query and return all of its results (blocking)
+        """
+        for attempt in range(retries + 1):
+            client = self.client
+            try:
+                return client.submitAsync(
+                    query, bindings=bindings).result().all().result()
+            except gremlin_connection_errors:
+                if attempt == retries:
+                    raise
+                self.reset(client)
+
+    async def execute_async(self, query, bindings=None, retries=1):
+        """
+        Execute a query and return all of its results (awaitable)
+        """
+        for attempt in range(retries + 1):
+            client = await asyncio.to_thread(lambda: self.client)
+            try:
+                # submitAsync blocks until a connection is free, so with more
+                # than pool_size queries in flight it must not run on the loop
+                future = await asyncio.to_thread(
+                    client.submitAsync, query, bindings=bindings)
+                result_set = await asyncio.wrap_future(future)
+                return await asyncio.wrap_future(result_set.all())
+            except gremlin_connection_errors:
+                if attempt == retries:
+                    raise
+                self.reset(client)
+
+
+# opened on first use
+gremlin_pool = GremlinPool()
 
 gremlin_error_codes = {
     400: 'Gremlin Query Compilation Error',
@@ -104,24 +231,65 @@ query_options = {
 }
 
 
+def id_bindings(ids, prefix="_id"):
+    """
+    Bindings for a list of ids, e.g., for `g.V(_id0, _id1)`:
+
+    returns ("_id0, _id1", {"_id0": "a", "_id1": "b"})
+    """
+    bindings = {f"{prefix}{i}": x for i, x in enumerate(ids)}
+    return ", ".join(bindings), bindings
+
+
 def exec_gremlin(
     query_string,
-    client=client_gremlin
+    bindings=None,
+    client=None
 ):
-    "Executes a gremlin query (async) on the graph db and returns the result"
+    """
+    Executes a gremlin query (async) on the graph db and returns the result
+
+    Values should be passed as bindings (variables in the query string) and
+    not inlined, so the server can cache the compiled query and no escaping
+    is needed:
+    ```python
+    exec_gremlin("g.V(_id).out(_relation)", {"_id": "...", "_relation": "parent"})
+    ```
+
+    client is a GremlinPool (the shared `gremlin_pool` by default); the call
+    is thread-safe, see `exec_gremlin_async` for coroutines
+    """
+    pool = client or gremlin_pool
     try:
-        callback = client.submitAsync(
-            query_string,
-            # request_options=query_options
-        )
-        if callback.result() is not None:
-            return callback.result().one()
+        return pool.execute(query_string, bindings)
+    except GremlinServerError as ex:
+        report_gremlin_error(ex, query_string)
+
+
+async def exec_gremlin_async(
+    query_string,
+    bindings=None,
+    client=None
+):
+    """
+    Awaitable `exec_gremlin`, e.g., to overlap many queries:
+    ```python
+    await asyncio.gather(*(exec_gremlin_async(q, b) for q, b in queries))
+    ```
+    """
+    pool = client or gremlin_pool
+    try:
+        return await pool.execute_async(query_string, bindings)
     except GremlinServerError as ex:
-        status = ex.status_attributes['x-ms-status-code']
-        print(f'There was an exception: {status}')
-        print(f'🔥 Problem with this query: 🔥 \n\n{query_string}\n\n')
-        print(gremlin_error_codes.get(status, 'Unknown error'))
-        print(ex)
+        report_gremlin_error(ex, query_string)
+
+
+def report_gremlin_error(ex, query_string):
+    status = ex.status_attributes['x-ms-status-code']
+    print(f'There was an exception: {status}')
+    print(f'🔥 Problem with this query: 🔥 \n\n{query_string}\n\n')
+    print(gremlin_error_codes.get(status, 'Unknown error'))
+    print(ex)
 
 #    Yb  dP 8888
 #     YbdP  8www
@@ -226,6 +394,39 @@ jargon = {
     "count": ".count()",
 }
 
+# in-memory graph (see `fns.local_graph.LocalGraph`) that answers the
+# graph_get_* queries instead of the graph db, when set by use_local_graph
+local_graph = None
+
+
+def use_local_graph(graph=None):
+    """
+    Answer the graph_get_* queries from an in-memory graph (e.g.,
+    `LocalGraph.from_export(...)`), or from the graph db again with None.
+    Writes (upsert_*, prune) still go to the graph db, apply them to the
+    local graph with `LocalGraph.add_plan`.
+    """
+    global local_graph
+    local_graph = graph
+    graph_cache.clear()
+    return graph
+
+
+# read-through cache of the graph_get_* queries (but graph_get_mean, which
+# samples), invalidated by upsert_node, upsert_edges and prune, see
+# `graph_cache.stats()` for the hit rate
+graph_cache = GraphCache(graph_cache_size, graph_cache_ttl)
+
+
+def cached_read(key, query, ids=None):
+    """
+    Read through `graph_cache` (a local graph is queried directly)
+    """
+    if local_graph is not None:
+        return query()
+    return graph_cache.fetch(key, query, ids)
+
+
 graph_queries = {
     "get_vertex_count_by_label": {
         "query": "g.V().group().by('label').by(count())",
@@ -247,16 +448,18 @@ def graph_get_mean(
     """
     Gets the mean links of a sample number of nodes in the graph db
     """
+    if local_graph is not None:
+        return local_graph.get_mean(sample, direction)
     _dir = jargon[direction]
     query = (
-        f"g.V().sample({sample})",
+        "g.V().sample(_sample)",
         ".project('vertex', 'links')",
         f".by({_dir}().count())",
         ".map(select('links'))",
         ".mean()"
     )
     query = "".join(query)
-    return exec_gremlin(query)
+    return exec_gremlin(query, {"_sample": sample})
 
 
 def graph_get_most_connected(
@@ -267,28 +470,38 @@ def graph_get_most_connected(
     """
     From a list of node ids, returns the node with the most connections
     """
-    _dir = jargon[direction]
-
-    ids = ", ".join([f'"{id}"' for id in node_ids])
-    query = (
-        f"g.V().hasId({ids})",
-        ".project('vertex', 'degree')",
-        ".by()",
-        f".by({_dir}().count())",
-        ".order().by(select('degree'), decr)",
-    ) + ((
-        ".limit(1)",
-        ".select('vertex')"
-    ) if pop else ())
-
-    query = "".join(query)
-    print(f"graph_get_most_connected Query: {query}")
+    def run():
+        if local_graph is not None:
+            results = local_graph.get_most_connected(node_ids, direction, pop)
+        else:
+            _dir = jargon[direction]
+
+            ids, bindings = id_bindings(node_ids)
+            query = (
+                f"g.V().hasId({ids})",
+                ".project('vertex', 'degree')",
+                ".by()",
+                f".by({_dir}().count())",
+                ".order().by(select('degree'), decr)",
+            ) + ((
+                ".limit(1)",
+                ".select('vertex')"
+            ) if pop else ())
+
+            query = "".join(query)
+            print(f"graph_get_most_connected Query: {query}")
+
+            results = exec_gremlin(query, bindings)
+        if pop or results is None:
+            return results
+        else:
+            return {result["vertex"]["id"]: result["degree"] for result in results}
 
-    results = exec_gremlin(query)
-    if pop:
-        return results
-    else:
-        return {result["vertex"]["id"]: result["degree"] for result in results}
+    return cached_read(
+        ("most_connected", id_key(node_ids), direction, pop),
+        run,
+        lambda _: node_ids,
+    )
 
 
 def graph_get_connections(
@@ -299,20 +512,29 @@ def graph_get_connections(
     """
     From a list of node ids, returns the node with the most connections
     """
-    _dir = jargon[direction]
-    _stat = jargon[stat] if stat else ""
+    def run():
+        if local_graph is not None:
+            return local_graph.get_connections(node_ids, direction, stat)
+        _dir = jargon[direction]
+        _stat = jargon[stat] if stat else ""
 
-    ids = ", ".join([f'"{id}"' for id in node_ids])
-    query = (
-        f"g.V().hasId({ids})",
-        ".project('vertex', 'degree')",
-        f".by({_dir}().count())",
-        ".select('degree')",
-        _stat
+        ids, bindings = id_bindings(node_ids)
+        query = (
+            f"g.V().hasId({ids})",
+            ".project('vertex', 'degree')",
+            f".by({_dir}().count())",
+            ".select('degree')",
+            _stat
+        )
+        query = "".join(query)
+        print(f"graph_get_connections Query: {query}")
+        return exec_gremlin(query, bindings)
+
+    return cached_read(
+        ("connections", id_key(node_ids), direction, stat),
+        run,
+        lambda _: node_ids,
     )
-    query = "".join(query)
-    print(f"graph_get_connections Query: {query}")
-    return exec_gremlin(query)
 
 
 def graph_get_in_common(
@@ -320,21 +542,30 @@ def graph_get_in_common(
     """
     Gets the nodes that are in common between a list of nodes (exclusive of provided nodes)
     """
-    provided = ", ".join([f'"{id}"' for id in nodes_ids])
-    query = (
-        f"g.V({provided})",
-        ".aggregate('provided')",
-        ".both()",
-        ".where(without('provided'))",  # only nodes not in provided
-        ".groupCount()",
-        # ".order(local)",
-        # ".by(values, decr)",
-        # ".limit(1)",
-        # ".select(keys)"
+    def run():
+        if local_graph is not None:
+            return local_graph.get_in_common(nodes_ids)
+        provided, bindings = id_bindings(nodes_ids)
+        query = (
+            f"g.V({provided})",
+            ".aggregate('provided')",
+            ".both()",
+            ".where(without('provided'))",  # only nodes not in provided
+            ".groupCount()",
+            # ".order(local)",
+            # ".by(values, decr)",
+            # ".limit(1)",
+            # ".select(keys)"
+        )
+        query = "".join(query)
+        print(f"graph_get_in_common Query: {query}")
+        return exec_gremlin(query, bindings)
+
+    return cached_read(
+        ("in_common", id_key(nodes_ids)),
+        run,
+        lambda x: [*nodes_ids, *(k for counts in x for k in counts)],
     )
-    query = "".join(query)
-    print(f"graph_get_in_common Query: {query}")
-    return exec_gremlin(query)
 
 
 def graph_get_connected(
@@ -351,16 +582,27 @@ def graph_get_connected(
     graph_get_connected("COSMyEnterprise:en:Taxpayers:0", "child")
     ```
     """
-    query = f"g.V('{node_id}').{direction}('{relation}')"
-
-    if prop_tuple:
-        query += f".has('{prop_tuple[0]}', '{prop_tuple[1]}')"
-
-    query += ".tree()"
-
-    print(f"graph_get_connected Query: {query}")
-    results = exec_gremlin(query)
-    return results
+    def run():
+        if local_graph is not None:
+            return local_graph.get_connected(node_id, relation, prop_tuple, direction)
+        query = f"g.V(_id).{direction}(_relation)"
+        bindings = {"_id": node_id, "_relation": relation}
+
+        if prop_tuple:
+            query += ".has(_key, _value)"
+            bindings.update({"_key": prop_tuple[0], "_value": prop_tuple[1]})
+
+        query += ".tree()"
+
+        print(f"graph_get_connected Query: {query}")
+        return exec_gremlin(query, bindings)
+
+    return cached_read(
+        ("connected", node_id, relation,
+         tuple(prop_tuple) if prop_tuple else None, direction),
+        run,
+        lambda x: [node_id, *vertex_ids(x)],
+    )
 
 
 def graph_get_chunk_by_parent(
@@ -394,36 +636,43 @@ def upsert_edges(
     "g.V('Rimma').addE('knows').from(g.V('Andrew'))"
 
     only upsert if non-existant (idempotent)
+
+    with execute=False, returns the (query, bindings) to execute instead
+    (and the caller invalidates `graph_cache` once they are executed)
     """
     results = []
     if rel_to:
         query = (
-            f"g.V('{from_id}').coalesce(",
-            f"outE('{rel_to}').where(inV().hasId('{to_id}')),",
-            f"addE('{rel_to}').from(__.V('{from_id}')).to(__.V('{to_id}'))",
+            "g.V(_from).coalesce(",
+            "outE(_rel).where(inV().hasId(_to)),",
+            "addE(_rel).from(__.V(_from)).to(__.V(_to))",
             ")"
         )
         q1 = "".join(query)
+        b1 = {"_from": from_id, "_to": to_id, "_rel": rel_to}
         # q1 = f"g.V('{from_id}').addE('{rel_to}').to(g.V('{to_id}'))"
         if execute:
-            r1 = exec_gremlin(q1)
+            r1 = exec_gremlin(q1, b1)
             results.append(r1)
         else:
-            results.append(q1)
+            results.append((q1, b1))
     if rel_from:
         query = (
-            f"g.V('{to_id}').coalesce(",
-            f"outE('{rel_from}').where(inV().hasId('{from_id}')),",
-            f"addE('{rel_from}').to(__.V('{from_id}')).from(__.V('{to_id}'))",
+            "g.V(_to).coalesce(",
+            "outE(_rel).where(inV().hasId(_from)),",
+            "addE(_rel).to(__.V(_from)).from(__.V(_to))",
             ")"
         )
         q2 = "".join(query)
+        b2 = {"_from": from_id, "_to": to_id, "_rel": rel_from}
         # q2 = f"g.V('{to_id}').addE('{rel_from}').from(g.V('{from_id}'))"
         if execute:
-            r2 = exec_gremlin(q2)
+            r2 = exec_gremlin(q2, b2)
             results.append(r2)
         else:
-            results.append(q2)
+            results.append((q2, b2))
+    if execute:
+        graph_cache.invalidate([from_id, to_id])
     return results
 
 # create enum for node type: publication, topic, chunk
@@ -453,33 +702,40 @@ def upsert_node(
 
     only upsert if non-existent (idempotent):
     https://stackoverflow.com/a/50354351
+
+    with execute=False, returns the [(query, bindings)] to execute instead
+    (and the caller invalidates `graph_cache` once they are executed)
     """
     if properties is None:
         properties = {}
 
-    def handle_primitive(value):
-        if isinstance(value, str):
-            return f"'{value}'"
-        return value
-
     message = (
-        f"g.V().hasId('{node_id}').fold()",
+        "g.V().hasId(_id).fold()",
         ".coalesce(unfold(),",
-        f"addV('{node_type}')",
-        f".property('id', '{node_id}')",
-        f".property('{partition_key}', '{partition}')",
+        "addV(_label)",
+        ".property('id', _id)",
+        ".property(_pk, _pv)",
         ")",
-        * (f".property('{k}', {handle_primitive(v)})" for k,
-           v in properties.items()),
+        * (f".property(_k{i}, _v{i})" for i in range(len(properties))),
     )
 
     message = "".join(message)
+    bindings = {
+        "_id": node_id,
+        "_label": node_type.value if isinstance(node_type, NodeType) else node_type,
+        "_pk": partition_key,
+        "_pv": partition,
+    }
+    for i, (k, v) in enumerate(properties.items()):
+        bindings[f"_k{i}"] = k
+        bindings[f"_v{i}"] = v
 
     if execute:
-        result = exec_gremlin(message)
+        result = exec_gremlin(message, bindings)
+        graph_cache.invalidate([node_id])
         return result
     else:
-        return [message]
+        return [(message, bindings)]
 
 # === DELETE ===
 
@@ -488,54 +744,43 @@ def gather_connections(node_id, relation="knows"):
     """
     Gathers all connections of a node in the graph db by their relation
     """
-    query = f"g.V('{node_id}').out('{relation}')"
-    results = exec_gremlin(query)
+    query = "g.V(_id).out(_relation)"
+    results = exec_gremlin(query, {"_id": node_id, "_relation": relation})
     return results
 
 
 def machiavelli(
     node_id,
     relation="parent",
-    results=None
+    max_depth=None
 ):
     """
     Gathers all decendants of a node in the graph db by their relation
-    (recursive)
+    (one traversal, see `fns.graph.descendant_ids`), as [{"id": ...}],
+    shallowest first
     """
-    if results is None:
-        results = []
-
-    children = gather_connections(node_id, relation)
-    results.extend(children)
-    if len(children) > 0:
-        for child in children:
-            machiavelli(child["id"], relation, results)
-    return results
+    # fns.graph builds on this module
+    from .graph import descendant_ids
+
+    return [{"id": x} for x in descendant_ids([node_id], relation, max_depth)]
 
 
-def prune(node_id, relation="parent", inclusive=True):
+def prune(node_id, relation="parent", inclusive=True, batch_size=100, max_depth=None):
     """
     🔥 use with caution 🔥
 
-    Deletes a subgraph of decendant nodes by targeting a progenitor node 
-
-    (will include the progenitor node itself if inclusive=True)
-
-    Gathers all decendants and deletes them
-
-    Source: https://stackoverflow.com/a/45243153
+    Deletes a subgraph of decendant nodes by targeting a progenitor node
+    (see `fns.graph.prune`)
     """
-    decendants = machiavelli(node_id, relation)
-
-    targets = [node["id"] for node in decendants]
-    if inclusive:
-        targets.append(node_id)
-
-    quoted = [f"'{target}'" for target in targets]
+    from .graph import prune as prune_subgraph
 
-    query = f"g.V().hasId({', '.join(quoted)}).drop()"
-
-    return exec_gremlin(query)
+    return prune_subgraph(
+        node_id,
+        relation,
+        inclusive=inclusive,
+        batch_size=batch_size,
+        max_depth=max_depth,
+    )
 
 #      8
 # 88b. 8 .d88 8d8b. 8d8b. .d88b 8d8b
@@ -608,128 +853,68 @@ def spawn_plan(
     }
     ```
 
-    and generates a plan of queries to execute, e.g.:
-
-    ```json
-    {
-        "gremlin": { "vertices": [], "edges": [] }
-        "vector": [{ ...vector store args ...}], list[dict]
-        "kv": [{ ...kv store args ...}], list[dict]
-    }
+    and adds the vertices and edges for the article, its chunks and the
+    topics they link to into a plan (a new one if plan is None):
 
+    ```python
+    GraphPlan(
+        vertices={"<id>": {"label": "topic", "properties": {...}}},
+        edges={("<from_id>", "parent", "<to_id>")},
+    )
     ```
+
+    the plan is only rendered to gremlin queries when it is executed (see
+    `fns.graph.execute_plan`)
     """
     if plan is None:
-        plan = {
-            "gremlin": {"vertices": [], "edges": []},
-            "vector": [],
-            "kv": []
-        }
+        plan = GraphPlan()
     meta = pluck_xf(metadata)
 
     path = from_id.split(":")
 
-    vertices = []
-    edges = []
     pub_id = None
     if len(path) > 2:
         # full article path
         pub_id = path[0]
-        topic_id = path[2]
         # create a link between the publication and the topic
-        edge = upsert_edges(
-            from_id=pub_id,
-            to_id=from_id,
-            rel_to="parent",
-            rel_from="child",
-            execute=False
-        )
-        edges.extend(edge)
+        plan.add_edge(pub_id, "parent", from_id)
+        plan.add_edge(from_id, "child", pub_id)
     else:
         # just a publication id
         pub_id = from_id
 
-    pub_node = upsert_node(
-        node_id=pub_id,
-        node_type="publication",
-        properties=meta,  # no properties for now
-        execute=False
-    )
-    vertices.extend(pub_node)
+    plan.add_vertex(pub_id, "publication", meta)
     # handle node generation first
     topic = digest["chunks"]
     # create a node for the article
-    topic_node = upsert_node(
-        node_id=from_id,
-        node_type="topic",
-        properties=meta,
-        execute=False
-    )
-    vertices.extend(topic_node)
+    plan.add_vertex(from_id, "topic", meta)
     for i, chunk in enumerate(topic):
         chunk_id = f"{from_id}:{i}"
         chunk_properties = {
             **meta,
-            "title": no_special_chars(chunk["title"]),
-            "heading": no_special_chars(chunk["heading"]),
+            "title": chunk["title"],
+            "heading": chunk["heading"],
             # TODO: store this in a KV store instead
-            "md": no_special_chars(chunk["md"]),
+            "md": chunk["md"],
             "order": i
         }
-        chunk_node = upsert_node(
-            node_id=chunk_id,
-            node_type="chunk",
-            properties=chunk_properties,
-            execute=False
-        )
-        vertices.extend(chunk_node)
-        chunk_links = chunk["links"]
+        plan.add_vertex(chunk_id, "chunk", chunk_properties)
         # create parent:child relationships between chunks and topic
-        topic_chunk_edges = upsert_edges(
-            from_id=from_id,
-            to_id=chunk_id,
-            rel_to="parent",
-            rel_from="child",
-            execute=False
-        )
-        edges.extend(topic_chunk_edges)
-        for link in chunk_links:
-            # append to links list
+        plan.add_edge(from_id, "parent", chunk_id)
+        plan.add_edge(chunk_id, "child", from_id)
+        for link in chunk["links"]:
             topic_id = f"{link['publication']}:{lang}:{link['topic']}"
-            chunk_topic_edges = upsert_edges(
-                from_id=chunk_id,
-                to_id=topic_id,
-                rel_to="related",
-                execute=False
-            )
-            edges.extend(chunk_topic_edges)
-            chunk_topic_node = upsert_node(
-                node_id=topic_id,
-                node_type="topic",
-                execute=False
-            )
-            vertices.extend(chunk_topic_node)
+            plan.add_edge(chunk_id, "related", topic_id)
+            # create node stubs for related articles
+            plan.add_vertex(topic_id, "topic")
 
     article_links = digest["links"]
     for link in article_links:
         if link['topic']:
             topic_id = f"{link['publication']}:{lang}:{link['topic']}"
-            article_article_links = upsert_edges(
-                from_id=from_id,
-                to_id=topic_id,
-                rel_to="related",
-                execute=False
-            )
-            edges.extend(article_article_links)
+            plan.add_edge(from_id, "related", topic_id)
             # create node stubs for related articles
-            topic_node = upsert_node(
-                node_id=topic_id,
-                node_type="topic",
-                execute=False
-            )
-            vertices.extend(topic_node)
-    plan["gremlin"]["vertices"].extend(vertices)
-    plan["gremlin"]["edges"].extend(edges)
+            plan.add_vertex(topic_id, "topic")
     # TODO: handle vector generation third
     # TODO: handle kv generation last
     return plan
@@ -754,12 +939,16 @@ def write_file(path, data, encoding='utf-8'):
         - if the path is remote, the blob will be stored as 
             - container: the first part of the path (e.g. 'benchmarks')
             - file_path: the rest of the path (e.g. 'file.txt')
-    param data: the data to write to the file
+    param data: the data to write to the file (str, or bytes for binary files)
 
     """
     if config.get('isLocal'):
         _dir = os.path.dirname(path)
         Path(_dir).mkdir(parents=True, exist_ok=True)
+        if isinstance(data, bytes):
+            with open(path, 'wb') as f:
+                f.write(data)
+            return
         with open(path, 'w', encoding=encoding) as f:
             f.write(data)
     else:
@@ -782,7 +971,7 @@ def write_file(path, data, encoding='utf-8'):
             overwrite=True)
 
 
-def read_file(path):
+def read_file(path, binary=False):
     """
     Reads a file from either local storage or Azure Blob Storage.
     param path: the path to the file (e.g. 'benchmarks/file.txt')
@@ -790,8 +979,12 @@ def read_file(path):
         - if the path is remote, the blob will be downloaded from 
             - container: the first part of the path (e.g. 'benchmarks')
             - file_path: the rest of the path (e.g. 'file.txt')
+    param binary: return bytes instead of (utf-8 decoded) text
     """
     if config.get('isLocal'):
+        if binary:
+            with open(path, 'rb') as f:
+                return f.read()
         with open(path, 'r', encoding='utf-8') as f:
             return f.read()
     else:
@@ -805,7 +998,8 @@ def read_file(path):
         blob_client = blob_service_client.get_blob_client(
             container_name, file_path)
         try:
-            return blob_client.download_blob().readall().decode('utf-8')
+            data = blob_client.download_blob().readall()
+            return data if binary else data.decode('utf-8')
         except ResourceNotFoundError:
             print(f"Error downloading blob: {path}")
             raise
@@ -820,8 +1014,18 @@ def read_file(path):
 #                   Y8""8D
 
 
-VECTOR_STORE_URL = get_secret("primary-search-service-base-url")
-VECTOR_STORE_API_KEY = get_secret("primary-search-service-secondary-key")
+@functools.cache
+def vector_store_credentials():
+    """
+    The search service (base url, api key), read from the key vault on first
+    use, so importing this module needs no network
+    """
+    return (
+        get_secret("primary-search-service-base-url"),
+        get_secret("primary-search-service-secondary-key"),
+    )
+
+
 ALGO_CONFIG_NAME = "HNSW-NVM"
 ALL_O_SERIES = "product/any(p: p eq 'O Series Cloud' or p eq 'O Series On-Premise' or p eq 'O Series On Demand')"
 COLLECTIONS = {
@@ -1049,7 +1253,8 @@ def create_index(
     """
 
     # ?{index_name}"  # ?api-version={api_version}&allowIndexDowntime=true"
-    base_url = f"{VECTOR_STORE_URL}/indexes"
+    vector_store_url, vector_store_api_key = vector_store_credentials()
+    base_url = f"{vector_store_url}/indexes"
     params = {"api-version": api_version, "allowIndexDowntime": "true"}
 
     [*values] = api_version.split("-")
@@ -1061,7 +1266,7 @@ def create_index(
 
     headers = {
         "Content-Type": "application/json",
-        "api-key": VECTOR_STORE_API_KEY,
+        "api-key": vector_store_api_key,
     }
 
     print("vector store url:", base_url)
@@ -1221,11 +1426,12 @@ def delete_index(index_name=search_index_name, api_version=search_api_version):
     """
     uses the requests library to make a call to the azure search api to delete an index
     """
-    base_url = f"{VECTOR_STORE_URL}/indexes/{index_name}"
+    vector_store_url, vector_store_api_key = vector_store_credentials()
+    base_url = f"{vector_store_url}/indexes/{index_name}"
     params = {"api-version": api_version, "allowIndexDowntime": "true"}
     headers = {
         "Content-Type": "application/json",
-        "api-key": VECTOR_STORE_API_KEY,
+        "api-key": vector_store_api_key,
     }
     response = requests.delete(
         base_url, headers=headers, params=params, timeout=60)
@@ -1233,6 +1439,22 @@ def delete_index(index_name=search_index_name, api_version=search_api_version):
     return response
 
 
+def index_exists(index_name=search_index_name, api_version=search_api_version):
+    """
+    uses the requests library to check whether an index exists in the azure search api
+    """
+    vector_store_url, vector_store_api_key = vector_store_credentials()
+    base_url = f"{vector_store_url}/indexes/{index_name}"
+    params = {"api-version": api_version}
+    headers = {
+        "Content-Type": "application/json",
+        "api-key": vector_store_api_key,
+    }
+    response = requests.get(
+        base_url, headers=headers, params=params, timeout=60)
+    return response.status_code == 200
+
+
 sc_name = "baseline_scoring_profile"
 # weights can be updated without recreating the index
 # via API:
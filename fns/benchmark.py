@@ -0,0 +1,213 @@
+"""
+Offline ingestion benchmark
+
+Runs local publication zips (fixtures) through the same parsing, chunking
+and embedding path as `fns.main.download_publication`, with a deterministic
+fake embedding function in place of Azure OpenAI, and compares the
+throughput with a stored baseline to catch regressions in the chunking and
+HTML hot paths.
+
+Secrets are only read from the key vault when a service is first called,
+so the benchmark runs without credentials or network (tiktoken's encoding
+must be cached locally, see TIKTOKEN_CACHE_DIR).
+
+example:
+```python
+from fns.benchmark import benchmark_ingestion
+
+results = benchmark_ingestion("downloads/2023-12-29")
+results["regressions"]  # [] when nothing is slower than the baseline
+```
+"""
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+from .main import process_publication, read_fixture, search_index_name
+from .metrics import StageReport, print_report, reporting, stage
+from .openai_fns import count_tokens
+
+baseline_path = "benchmarks/ingestion-baseline.json"
+
+# throughput metrics (higher is better) and resource metrics (lower is better)
+rate_metrics = ["topics_per_second", "chunks_per_second", "tokens_per_second"]
+cost_metrics = ["peak_rss_mb"]
+
+
+def fake_embeddings(texts, dims=1536):
+    """
+    Deterministic stand-in for `get_embeddings_batch`: each text is hashed
+    into the seed of a unit vector, so equal texts get equal vectors and no
+    request leaves the machine
+    """
+    vectors = []
+    for text in texts:
+        seed = int.from_bytes(hashlib.sha256(
+            text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(dims)
+        vectors.append((vector / np.linalg.norm(vector)).astype(np.float32).tolist())
+    return vectors
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process so far, in MB (None where it
+    can't be read, e.g., on Windows)
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def benchmark_publication(zip_filename, embed_fn=fake_embeddings, report=None):
+    """
+    Parse, chunk and (fake) embed a single fixture zip
+
+    returns the counts for the publication
+    """
+    if report is None:
+        report = StageReport(os.path.basename(zip_filename))
+
+    with reporting(report):
+        zip_file, pub_meta = read_fixture(zip_filename)
+        with stage("topics") as counts:
+            chunks, topics = process_publication(
+                zip_file=zip_file,
+                publication_metadata=pub_meta,
+                debug=False,
+            )
+            counts["items"] = topics
+        texts = [chunk.page_content for chunk in chunks]
+        tokens = sum(count_tokens(text) for text in texts)
+        with stage("embed", items=len(texts), tokens=tokens):
+            embed_fn(texts)
+
+    return {
+        "publication": pub_meta["publication_name"],
+        "topics": topics,
+        "chunks": len(chunks),
+        "tokens": tokens,
+    }
+
+
+def compare_to_baseline(metrics, baseline, tolerance=0.2):
+    """
+    List the metrics that are worse than the baseline by more than
+    `tolerance` (a fraction of the baseline value), skipping the metrics
+    that could not be measured on either side
+    """
+    regressions = []
+    for name in rate_metrics:
+        if metrics.get(name) is None:
+            continue
+        if baseline.get(name) and metrics[name] < baseline[name] * (1 - tolerance):
+            regressions.append(
+                {"metric": name, "baseline": baseline[name], "current": metrics[name]})
+    for name in cost_metrics:
+        if metrics.get(name) is None:
+            continue
+        if baseline.get(name) and metrics[name] > baseline[name] * (1 + tolerance):
+            regressions.append(
+                {"metric": name, "baseline": baseline[name], "current": metrics[name]})
+    return regressions
+
+
+def benchmark_ingestion(
+    fixtures_dir=os.path.join("downloads", search_index_name),
+    baseline=baseline_path,
+    tolerance=0.2,
+    update_baseline=False,
+    embed_fn=fake_embeddings,
+):
+    """
+    Benchmark every `*.zip` in fixtures_dir and compare the throughput with
+    the baseline JSON (written instead when update_baseline=True or when it
+    does not exist yet)
+
+    returns:
+    ```json
+    {
+        "metrics": {"topics_per_second": ..., "chunks_per_second": ...,
+                    "tokens_per_second": ..., "peak_rss_mb": ..., ...},
+        "publications": [{"publication": "...", "topics": 12, ...}],
+        "report": {...per stage timing, see fns.metrics...},
+        "baseline": {...} | None,
+        "regressions": [{"metric": "...", "baseline": ..., "current": ...}]
+    }
+    ```
+    """
+    fixtures = sorted(glob.glob(os.path.join(fixtures_dir, "*.zip")))
+    if not fixtures:
+        raise ValueError(f"No fixture zips found in {fixtures_dir}")
+
+    report = StageReport("benchmark")
+    publications = []
+    start = time.perf_counter()
+    for zip_filename in fixtures:
+        publications.append(benchmark_publication(
+            zip_filename, embed_fn=embed_fn, report=report))
+    seconds = time.perf_counter() - start
+
+    topics = sum(x["topics"] for x in publications)
+    chunks = sum(x["chunks"] for x in publications)
+    tokens = sum(x["tokens"] for x in publications)
+    metrics = {
+        "fixtures": len(fixtures),
+        "seconds": seconds,
+        "topics": topics,
+        "chunks": chunks,
+        "tokens": tokens,
+        "topics_per_second": topics / seconds,
+        "chunks_per_second": chunks / seconds,
+        "tokens_per_second": tokens / seconds,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+    previous = None
+    if os.path.exists(baseline):
+        with open(baseline, encoding="utf-8") as f:
+            previous = json.load(f)
+
+    regressions = compare_to_baseline(
+        metrics, previous, tolerance) if previous else []
+
+    if update_baseline or previous is None:
+        Path(os.path.dirname(baseline) or ".").mkdir(
+            parents=True, exist_ok=True)
+        with open(baseline, "w", encoding="utf-8") as f:
+            json.dump(metrics, f, indent=2)
+        print(f"📏 Wrote baseline to {baseline}")
+
+    print_report(report.to_dict())
+    for name in rate_metrics + cost_metrics:
+        if metrics[name] is None:
+            print(f"{name:>18}: n/a")
+            continue
+        print(f"{name:>18}: {metrics[name]:.2f}" + (
+            f" (baseline {previous[name]:.2f})" if previous and previous.get(name) is not None else ""))
+    for regression in regressions:
+        print(
+            f"🔥 Regression in {regression['metric']}: {regression['current']:.2f} vs {regression['baseline']:.2f}")
+
+    return {
+        "metrics": metrics,
+        "publications": publications,
+        "report": report.to_dict(),
+        "baseline": previous,
+        "regressions": regressions,
+    }
@@ -0,0 +1,206 @@
+import atexit
+import hashlib
+import json
+import os
+import threading
+
+from pathlib import Path
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    Persistent, content-addressed cache of embedding vectors
+
+    Vectors are keyed by sha256(namespace + text), where the namespace is
+    the embedding model/deployment (or a function returning it, so it can
+    be looked up lazily), so switching models never serves stale vectors.
+    On disk:
+        - <directory>/vectors.f32: memory-mapped float32 matrix (slot x dims)
+        - <directory>/index.json: {"dims", "capacity", "entries": {key: [slot, last_used]}}
+
+    The capacity (number of slots) is derived from max_bytes once the vector
+    dimensions are known. When full, the least recently used ~10% of entries
+    are evicted, and the index is written before their slots are reused, so
+    the index on disk never maps a text to another text's vector.
+
+    The index is written every `flush_every` new vectors, on eviction, on
+    `flush` and at exit, not on every put.
+    """
+
+    def __init__(self, directory, max_bytes=1024 * 1024 * 1024, namespace="", flush_every=1000):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.namespace = namespace
+        self.flush_every = flush_every
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._dirty = False
+        self._vectors = None
+        self._dims = None
+        self._capacity = None
+        self._entries = {}
+        self._free = []
+        self._clock = 0
+        self._unflushed = 0
+        atexit.register(self.flush)
+
+    @property
+    def _index_path(self):
+        return os.path.join(self.directory, "index.json")
+
+    @property
+    def _vectors_path(self):
+        return os.path.join(self.directory, "vectors.f32")
+
+    def key(self, text):
+        """
+        The cache key for a text
+        """
+        namespace = self.namespace() if callable(self.namespace) else self.namespace
+        payload = f"{namespace}\0{text}".encode("utf-8")
+        return hashlib.sha256(payload).hexdigest()
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        if not os.path.exists(self._index_path) or not os.path.exists(self._vectors_path):
+            return
+        with open(self._index_path, encoding="utf-8") as f:
+            index = json.load(f)
+        self._open(index["dims"], index["capacity"])
+        self._entries = index["entries"]
+        used = {slot for slot, _ in self._entries.values()}
+        self._free = [x for x in range(self._capacity) if x not in used]
+        self._clock = max((t for _, t in self._entries.values()), default=0)
+
+    def _open(self, dims, capacity=None):
+        """
+        Map an existing vector file (capacity given) or create a new one
+        sized by max_bytes
+        """
+        fresh = capacity is None
+        self._dims = dims
+        self._capacity = capacity or max(1, self.max_bytes // (dims * 4))
+        if fresh:
+            Path(self.directory).mkdir(parents=True, exist_ok=True)
+            self._free = list(range(self._capacity))
+        self._vectors = np.memmap(
+            self._vectors_path,
+            dtype=np.float32,
+            mode="w+" if fresh else "r+",
+            shape=(self._capacity, dims),
+        )
+
+    def _evict(self):
+        count = max(1, self._capacity // 10)
+        lru = sorted(self._entries.items(), key=lambda x: x[1][1])[:count]
+        for key, _ in lru:
+            del self._entries[key]
+        self.evictions += len(lru)
+        self._dirty = True
+        # persist the index without the evicted entries before their slots
+        # are overwritten
+        self._flush()
+        self._free.extend(slot for _, (slot, _) in lru)
+
+    def get_many(self, texts):
+        """
+        Look up many texts, returning a vector (list) or None for each
+        """
+        with self._lock:
+            self._load()
+            results = []
+            for text in texts:
+                entry = self._entries.get(self.key(text))
+                if entry is None:
+                    self.misses += 1
+                    results.append(None)
+                    continue
+                self.hits += 1
+                self._clock += 1
+                entry[1] = self._clock
+                self._dirty = True
+                results.append(self._vectors[entry[0]].tolist())
+            return results
+
+    def get(self, text):
+        """
+        Look up a single text, returning its vector (list) or None
+        """
+        return self.get_many([text])[0]
+
+    def put_many(self, texts, vectors):
+        """
+        Store vectors for many texts
+        """
+        with self._lock:
+            self._load()
+            for text, vector in zip(texts, vectors):
+                if self._vectors is None:
+                    self._open(len(vector))
+                if len(vector) != self._dims:
+                    continue
+                key = self.key(text)
+                entry = self._entries.get(key)
+                if entry is None:
+                    if not self._free:
+                        self._evict()
+                    entry = [self._free.pop(), 0]
+                    self._entries[key] = entry
+                self._clock += 1
+                entry[1] = self._clock
+                self._vectors[entry[0]] = vector
+                self._dirty = True
+                self._unflushed += 1
+            if self._unflushed >= self.flush_every:
+                self._flush()
+
+    def put(self, text, vector):
+        """
+        Store the vector for a single text
+        """
+        self.put_many([text], [vector])
+
+    def flush(self):
+        """
+        Write the vectors and the index to disk
+        """
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if not self._dirty or self._vectors is None:
+            return
+        # vectors first, so the index never points at unwritten slots
+        self._vectors.flush()
+        index = {
+            "dims": self._dims,
+            "capacity": self._capacity,
+            "entries": self._entries,
+        }
+        tmp = self._index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tmp, self._index_path)
+        self._dirty = False
+        self._unflushed = 0
+
+    def stats(self):
+        """
+        Hit/miss counters for the cache
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "capacity": self._capacity,
+        }
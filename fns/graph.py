@@ -0,0 +1,696 @@
+import json
+import random
+import re
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from gremlin_python.driver.protocol import GremlinServerError
+
+from .azure_fns import (
+    GremlinPool,
+    gremlin_connection_errors,
+    gremlin_error_codes,
+    graph_cache,
+    id_bindings,
+    upsert_edges,
+    upsert_node,
+)
+from .metrics import current_report, run_reported, stage
+
+# queries in flight at once (and connections in the executor's client pool)
+gremlin_concurrency = 8
+# Cosmos statuses that mean "slow down and try again": request rate too
+# large, request timeout, concurrent write conflict
+retry_statuses = [429, 408, 449]
+# upserts packed into a single traversal (request), and its maximum length
+max_batch_statements = 50
+max_batch_chars = 60 * 1024
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def executor_client(pool_size=gremlin_concurrency):
+    """
+    A GremlinPool with one connection per query in flight (the client
+    blocks when all of its connections are busy), shared per size
+    """
+    with _clients_lock:
+        if pool_size not in _clients:
+            _clients[pool_size] = GremlinPool(pool_size=pool_size)
+        return _clients[pool_size]
+
+
+def parse_retry_after(value):
+    """
+    Seconds to wait from an `x-ms-retry-after-ms` header, which Cosmos sends
+    either as milliseconds ("13") or as a timespan ("00:00:00.0130000")
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return value / 1000
+    value = str(value)
+    if ":" in value:
+        hours, minutes, seconds = value.split(":")
+        return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    try:
+        return float(value) / 1000
+    except ValueError:
+        return None
+
+
+def request_charge(attributes):
+    """
+    RUs charged for a request, from its status attributes
+    """
+    try:
+        return float((attributes or {}).get("x-ms-total-request-charge", 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def submit_query(
+    query,
+    client=None,
+    retries=5,
+    backoff=0.5,
+    verbose=True,
+    bindings=None,
+):
+    """
+    Execute a gremlin query (with its bindings), retrying throttled (429)
+    and other transient failures, waiting `x-ms-retry-after-ms` when Cosmos
+    sends it and backing off exponentially (with jitter) otherwise
+
+    returns:
+    ```json
+    {
+        "query": "g.V()...",
+        "ok": true,
+        "status": 200,
+        "charge": 12.3,
+        "attempts": 1,
+        "result": [...]
+    }
+    ```
+    """
+    if client is None:
+        client = executor_client()
+    charge = 0.0
+    status = None
+    for attempt in range(retries + 1):
+        # the connections this attempt uses, to only reopen those if stale
+        opened = client.client if isinstance(client, GremlinPool) else None
+        try:
+            result_set = client.submitAsync(query, bindings=bindings).result()
+            result = result_set.all().result()
+            charge += request_charge(getattr(result_set, "status_attributes", {}))
+            return {
+                "query": query,
+                "ok": True,
+                "status": 200,
+                "charge": charge,
+                "attempts": attempt + 1,
+                "result": result,
+            }
+        except gremlin_connection_errors as ex:
+            # stale connection: reopen the pool and try again
+            status = type(ex).__name__
+            if attempt == retries:
+                print(f"🔥 Connection failed for this query ({status}): 🔥 \n\n{query}\n")
+                break
+            if opened is not None:
+                client.reset(opened)
+            continue
+        except GremlinServerError as ex:
+            attributes = ex.status_attributes or {}
+            status = attributes.get("x-ms-status-code", ex.status_code)
+            charge += request_charge(attributes)
+            if status not in retry_statuses or attempt == retries:
+                if not verbose:
+                    break
+                print(f"🔥 Problem with this query ({status}): 🔥 \n\n{query}\n{bindings}\n")
+                print(gremlin_error_codes.get(status, "Unknown error"))
+                break
+            wait = parse_retry_after(attributes.get("x-ms-retry-after-ms"))
+            if wait is None:
+                wait = backoff * (2 ** attempt) * (1 + random.random())
+            time.sleep(wait)
+    return {
+        "query": query,
+        "ok": False,
+        "status": status,
+        "charge": charge,
+        "attempts": attempt + 1,
+        "result": None,
+    }
+
+
+def submit_pages(
+    query,
+    client=None,
+    retries=5,
+    backoff=0.5,
+    bindings=None,
+):
+    """
+    Execute a gremlin query like `submit_query`, but stream its result a
+    page (response batch) at a time instead of collecting all of it. A query
+    that fails part way (after retries) is submitted again from the start,
+    so pages can repeat: callers dedupe.
+
+    raises RuntimeError if the query still fails after retries
+    """
+    if client is None:
+        client = executor_client()
+    status = None
+    for attempt in range(retries + 1):
+        opened = client.client if isinstance(client, GremlinPool) else None
+        try:
+            result_set = client.submitAsync(query, bindings=bindings).result()
+            for page in result_set:
+                yield page
+            return
+        except gremlin_connection_errors as ex:
+            status = type(ex).__name__
+            if attempt == retries:
+                break
+            if opened is not None:
+                client.reset(opened)
+        except GremlinServerError as ex:
+            attributes = ex.status_attributes or {}
+            status = attributes.get("x-ms-status-code", ex.status_code)
+            if status not in retry_statuses or attempt == retries:
+                break
+            wait = parse_retry_after(attributes.get("x-ms-retry-after-ms"))
+            if wait is None:
+                wait = backoff * (2 ** attempt) * (1 + random.random())
+            time.sleep(wait)
+    raise RuntimeError(f"Query failed ({status}): {query} {bindings}")
+
+
+def as_statement(query):
+    """
+    Turn a standalone traversal ("g.V()...") into an anonymous one
+    ("__.V()...") that can run as a step of another traversal
+    """
+    return "__." + query[2:] if query.startswith("g.") else query
+
+
+def rebind(query, bindings, suffix):
+    """
+    Rename the bindings of a query (e.g., _id -> _id_3), so queries can be
+    packed together without their variables clashing
+    """
+    for name in bindings:
+        query = re.sub(
+            rf"(?<![\w]){re.escape(name)}(?![\w])", f"{name}{suffix}", query)
+    return query, {f"{name}{suffix}": value for name, value in bindings.items()}
+
+
+def compose_batch(queries):
+    """
+    Pack (query, bindings) upserts into a single traversal, each one a
+    sideEffect of an injected traverser, so every upsert keeps its own
+    fold/coalesce:
+
+    g.inject(0).sideEffect(__.V().hasId(_id_0).fold().coalesce(...)).sideEffect(...)
+
+    The query text only depends on the shape of the upserts (not on their
+    values), so the server can reuse compiled queries across batches.
+
+    returns (query, bindings)
+    """
+    if len(queries) == 1:
+        return queries[0]
+    statements = []
+    bindings = {}
+    for i, (query, query_bindings) in enumerate(queries):
+        query, query_bindings = rebind(query, query_bindings, f"_{i}")
+        statements.append(f".sideEffect({as_statement(query)})")
+        bindings.update(query_bindings)
+    return "g.inject(0)" + "".join(statements), bindings
+
+
+def query_size(query):
+    """
+    Size of a (query, bindings) request, in characters
+    """
+    text, bindings = query
+    return len(text) + len(json.dumps(bindings))
+
+
+def batch_queries(
+    queries,
+    max_statements=max_batch_statements,
+    max_chars=max_batch_chars,
+):
+    """
+    Group (query, bindings) pairs into batches of up to max_statements whose
+    composed traversal (with its bindings) stays within max_chars (a query
+    that is longer on its own is sent alone)
+
+    returns batches of indexes into queries
+    """
+    batches = []
+    batch = []
+    batch_chars = len("g.inject(0)")
+    for i, query in enumerate(queries):
+        size = query_size(query) + len(".sideEffect()")
+        if batch and (len(batch) >= max_statements or batch_chars + size > max_chars):
+            batches.append(batch)
+            batch = []
+            batch_chars = len("g.inject(0)")
+        batch.append(i)
+        batch_chars += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def execute_queries(
+    queries,
+    client=None,
+    concurrency=gremlin_concurrency,
+    retries=5,
+    backoff=0.5,
+    name="gremlin",
+    max_statements=max_batch_statements,
+    max_chars=max_batch_chars,
+):
+    """
+    Execute (query, bindings) upserts, packed into batches (see
+    `compose_batch`) with up to `concurrency` requests in flight, timed as
+    the `name` stage of the active report. A batch that fails outright is
+    sent again one query at a time (upserts are idempotent), so a single
+    bad query only fails itself.
+
+    returns:
+    ```json
+    {
+        "queries": 100,
+        "requests": 2,
+        "failed": [{"index": 12, "query": "...", "status": 400}],
+        "charge": 1234.5,
+        "retries": 3,
+        "seconds": 1.2
+    }
+    ```
+    """
+    queries = list(queries)
+    if client is None:
+        client = executor_client(concurrency)
+    batches = batch_queries(queries, max_statements, max_chars)
+
+    def send(batch):
+        """
+        returns (requests sent, outcome per query)
+        """
+        query, bindings = compose_batch([queries[i] for i in batch])
+        with stage(name, items=len(batch), bytes=query_size((query, bindings))):
+            result = submit_query(
+                query, client, retries, backoff,
+                verbose=len(batch) == 1, bindings=bindings)
+            if result["ok"]:
+                # the batch stands for all of its queries
+                return [result], [{**result, "index": i} for i in batch]
+            if len(batch) == 1:
+                return [result], [{**result, "index": batch[0]}]
+            print(
+                f"🔥 Batch of {len(batch)} queries failed ({result['status']}), sending them one at a time")
+            outcomes = [
+                {**submit_query(
+                    queries[i][0], client, retries, backoff,
+                    bindings=queries[i][1]), "index": i}
+                for i in batch
+            ]
+            return [result] + outcomes, outcomes
+
+    # batches are timed into the caller's active report
+    report = current_report.get()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        sent = list(pool.map(
+            lambda x: run_reported(report, send, x), batches))
+    seconds = time.perf_counter() - start
+
+    requests = [x for batch_requests, _ in sent for x in batch_requests]
+    results = [x for _, outcomes in sent for x in outcomes]
+
+    return {
+        "queries": len(queries),
+        "requests": len(requests),
+        "failed": [
+            {"index": x["index"], "query": queries[x["index"]][0], "status": x["status"]}
+            for x in results if not x["ok"]
+        ],
+        "charge": sum(x["charge"] for x in requests),
+        "retries": sum(x["attempts"] - 1 for x in requests),
+        "seconds": seconds,
+    }
+
+
+def render_vertex(plan, vertex_id):
+    """
+    Gremlin upsert (query, bindings) (fold/coalesce) for a vertex of a
+    GraphPlan
+    """
+    vertex = plan.vertices[vertex_id]
+    return upsert_node(
+        node_id=vertex_id,
+        node_type=vertex["label"],
+        properties=vertex["properties"],
+        execute=False,
+    )[0]
+
+
+def render_edge(edge):
+    """
+    Gremlin upsert (query, bindings) (coalesce) for a (from_id, label, to_id)
+    edge
+    """
+    from_id, label, to_id = edge
+    return upsert_edges(
+        from_id=from_id,
+        to_id=to_id,
+        rel_to=label,
+        execute=False,
+    )[0]
+
+
+def merge_summaries(summaries):
+    """
+    Add up `execute_queries` summaries (e.g., one per segment)
+    """
+    total = {
+        "queries": 0,
+        "requests": 0,
+        "failed": [],
+        "charge": 0.0,
+        "retries": 0,
+        "seconds": 0.0,
+    }
+    for summary in summaries:
+        for key, value in summary.items():
+            total[key] += value
+    return total
+
+
+def execute_segments(
+    keys,
+    render,
+    done,
+    on_segment=None,
+    segment_size=2000,
+    name="gremlin",
+    **kwargs,
+):
+    """
+    Render and execute queries for the keys that are not `done` yet, a
+    segment at a time. The keys of queries that succeeded are added to
+    `done` and `on_segment(done)` is called after every segment (e.g., to
+    checkpoint progress).
+
+    returns the summary (see `execute_queries`) with the keys of failed
+    queries in "failed"
+    """
+    pending = [key for key in keys if key not in done]
+    summaries = []
+    for i in range(0, len(pending), segment_size):
+        segment = pending[i:i + segment_size]
+        summary = execute_queries(
+            [render(key) for key in segment], name=name, **kwargs)
+        failed = {segment[x["index"]] for x in summary["failed"]}
+        done.update(key for key in segment if key not in failed)
+        summaries.append({**summary, "failed": sorted(failed)})
+        if on_segment is not None:
+            on_segment(done)
+    return merge_summaries(summaries)
+
+
+def execute_plan(
+    plan,
+    client=None,
+    concurrency=gremlin_concurrency,
+    retries=5,
+    backoff=0.5,
+    done=None,
+    on_segment=None,
+    segment_size=2000,
+):
+    """
+    Render a GraphPlan to gremlin and execute it. Every vertex write has
+    finished (or exhausted its retries) before the first edge is sent, since
+    edges look up both of their vertices.
+
+    done ({"vertices": set(ids), "edges": set((from, label, to))}) holds
+    what has already been written (e.g., by a run that was interrupted),
+    which is skipped and kept up to date. on_segment(done) is called after
+    every segment of segment_size queries.
+
+    returns:
+    ```json
+    {
+        "vertices": {...execute_queries summary, "failed": ["<vertex id>"]},
+        "edges": {...execute_queries summary, "failed": [["<from>", "<label>", "<to>"]]}
+    }
+    ```
+    """
+    if client is None:
+        client = executor_client(concurrency)
+    if done is None:
+        done = {"vertices": set(), "edges": set()}
+    options = {
+        "client": client,
+        "concurrency": concurrency,
+        "retries": retries,
+        "backoff": backoff,
+    }
+
+    vertex_summary = execute_segments(
+        list(plan.vertices),
+        lambda x: render_vertex(plan, x),
+        done["vertices"],
+        on_segment=on_segment and (lambda _: on_segment(done)),
+        segment_size=segment_size,
+        name="gremlin_vertices",
+        **options,
+    )
+    print(
+        f"🔴 {vertex_summary['queries']} vertices in {vertex_summary['seconds']:.2f}s"
+        f" ({vertex_summary['requests']} requests, {vertex_summary['charge']:.1f} RUs, {vertex_summary['retries']} retries,"
+        f" {len(vertex_summary['failed'])} failed)")
+    edge_summary = execute_segments(
+        sorted(plan.edges),
+        render_edge,
+        done["edges"],
+        on_segment=on_segment and (lambda _: on_segment(done)),
+        segment_size=segment_size,
+        name="gremlin_edges",
+        **options,
+    )
+    print(
+        f"🔗 {edge_summary['queries']} edges in {edge_summary['seconds']:.2f}s"
+        f" ({edge_summary['requests']} requests, {edge_summary['charge']:.1f} RUs, {edge_summary['retries']} retries,"
+        f" {len(edge_summary['failed'])} failed)")
+    graph_cache.invalidate(
+        {*plan.vertices, *(x for edge in plan.edges for x in (edge[0], edge[2]))})
+    return {"vertices": vertex_summary, "edges": edge_summary}
+
+
+def topic_children(pub_id, client=None):
+    """
+    Ids of the topic vertices that are children of a publication in the graph
+    """
+    result = submit_query(
+        "g.V(_id).out('parent').hasLabel('topic').id()", client,
+        bindings={"_id": pub_id})
+    return result["result"] or []
+
+
+def iter_descendants(
+    node_ids,
+    relation="parent",
+    max_depth=None,
+    client=None,
+    batch_size=100,
+):
+    """
+    Stream the ids of all the descendants of some vertices (by relation, up
+    to max_depth levels down if given), collected server side by a single
+    repeat/emit traversal per batch_size roots, shallowest first, a page
+    (response batch) at a time (see `submit_pages`). Only the ids already
+    sent are kept, to leave out repeats.
+
+    raises RuntimeError if a traversal fails (after retries), rather than
+    end as if the subgraph were complete
+    """
+    node_ids = list(node_ids)
+    times = ".times(_depth)" if max_depth else ""
+    seen = set()
+    for i in range(0, len(node_ids), batch_size):
+        roots, bindings = id_bindings(node_ids[i:i + batch_size])
+        bindings["_relation"] = relation
+        if max_depth:
+            bindings["_depth"] = max_depth
+        for page in submit_pages(
+            f"g.V({roots}).repeat(out(_relation).simplePath()).emit(){times}.dedup().id()",
+            client,
+            bindings=bindings,
+        ):
+            page = [x for x in page if x not in seen]
+            seen.update(page)
+            if page:
+                yield page
+
+
+def descendant_ids(
+    node_ids,
+    relation="parent",
+    max_depth=None,
+    client=None,
+    batch_size=100,
+):
+    """
+    Ids of all the descendants of some vertices, shallowest first (see
+    `iter_descendants`)
+    """
+    return [
+        x for page in iter_descendants(
+            node_ids, relation, max_depth, client=client, batch_size=batch_size)
+        for x in page
+    ]
+
+
+def drop_vertices(
+    node_ids,
+    client=None,
+    concurrency=gremlin_concurrency,
+    batch_size=100,
+):
+    """
+    Drop vertices (and their edges) in batches of batch_size ids per query
+
+    returns the `execute_queries` summary
+    """
+    node_ids = list(node_ids)
+    queries = []
+    for i in range(0, len(node_ids), batch_size):
+        ids, bindings = id_bindings(node_ids[i:i + batch_size])
+        queries.append((f"g.V({ids}).drop()", bindings))
+    summary = execute_queries(
+        queries,
+        client=client,
+        concurrency=concurrency,
+        name="gremlin_drop",
+        max_statements=1,
+    )
+    graph_cache.invalidate(node_ids)
+    return summary
+
+
+def prune(
+    node_id,
+    relation="parent",
+    inclusive=True,
+    client=None,
+    batch_size=100,
+    max_depth=None,
+):
+    """
+    🔥 use with caution 🔥
+
+    Drop a progenitor node's descendants (by relation) and, if
+    inclusive=True, the progenitor itself. The descendants are dropped
+    deepest first, batch_size ids per query, one query at a time (retrying
+    throttled queries, see `execute_queries`), and the progenitor only once
+    all of them are gone, so a prune that failed or was interrupted can
+    simply be run again. The descendants stream back a page at a time (see
+    `iter_descendants`), but their ids are all kept: the deepest are only
+    known once the last page is in.
+
+    returns the targeted ids (deepest first) and the drop queries that
+    failed (see `execute_queries`):
+    ```json
+    {
+        "targets": ["<id>", ...],
+        "failed": [{"index": 0, "query": "...", "status": 429}]
+    }
+    ```
+
+    Source: https://stackoverflow.com/a/45243153
+    """
+    if client is None:
+        client = executor_client(1)
+    targets = list(reversed(descendant_ids(
+        [node_id], relation, max_depth, client=client, batch_size=batch_size)))
+    summary = drop_vertices(
+        targets, client=client, concurrency=1, batch_size=batch_size)
+    failed = summary["failed"]
+    if inclusive and not failed:
+        targets.append(node_id)
+        failed = drop_vertices([node_id], client=client, concurrency=1)["failed"]
+    if failed:
+        print(f"🔥 {len(failed)} drop queries failed pruning {node_id}, run again")
+    return {"targets": targets, "failed": failed}
+
+
+def reconcile(
+    manifests,
+    client=None,
+    batch_size=100,
+):
+    """
+    Remove the topics that are no longer in their publication: the topic
+    children of each publication in the graph are diffed against its
+    manifest ({pub_id: {topic ids}}, see `GraphPlan.manifests`), and the
+    stale topics are dropped with all of their descendants (chunks)
+
+    Like `prune`, the descendants are dropped deepest first, one query at a
+    time, and the stale topics only once all of them are gone: a topic is
+    how a later run finds its chunks, so after a failed or interrupted
+    reconcile the next one picks up what is left.
+
+    An empty manifest is never reconciled, so a publication that failed to
+    extract does not wipe its topics.
+
+    returns the targeted ids (deepest first) and the drop queries that
+    failed (see `execute_queries`):
+    ```json
+    {
+        "stale": {"<pub_id>": ["<topic id>"]},
+        "targets": ["<id>", ...],
+        "failed": [{"index": 0, "query": "...", "status": 429}]
+    }
+    ```
+    """
+    if client is None:
+        client = executor_client(1)
+    stale = {}
+    for pub_id, topic_ids in manifests.items():
+        if not topic_ids:
+            continue
+        removed = sorted(set(topic_children(pub_id, client)) - set(topic_ids))
+        if removed:
+            stale[pub_id] = removed
+    topics = [x for removed in stale.values() for x in removed]
+    if not topics:
+        return {"stale": {}, "targets": [], "failed": []}
+    targets = list(reversed(descendant_ids(
+        topics, client=client, batch_size=batch_size)))
+    failed = drop_vertices(
+        targets, client=client, concurrency=1, batch_size=batch_size)["failed"]
+    if not failed:
+        targets += topics
+        failed = drop_vertices(
+            topics, client=client, concurrency=1, batch_size=batch_size)["failed"]
+    if failed:
+        print(
+            f"🔥 {len(failed)} drop queries failed removing {len(topics)} stale topics, run again")
+    else:
+        print(
+            f"✂️  Dropped {len(targets)} stale vertices ({len(topics)} topics) from {len(stale)} publications")
+    return {"stale": stale, "targets": targets, "failed": failed}
@@ -0,0 +1,160 @@
+import threading
+import time
+
+from collections import OrderedDict
+
+
+def vertex_ids(payload):
+    """
+    The ids of every vertex element (GraphSON, {"type": "vertex", ...}) in
+    a gremlin result, e.g., of a `.tree()`
+    """
+    ids = []
+    stack = [payload]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, dict):
+            if item.get("type") == "vertex" and "id" in item:
+                ids.append(item["id"])
+            stack.extend(item.values())
+        elif isinstance(item, list):
+            stack.extend(item)
+    return ids
+
+
+def id_key(ids):
+    """
+    Order independent form of a list of ids, for cache keys
+    """
+    return tuple(sorted(set(ids)))
+
+
+class GraphCache:
+    """
+    Bounded LRU cache of graph reads (e.g., `graph_get_connected`), with a
+    time to live per entry
+
+    Entries are keyed by the normalized traversal (query name and
+    arguments) and indexed by the vertex ids they depend on (the ids they
+    start from and the vertices they return), so a write can invalidate
+    exactly the reads it affects (see `invalidate`). Cached values are
+    shared between callers and must not be mutated.
+    """
+
+    def __init__(self, max_entries=1024, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # bumped by every invalidation, so a read that raced a write is not
+        # cached (see `put`)
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._by_id = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        _, _, ids = self._entries.pop(key)
+        for vertex_id in ids:
+            keys = self._by_id.get(vertex_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_id[vertex_id]
+
+    def get(self, key):
+        """
+        The cached value for a key, or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, ids=(), generation=None):
+        """
+        Cache a value that depends on the vertex ids. Nothing is cached for
+        None (a failed query), or when anything was invalidated since
+        `generation` (read before the query was sent).
+        """
+        if value is None or self.max_entries <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            ids = set(ids)
+            self._entries[key] = (time.monotonic() + self.ttl, value, ids)
+            for vertex_id in ids:
+                self._by_id.setdefault(vertex_id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def fetch(self, key, query, ids=None):
+        """
+        Read through the cache: the cached value for key, else query() (ids
+        maps its result to the vertex ids it depends on)
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+        generation = self.generation
+        value = query()
+        if value is not None:
+            self.put(key, value, ids(value) if ids else (), generation)
+        return value
+
+    def invalidate(self, ids):
+        """
+        Drop the entries that depend on any of the vertex ids (e.g., after
+        they were upserted, linked or dropped)
+        """
+        with self._lock:
+            self.generation += 1
+            for vertex_id in ids:
+                for key in self._by_id.pop(vertex_id, set()):
+                    if key in self._entries:
+                        self._remove(key)
+                        self.invalidations += 1
+
+    def clear(self):
+        """
+        Drop every entry
+        """
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._by_id.clear()
+
+    def stats(self):
+        """
+        Hit/miss counters for the cache
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "expirations": self.expirations,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "entries": len(self._entries),
+            "capacity": self.max_entries,
+        }
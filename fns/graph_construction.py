@@ -1,7 +1,7 @@
 import asyncio
-import sys
 import os
 import json
+import hashlib
 import zipfile
 import re
 import datetime
@@ -9,6 +9,7 @@ import time
 import urllib
 import pickle
 
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from dotenv import load_dotenv, dotenv_values
 from glom import glom
@@ -16,6 +17,7 @@ from glom import glom
 from gremlin_python.driver import client, serializer
 from .artifactory_fns import (
     ArtifactoryPath,
+    download_artifact,
     get_artifactory_metadata,
     get_publication_metadata,
     extract_xml_from_zip
@@ -37,8 +39,11 @@ from .azure_fns import (
     write_file,
     read_file,
     spawn_plan,
-    exec_gremlin
+    pluck_xf,
 )
+from .graph import execute_plan, gremlin_concurrency, reconcile
+from .graph_plan import GraphPlan, export_plan, import_plan
+from .kv_state import KVStore, open_kv_store
 from .markdown_fns import chunk_markdown
 from .utils import RELATIVE_PATH
 
@@ -65,11 +70,11 @@ AF_URL = AF_BASE_URL + AF_TARGET + "/"
 # artifactory_path: https://binrepo.vtxdev.net/artifactory/knowmgmt-gen-publish/publish-prod
 
 
-def file_size(file):
-    """
-    Get the size of the file
-    """
-    return os.stat(file).st_size
+# bump when digest_article/spawn_plan change what they generate, so every
+# topic is planned again even though its content did not change
+plan_version = 3
+
+zip_buffer_size = 64 * 1024
 
 # 2. For each path: digest the publication name, metadata (json file), xml file, and zip files
 #     - the entire process is modulated per publication (i.e., iterate over files with the same function)
@@ -86,23 +91,24 @@ def xf_metadata(metadata: dict):
         """
         some tags are incorrectly concatenated and need to be split by commas. this
         function takes all the tags, splits each of them by commas adds them to a
-        set, and flattens into a list 
+        set, and flattens into a sorted list (so the result does not depend
+        on the hash seed, e.g., for `plan_fingerprint`)
 
         example:
         ["Release Notes", "Featured, Product Documentation", "Featured"]
         ->
-        ["Release Notes", "Featured", "Product Documentation"]
+        ["Featured", "Product Documentation", "Release Notes"]
         """
         results = set()
         if isinstance(tags, list):
             for tag in tags:
                 results.update([re.sub(bracket_rx, "", t.strip())
                                for t in tag.split(",")])
-            return list([result for result in results if result != ""])
+            return sorted([result for result in results if result != ""])
         elif isinstance(tags, str):
             results.update([re.sub(bracket_rx, "", t.strip())
                            for t in tags.split(",")])
-            return list([result for result in results if result != ""])
+            return sorted([result for result in results if result != ""])
         else:
             return tags
 
@@ -186,6 +192,44 @@ lang_dict = {
 }
 
 
+def read_member(zip_file, file_info, buffer_size=zip_buffer_size):
+    """
+    Read a zip member, hashing it (sha256) as it streams out of the zip
+
+    returns (data, sha256)
+    """
+    digest = hashlib.sha256()
+    blocks = []
+    with zip_file.open(file_info) as member:
+        for block in iter(lambda: member.read(buffer_size), b""):
+            digest.update(block)
+            blocks.append(block)
+    return b"".join(blocks), digest.hexdigest()
+
+
+def member_text(data, encoding="utf-8"):
+    """
+    Decode a zip member as text, with universal newlines (as `open` would)
+    """
+    text = data.decode(encoding)
+    return text.replace("\r\n", "\n").replace("\r", "\n")
+
+
+def plan_fingerprint(sha256, metadata, lang="en"):
+    """
+    Fingerprint of everything a topic's plan is generated from: its content,
+    the publication metadata that `spawn_plan` copies onto the vertices, the
+    language and the plan version
+    """
+    payload = json.dumps({
+        "sha256": sha256,
+        "metadata": pluck_xf(metadata),
+        "lang": lang,
+        "plan_version": plan_version,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
 def infuse_metadata(chunks, metadata):
     """
     Infuse metadata into the chunks
@@ -220,8 +264,13 @@ def extract_zip(
             f"Skipping {pub_name} due to small size: {artf_meta['size']} bytes")
         return
 
-    with path.open() as infile, open(zip_filename, "wb") as outfile:
-        outfile.write(infile.read())
+    # check if the publication changed (content hash) before downloading it
+    previous = kv_state.get(pub_name, {})
+    if previous.get("artifact_sha256") == artf_meta["sha256"] and previous.get("plan_version") == plan_version:
+        print(f"✅✅ Skipping publication {pub_name} due to unchanged content")
+        return
+
+    download_artifact(path, zip_filename, sha256=artf_meta["sha256"])
 
     zip_file = zipfile.ZipFile(zip_filename)
     xml = extract_xml_from_zip(zip_file)
@@ -229,164 +278,425 @@ def extract_zip(
     pub_meta["publication_name"] = pub_name
     pub_meta.update(artf_meta)
     pub_meta = xf_metadata(pub_meta)
+    # kept as is (xf_metadata splits every string into a list)
+    pub_meta["artifact_sha256"] = artf_meta["sha256"]
+    pub_meta["plan_version"] = plan_version
 
-    zip_file_contents = zip_file.namelist()
-
-    # check if the publication size has changed
-    if pub_name in kv_state:
-        if kv_state[pub_name]["size"] == pub_meta["size"]:
-            print(f"✅✅ Skipping publication {pub_name} due to unchanged size")
-            return
-        else:
-            # update the size store and continue
-            kv_state[pub_name] = pub_meta
-    else:
-        # add the publication to the size store
-        kv_state[pub_name] = pub_meta
+    # update the kv store and continue
+    kv_state[pub_name] = pub_meta
 
     publication = pub_name.split("/")[0]
 
-    gremlin_vertices = set()
-    gremlin_edges = set()
+    plan = GraphPlan()
+    # every topic in the publication, changed or not
+    topics = set()
 
     content_path = "Vertex/content/" + lang + "/"
     # handle zip files with content in the /content/en/ directory
-    for file in zip_file_contents:
+    # (members are read straight from the zip, nothing touches the disk)
+    for file_info in zip_file.infolist():
+        file = file_info.filename
         if content_path in file and (file.endswith(".json") or file.endswith(".html")):
-            zip_file.extract(file, directory)
-            print(f"Extracted {file} to {directory}")
+            print(f"Reading {file} from {zip_filename}")
             # print(f"🍖 Metadata: {json.dumps(pub_meta, indent=2)} 🍖")
             # only one per publication
             if file.endswith("metadata.json"):
-                json_file = os.path.join(directory, file)
-                with open(json_file) as pojo:
-                    data = json.load(pojo)["values"]
-                    size = file_size(json_file)
-                    meta = xf_metadata(data)
-                    kv_state[pub_name].update(meta)
+                data = json.loads(zip_file.read(file_info))["values"]
+                meta = xf_metadata(data)
+                pub_meta.update(meta)
+                kv_state[pub_name] = pub_meta
             elif file.endswith(".html"):
-                html_file = os.path.join(directory, file)
-                with open(html_file) as html:
-                    size = file_size(html_file)
-                    print(f"Size of html {file}: {size} bytes")
-                    topic_path = file.split(".")[-2]
-                    # -> Vertex/content/<lang>/<topic>
-                    topic = ":".join(topic_path.split("/")[-2:])
-                    # -> <lang>:<topic>
-                    key = f"{pub_name}:{topic}"
-                    print(f"Key: {key}")
-                    if key in kv_state:
-                        if kv_state[key]["size"] == size:
-                            print(
-                                f"✅ Skipping topic {key} due to unchanged size")
-                            continue
-                        else:
-                            kv_state[key] = {"size": size}
-                    else:
-                        kv_state[key] = {"size": size}
-                    # pretty print the html data
-                    data = html.read()
-                    md = html2md(data)
-                    # TODO: Chunking
-                    digest = digest_article(
-                        md, publication, lang=lang_dict[lang])
-                    # print(f"\n📄 Markdown digest for {publication} 📄")
-                    # print(f"📄 {json.dumps(digest, indent=2)} 📄")
-                    plan = spawn_plan(
-                        from_id=key,
-                        digest=digest,
-                        metadata=pub_meta,
-                        lang='en'
-                    )
-                    # print(f"Plan for {key}:\n")
-                    gremlin_vertices = gremlin_vertices.union(
-                        plan["gremlin"]["vertices"])
-                    gremlin_edges = gremlin_edges.union(
-                        plan["gremlin"]["edges"])
-                    # print("\n" + json.dumps(digest, indent=2))
-                    # TODO: Graph Construction + other storage
-            # delete the extracted file
-            os.remove(os.path.join(directory, file))
-
-        # print the gremlins
-    print("GREMLINS:\n")
-    # number
-    # print(f"Vertices: {len(gremlin_vertices)}")
-    # print(f"Edges: {len(gremlin_edges)}")
-    # execute the gremlins
+                size = file_info.file_size
+                print(f"Size of html {file}: {size} bytes")
+                topic_path = file.split(".")[-2]
+                # -> Vertex/content/<lang>/<topic>
+                topic = ":".join(topic_path.split("/")[-2:])
+                # -> <lang>:<topic>
+                key = f"{pub_name}:{topic}"
+                print(f"Key: {key}")
+                topics.add(key)
+                raw, sha256 = read_member(zip_file, file_info)
+                fingerprint = plan_fingerprint(sha256, pub_meta, lang=lang)
+                if kv_state.get(key, {}).get("fingerprint") == fingerprint:
+                    print(
+                        f"✅ Skipping topic {key} due to unchanged content")
+                    continue
+                kv_state[key] = {
+                    "size": size,
+                    "sha256": sha256,
+                    "fingerprint": fingerprint,
+                }
+                # same newline handling as reading the file in text mode
+                data = member_text(raw)
+                md = html2md(data)
+                # TODO: Chunking
+                digest = digest_article(
+                    md, publication, lang=lang_dict[lang])
+                # print(f"\n📄 Markdown digest for {publication} 📄")
+                # print(f"📄 {json.dumps(digest, indent=2)} 📄")
+                spawn_plan(
+                    from_id=key,
+                    digest=digest,
+                    metadata=pub_meta,
+                    plan=plan,
+                    lang='en'
+                )
+                # print(f"Plan for {key}:\n")
+                # print("\n" + json.dumps(digest, indent=2))
+                # TODO: Graph Construction + other storage
+
+    plan.set_manifest(pub_name, topics)
+    print(f"PLAN for {pub_name}: {plan}\n")
+    # executed by the caller, merged with the other publications' plans
+    return plan
+
+
+# loaded on first use, see fns.kv_state
+kv_store = open_kv_store()
+
+
+def kv_slice(kv_state, pub_name):
+    """
+    The entries of the kv state that belong to a publication (the
+    publication itself and its `<pub_name>:<lang>:<topic>` keys)
+    """
+    if isinstance(kv_state, KVStore):
+        return kv_state.publication(pub_name)
+    prefix = f"{pub_name}:"
     return {
-        "gremlin": {"vertices": gremlin_vertices, "edges": gremlin_edges},
+        k: v for k, v in kv_state.items() if k == pub_name or k.startswith(prefix)
     }
 
 
-kv_store = json.loads(read_file("benchmarks/kv.json"))
+def extract_publication(url, directory, kv_state, lang="en"):
+    """
+    Process pool entry point for `extract_zip`: rebuilds the Artifactory path
+    from its url, downloads into its own subdirectory (so publications never
+    share files) and returns the plan with the entries of the publication's
+    slice of the kv state that changed, for the parent to merge
 
+    returns (GraphPlan | None, kv_updates)
+    """
+    path = ArtifactoryPath(url)
+    subdir = os.path.join(directory, path.stem)
+    if not os.path.exists(subdir):
+        os.makedirs(subdir)
+    previous = json.loads(json.dumps(kv_state))
+    plan = extract_zip(path, subdir, kv_state=kv_state, lang=lang)
+    kv_updates = {k: v for k, v in kv_state.items() if previous.get(k) != v}
+    return plan, kv_updates
 
-def download_af_files(
+
+def checkpoint_paths(index_name):
+    """
+    Where a graph load keeps its checkpoint: the plan with the kv state it
+    leads to (written once, before any query is sent), and the journal of
+    what has been written so far (rewritten after every segment)
+    """
+    return {
+        "plan": f"benchmarks/{index_name}-graph-plan.json",
+        "journal": f"benchmarks/{index_name}-graph-journal.json",
+    }
+
+
+def save_checkpoint(index_name, plan, kv_changes):
+    """
+    Checkpoint a graph load before executing it, with the kv changes that
+    are committed once it has finished
+    """
+    paths = checkpoint_paths(index_name)
+    write_file(paths["plan"], json.dumps(
+        {"plan": plan.to_dict(), "kv": kv_changes}))
+    save_journal(index_name, {"vertices": set(), "edges": set()})
+
+
+def save_journal(index_name, done):
+    """
+    Record the vertices and edges that have been written
+    """
+    write_file(checkpoint_paths(index_name)["journal"], json.dumps({
+        "vertices": sorted(done["vertices"]),
+        "edges": [list(edge) for edge in sorted(done["edges"])],
+    }))
+
+
+def load_checkpoint(index_name):
+    """
+    Load an unfinished graph load, if there is one
+
+    returns (plan, kv_changes, done) or None
+    """
+    paths = checkpoint_paths(index_name)
+    try:
+        checkpoint = json.loads(read_file(paths["plan"]))
+    except Exception:
+        return None
+    if not checkpoint:
+        return None
+    try:
+        journal = json.loads(read_file(paths["journal"])) or {}
+    except Exception:
+        journal = {}
+    done = {
+        "vertices": set(journal.get("vertices", [])),
+        "edges": {tuple(edge) for edge in journal.get("edges", [])},
+    }
+    return GraphPlan.from_dict(checkpoint["plan"]), checkpoint["kv"], done
+
+
+def clear_checkpoint(index_name):
+    """
+    Mark the graph load as finished (blobs can't be removed via write_file,
+    so the checkpoint is emptied instead)
+    """
+    for path in checkpoint_paths(index_name).values():
+        write_file(path, "null")
+
+
+def forget_failed(kv_state, summary):
+    """
+    Drop the kv entries of topics (and their publications) with vertices or
+    edges that could not be written, so the next run plans them again
+    instead of skipping them as unchanged
+    """
+    ids = set(summary["vertices"]["failed"])
+    for from_id, _, to_id in summary["edges"]["failed"]:
+        ids.update([from_id, to_id])
+    for node_id in ids:
+        # <pub_name>[:<lang>:<topic>[:<chunk>]]
+        parts = node_id.split(":")
+        kv_state.pop(parts[0], None)
+        if len(parts) >= 3:
+            kv_state.pop(":".join(parts[:3]), None)
+
+
+def plan_af_files(
     index_name: str,
     download_dir: str = "downloads",
     lang: str = "en",
     targeted_products: bool | list[str] = False,
-    kv: dict = kv_store
+    kv: KVStore = kv_store,
+    workers: int = 1,
 ):
     """
-    Download files from the Artifactory URL
+    Download the publications from the Artifactory URL and plan their graph
+
+    workers > 1 extracts and plans publications concurrently in a process
+    pool. Each worker gets only its publication's slice of the kv state and
+    the updated slices are merged back here, so no two workers ever write
+    the same keys.
+
+    returns the merged GraphPlan (kv is updated in place)
     """
     directory = os.path.join(download_dir, index_name)
     if not os.path.exists(directory):
         os.makedirs(directory)
     payload = []
-    gremlin_vertices = set()
-    gremlin_edges = set()
-    execution_count = 0
     af_path = ArtifactoryPath(AF_URL)
+    whitelist = [x.lower() for x in publication_whitelist]
+    targets = [x.lower() for x in targeted_products] if targeted_products else []
+    paths = []
     for path in af_path:
         # path: https://binrepo.vtxdev.net/artifactory/knowmgmt-gen-publish/publish-prod/IrisProductGuide.zip
-        if path.stem.lower() not in [x.lower() for x in publication_whitelist]:
+        if path.stem.lower() not in whitelist:
             print(f"⬛ Skipping non-whitelisted publication: {path.stem}")
             # Skipping non-whitelisted publication: IrisProductGuide
             continue
-        if targeted_products and len(targeted_products) and path.stem.lower() in [x.lower() for x in targeted_products]:
+        if targets and path.stem.lower() in targets:
             print(
                 f"Downloading targeted (shortlist) {path.stem} to {directory}")
             print(f"full path: {path}")
-            payload.append(extract_zip(
-                path, directory, kv_state=kv, lang=lang))
+            paths.append(path)
         elif not targeted_products:
             print(f"Downloading {path.stem} to {directory}")
+            paths.append(path)
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(
+                    extract_publication,
+                    str(path),
+                    directory,
+                    kv_slice(kv, path.stem),
+                    lang,
+                )
+                for path in paths
+            ]
+            for path, future in zip(paths, futures):
+                try:
+                    plan, kv_updates = future.result()
+                except Exception as e:
+                    print(f"🔥 Problem extracting {path.stem}: {e}")
+                    continue
+                kv.update(kv_updates)
+                payload.append(plan)
+    else:
+        for path in paths:
             payload.append(extract_zip(
                 path, directory, kv_state=kv, lang=lang))
 
-    for plan in payload:
-        try:
-            gremlin_vertices = gremlin_vertices.union(
-                plan["gremlin"]["vertices"] or set())
-            gremlin_edges = gremlin_edges.union(
-                plan["gremlin"]["edges"] or set())
-        except TypeError:
-            # print(f"🔥 PROBLEM PARSING PLAN:\n {plan}")
-            # Plan can end up being [] instead (FIXME)
-            continue
+    # skipped publications have no plan
+    plan = GraphPlan()
+    for publication_plan in payload:
+        plan.merge(publication_plan)
+    return plan
+
+
+
+def load_graph(
+    index_name: str,
+    plan: GraphPlan,
+    kv: KVStore = kv_store,
+    gremlin_workers: int = gremlin_concurrency,
+    checkpoint_every: int = 2000,
+    done: dict = None,
+):
+    """
+    Write a plan to the graph, then commit the kv changes it leads to
+
+    The load is checkpointed: the plan and the kv changes are saved before
+    any query is sent (unless done is given, i.e., when resuming), and the
+    vertices and edges written so far are journaled every checkpoint_every
+    queries. The kv changes are only committed (and snapshotted) once the
+    load has finished.
+
+    Once the plan is loaded, topics that were removed from the planned
+    publications are pruned from the graph (see `fns.graph.reconcile`).
+
+    returns the `fns.graph.execute_plan` summary, with the reconcile
+    summary in "reconciled"
+    """
+    if done is None:
+        save_checkpoint(index_name, plan, kv.changes())
+        done = {"vertices": set(), "edges": set()}
+
+    # create nodes first, then the edges between them
+    summary = execute_plan(
+        plan,
+        concurrency=gremlin_workers,
+        done=done,
+        on_segment=lambda x: save_journal(index_name, x),
+        segment_size=checkpoint_every,
+    )
+    total_queries = len(plan)
+    failed = len(summary["vertices"]["failed"]) + \
+        len(summary["edges"]["failed"])
+    charge = summary["vertices"]["charge"] + summary["edges"]["charge"]
+    print(
+        f"🧧 DONE: {total_queries - failed} of {total_queries} queries ({charge:.1f} RUs) 🧧")
+    forget_failed(kv, summary)
+
+    # remove the topics that are no longer in their publications
+    reconciled = reconcile(plan.manifests)
+    if reconciled["failed"]:
+        # the stale topics that are left are found again by the next load
+        print(
+            f"🔥 Could not remove every stale topic ({len(reconciled['failed'])} drop queries failed), the next load retries them")
+    else:
+        for removed in reconciled["stale"].values():
+            for topic_id in removed:
+                kv.pop(topic_id, None)
+
+    changed = len(kv.changes())
+    snapshot_size = kv.commit(snapshot=True)
+    print(
+        f"📄📄📄 Updated {changed} kv entries (snapshot: {snapshot_size} bytes) 📄📄📄")
+    clear_checkpoint(index_name)
+    return {**summary, "reconciled": reconciled}
 
-    # create nodes first
-    for gremlin in gremlin_vertices:
-        execution_count += 1
-        print(f"\n🔴 Creating Vertex:\n{gremlin}")
-        exec_gremlin(gremlin)
-
-    # create edges
-    for gremlin in gremlin_edges:
-        execution_count += 1
-        print(f"\n🔗 Creating Edge:\n{gremlin}")
-        exec_gremlin(gremlin)
-
-    total_queries = len(gremlin_vertices.union(gremlin_edges))
-    print(f"🧧 DONE: {execution_count} of {total_queries} queries 🧧")
-
-    new_kvs = json.dumps(kv, indent=2)
-    write_file("benchmarks/kv.json", new_kvs)
-    new_kvs_size = sys.getsizeof(new_kvs)
-    print(f"📄📄📄 Updated size store ({new_kvs_size} bytes) 📄📄📄")
+
+def resume_graph(index_name, kv=kv_store):
+    """
+    Pick up an unfinished graph load: replays its kv changes
+
+    returns (plan, done) or None
+    """
+    checkpoint = load_checkpoint(index_name)
+    if not checkpoint:
+        return None
+    plan, kv_changes, done = checkpoint
+    kv.apply(kv_changes)
+    print(
+        f"⏯  Resuming graph load for {index_name}: {len(done['vertices'])} of {len(plan.vertices)} vertices and {len(done['edges'])} of {len(plan.edges)} edges already written")
+    return plan, done
+
+
+def download_af_files(
+    index_name: str,
+    download_dir: str = "downloads",
+    lang: str = "en",
+    targeted_products: bool | list[str] = False,
+    kv: KVStore = kv_store,
+    workers: int = 1,
+    gremlin_workers: int = gremlin_concurrency,
+    resume: bool = True,
+    checkpoint_every: int = 2000,
+    export_dir: str = None,
+):
+    """
+    Download files from the Artifactory URL and load their graph
+
+    workers > 1 plans publications concurrently (see `plan_af_files`) and
+    gremlin_workers is the number of graph queries in flight at once (see
+    `fns.graph.execute_plan`).
+
+    With resume=True, a run that finds an unfinished checkpoint (see
+    `load_graph`) picks it up instead of planning again, and skips
+    everything already journaled.
+
+    With export_dir, the merged plan is exported instead (see
+    `fns.graph_plan.export_plan`) with the kv changes it leads to, and
+    nothing is written to the graph or kept in the kv store (the changes
+    are rolled back): bulk import the files, or replay them later with
+    `load_export`.
+    """
+    resumed = resume_graph(index_name, kv) if resume and not export_dir else None
+    if resumed:
+        plan, done = resumed
+        return load_graph(
+            index_name, plan, kv, gremlin_workers, checkpoint_every, done=done)
+
+    plan = plan_af_files(
+        index_name=index_name,
+        download_dir=download_dir,
+        lang=lang,
+        targeted_products=targeted_products,
+        kv=kv,
+        workers=workers,
+    )
+    if export_dir:
+        paths = export_plan(plan, export_dir, extra={"kv": kv.changes()})
+        # the changes travel with the export, until it is loaded the store
+        # must not consider these topics planned
+        kv.rollback()
+        print(f"📦 Exported {plan} to {', '.join(paths.values())}")
+        return paths
+    return load_graph(index_name, plan, kv, gremlin_workers, checkpoint_every)
+
+
+def load_export(
+    index_name: str,
+    export_dir: str,
+    kv: KVStore = kv_store,
+    gremlin_workers: int = gremlin_concurrency,
+    resume: bool = True,
+    checkpoint_every: int = 2000,
+):
+    """
+    Replay a plan exported by `download_af_files(export_dir=...)` into the
+    graph (and commit its kv changes), without downloading or parsing any
+    publication
+    """
+    resumed = resume_graph(index_name, kv) if resume else None
+    if resumed:
+        plan, done = resumed
+        return load_graph(
+            index_name, plan, kv, gremlin_workers, checkpoint_every, done=done)
+    plan, extra = import_plan(export_dir)
+    kv.apply(extra.get("kv", {}))
+    print(f"📦 Loading {plan} from {export_dir}")
+    return load_graph(index_name, plan, kv, gremlin_workers, checkpoint_every)
 
 
 """
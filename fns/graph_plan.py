@@ -0,0 +1,201 @@
+import json
+import os
+
+from pathlib import Path
+
+
+class GraphPlan:
+    """
+    The vertices and edges to upsert into the graph db, kept as data until
+    they are executed (see `fns.graph.execute_plan`)
+
+    - vertices: {id: {"label": "topic", "properties": {...}}}, where the
+      properties of every upsert of the same vertex are merged (later
+      values win), so a stub (e.g., a linked topic) and the full vertex
+      become a single upsert
+    - edges: {(from_id, label, to_id)}
+    - manifests: {pub_id: {topic ids}}, every topic currently in a
+      publication that was planned (including unchanged topics), to find
+      the topics that were removed from it (see `fns.graph.reconcile`)
+
+    Plans merge cheaply (e.g., per topic into per publication into a full
+    load) and are picklable, so they can be returned from a process pool.
+    """
+
+    def __init__(self, vertices=None, edges=None, manifests=None):
+        self.vertices = vertices if vertices is not None else {}
+        self.edges = edges if edges is not None else set()
+        self.manifests = manifests if manifests is not None else {}
+
+    def __len__(self):
+        return len(self.vertices) + len(self.edges)
+
+    def __repr__(self):
+        return f"GraphPlan(vertices={len(self.vertices)}, edges={len(self.edges)})"
+
+    def add_vertex(self, vertex_id, label, properties=None):
+        """
+        Add a vertex, merging its properties into an existing one
+        """
+        vertex = self.vertices.get(vertex_id)
+        if vertex is None:
+            vertex = self.vertices[vertex_id] = {"label": label, "properties": {}}
+        elif vertex["label"] is None:
+            vertex["label"] = label
+        if properties:
+            vertex["properties"].update(properties)
+        return self
+
+    def add_edge(self, from_id, label, to_id):
+        """
+        Add an edge (from_id)-[label]->(to_id)
+        """
+        self.edges.add((from_id, label, to_id))
+        return self
+
+    def set_manifest(self, pub_id, topic_ids):
+        """
+        Record the topics that are currently in a publication
+        """
+        self.manifests[pub_id] = set(topic_ids)
+        return self
+
+    def merge(self, other):
+        """
+        Merge another plan into this one
+        """
+        if other is None:
+            return self
+        for vertex_id, vertex in other.vertices.items():
+            self.add_vertex(vertex_id, vertex["label"], vertex["properties"])
+        self.edges.update(other.edges)
+        for pub_id, topic_ids in other.manifests.items():
+            self.manifests.setdefault(pub_id, set()).update(topic_ids)
+        return self
+
+    def to_dict(self):
+        """
+        JSON serializable form of the plan
+        """
+        return {
+            "vertices": self.vertices,
+            "edges": [list(edge) for edge in sorted(self.edges)],
+            "manifests": {k: sorted(v) for k, v in self.manifests.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Rebuild a plan from its `to_dict` form
+        """
+        return cls(
+            vertices=data.get("vertices", {}),
+            edges={tuple(edge) for edge in data.get("edges", [])},
+            manifests={k: set(v) for k, v in data.get("manifests", {}).items()},
+        )
+
+
+def graphson_vertex(vertex_id, label, properties):
+    """
+    A vertex in the GraphSON form the graph db returns (and bulk imports),
+    e.g.:
+    {"id", "label", "type": "vertex",
+     "properties": {"title": [{"id": "<id>|title", "value": "..."}]}}
+    """
+    return {
+        "id": vertex_id,
+        "label": label,
+        "type": "vertex",
+        "properties": {
+            k: [{"id": f"{vertex_id}|{k}", "value": v}]
+            for k, v in properties.items()
+        },
+    }
+
+
+def graphson_edge(from_id, label, to_id, from_label=None, to_label=None):
+    """
+    An edge in the GraphSON form the graph db returns (and bulk imports),
+    with an id derived from its ends (edges are unique per from/label/to)
+    """
+    edge = {
+        "id": f"{from_id}|{label}|{to_id}",
+        "label": label,
+        "type": "edge",
+        "outV": from_id,
+        "inV": to_id,
+    }
+    if from_label:
+        edge["outVLabel"] = from_label
+    if to_label:
+        edge["inVLabel"] = to_label
+    return edge
+
+
+def export_plan(plan, directory, extra=None, partition="en", partition_key="lang"):
+    """
+    Write a plan as GraphSON, one vertex or edge per line, to be bulk
+    imported or replayed later (see `import_plan`):
+        - <directory>/vertices.json: {"id", "label", "type": "vertex",
+          "properties"}, with the partition key among the properties
+        - <directory>/edges.json: {"id", "label", "type": "edge", "outV",
+          "inV", "outVLabel", "inVLabel"} (the labels of vertices that are
+          not in the plan are left out)
+        - <directory>/plan.json: {"manifests": {...}, "extra": {...}}
+
+    returns the paths written
+    """
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    paths = {
+        "vertices": os.path.join(directory, "vertices.json"),
+        "edges": os.path.join(directory, "edges.json"),
+        "plan": os.path.join(directory, "plan.json"),
+    }
+    with open(paths["vertices"], "w", encoding="utf-8") as f:
+        for vertex_id, vertex in plan.vertices.items():
+            properties = {partition_key: partition, **vertex["properties"]}
+            f.write(json.dumps(
+                graphson_vertex(vertex_id, vertex["label"], properties)) + "\n")
+
+    def label(vertex_id):
+        return plan.vertices.get(vertex_id, {}).get("label")
+
+    with open(paths["edges"], "w", encoding="utf-8") as f:
+        for from_id, edge_label, to_id in sorted(plan.edges):
+            f.write(json.dumps(graphson_edge(
+                from_id, edge_label, to_id, label(from_id), label(to_id))) + "\n")
+    with open(paths["plan"], "w", encoding="utf-8") as f:
+        json.dump({
+            "manifests": {k: sorted(v) for k, v in plan.manifests.items()},
+            "extra": extra or {},
+        }, f)
+    return paths
+
+
+def import_plan(directory, partition_key="lang"):
+    """
+    Read a plan written by `export_plan` (the partition key is left out of
+    the vertex properties, it is added again when they are rendered)
+
+    returns (plan, extra)
+    """
+    plan = GraphPlan()
+    with open(os.path.join(directory, "vertices.json"), encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                vertex = json.loads(line)
+                plan.add_vertex(vertex["id"], vertex["label"], {
+                    k: v[0]["value"]
+                    for k, v in vertex["properties"].items()
+                    if k != partition_key
+                })
+    with open(os.path.join(directory, "edges.json"), encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                edge = json.loads(line)
+                plan.add_edge(edge["outV"], edge["label"], edge["inV"])
+    with open(os.path.join(directory, "plan.json"), encoding="utf-8") as f:
+        data = json.load(f)
+    for pub_id, topic_ids in data.get("manifests", {}).items():
+        plan.set_manifest(pub_id, topic_ids)
+    return plan, data.get("extra", {})
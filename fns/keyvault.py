@@ -1,3 +1,4 @@
+import functools
 import os
 from azure.keyvault.secrets import SecretClient
 from azure.identity import AzureCliCredential
@@ -6,11 +7,17 @@ from .utils import RELATIVE_PATH
 
 load_dotenv(dotenv_path=f"{RELATIVE_PATH}.env")
 
-KVUri = f'https://{os.environ["KEY_VAULT_NAME"]}.vault.azure.net'
 
-credential = AzureCliCredential()
-client = SecretClient(vault_url=KVUri, credential=credential)
+@functools.cache
+def secret_client():
+    """
+    The key vault client, created on first use, so modules can be imported
+    without credentials (e.g., offline)
+    """
+    KVUri = f'https://{os.environ["KEY_VAULT_NAME"]}.vault.azure.net'
+    credential = AzureCliCredential()
+    return SecretClient(vault_url=KVUri, credential=credential)
 
 
 def get_secret(name, default=None):
-    return client.get_secret(name).value
+    return secret_client().get_secret(name).value
@@ -0,0 +1,274 @@
+import gzip
+import json
+import os
+import sqlite3
+
+from collections.abc import MutableMapping
+from pathlib import Path
+
+from .azure_fns import read_file, write_file
+from .utils import RELATIVE_PATH
+
+with open(f"{RELATIVE_PATH}constants.json") as f:
+    config = json.load(f)
+    kv_backend = config.get("kv_store", "sqlite")
+    kv_store_path = config.get("kv_store_path", "cache/kv.sqlite3")
+
+# compressed snapshot (blob or local, see write_file) and the legacy
+# uncompressed JSON document it replaces
+kv_snapshot_path = "benchmarks/kv.json.gz"
+kv_legacy_path = "benchmarks/kv.json"
+
+
+class KVStore(MutableMapping):
+    """
+    Key-value state of the graph load (publication and topic hashes, see
+    `fns.graph_construction.extract_zip`), keyed by:
+        - <pub_name>: publication metadata
+        - <pub_name>:<lang>:<topic>: {"size", "sha256", "fingerprint"}
+
+    Stores are loaded lazily, on first access. Every write is tracked until
+    `commit`, so a load can checkpoint (and replay) only what it changed.
+    Implementations provide _load, _get, _set, _delete, _keys, _items,
+    _len, _prefixed, _commit and _rollback.
+    """
+
+    def __init__(self, snapshot_path=kv_snapshot_path, legacy_path=kv_legacy_path):
+        self.snapshot_path = snapshot_path
+        self.legacy_path = legacy_path
+        self._loaded = False
+        self._changes = {}
+        # the committed value (None if absent) of every key changed since
+        self._originals = {}
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self._loaded = True
+            self._load()
+
+    def _initial_state(self):
+        """
+        The state to start from: the compressed snapshot if there is one,
+        else the legacy JSON document, else nothing
+        """
+        try:
+            return json.loads(gzip.decompress(
+                read_file(self.snapshot_path, binary=True)))
+        except Exception:
+            pass
+        try:
+            return json.loads(read_file(self.legacy_path))
+        except Exception as e:
+            print(f"No kv state found ({e}), starting fresh")
+            return {}
+
+    def __getitem__(self, key):
+        self._ensure_loaded()
+        value = self._get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self._ensure_loaded()
+        if key not in self._originals:
+            self._originals[key] = self._get(key)
+        self._set(key, value)
+        self._changes[key] = value
+
+    def __delitem__(self, key):
+        self._ensure_loaded()
+        value = self._get(key)
+        if value is None:
+            raise KeyError(key)
+        self._originals.setdefault(key, value)
+        self._delete(key)
+        self._changes[key] = None
+
+    def __iter__(self):
+        self._ensure_loaded()
+        return iter(self._keys())
+
+    def __len__(self):
+        self._ensure_loaded()
+        return self._len()
+
+    def publication(self, pub_name):
+        """
+        The entries that belong to a publication (the publication itself
+        and its `<pub_name>:<lang>:<topic>` keys)
+        """
+        self._ensure_loaded()
+        return self._prefixed(pub_name)
+
+    def changes(self):
+        """
+        Everything written since the last commit ({key: value}, None for
+        deleted keys)
+        """
+        return dict(self._changes)
+
+    def apply(self, changes):
+        """
+        Replay `changes` (e.g., from a checkpoint)
+        """
+        for key, value in changes.items():
+            if value is None:
+                self.pop(key, None)
+            else:
+                self[key] = value
+
+    def commit(self, snapshot=False):
+        """
+        Persist the changes (and snapshot the state if snapshot=True)
+        """
+        self._ensure_loaded()
+        self._commit()
+        self._changes = {}
+        self._originals = {}
+        if snapshot:
+            return self.snapshot()
+
+    def rollback(self):
+        """
+        Discard the changes since the last commit (e.g., of a plan that was
+        only exported)
+        """
+        self._ensure_loaded()
+        self._rollback()
+        self._changes = {}
+        self._originals = {}
+
+    def snapshot(self, path=None):
+        """
+        Write a gzip compressed JSON snapshot of the whole state (e.g., to
+        blob storage), returning its size in bytes
+        """
+        self._ensure_loaded()
+        data = gzip.compress(json.dumps(self._items()).encode("utf-8"))
+        write_file(path or self.snapshot_path, data)
+        return len(data)
+
+
+class SQLiteKVStore(KVStore):
+    """
+    KVStore in an embedded SQLite database: point reads and writes by
+    primary key, and range scans for a publication's keys. The database is
+    seeded from the snapshot (or legacy JSON) the first time it is opened.
+    """
+
+    def __init__(self, path=kv_store_path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._db = None
+
+    def _load(self):
+        Path(os.path.dirname(self.path) or ".").mkdir(
+            parents=True, exist_ok=True)
+        self._db = sqlite3.connect(self.path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        if self._len() == 0:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)",
+                ((k, json.dumps(v)) for k, v in self._initial_state().items()))
+        self._db.commit()
+
+    def _get(self, key):
+        row = self._db.execute(
+            "SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _set(self, key, value):
+        self._db.execute(
+            "INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)",
+            (key, json.dumps(value)))
+
+    def _delete(self, key):
+        self._db.execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def _keys(self):
+        return [row[0] for row in self._db.execute("SELECT key FROM kv")]
+
+    def _items(self):
+        rows = self._db.execute("SELECT key, value FROM kv")
+        return {key: json.loads(value) for key, value in rows}
+
+    def _len(self):
+        return self._db.execute("SELECT COUNT(*) FROM kv").fetchone()[0]
+
+    def _prefixed(self, pub_name):
+        prefix = f"{pub_name}:"
+        rows = self._db.execute(
+            "SELECT key, value FROM kv WHERE key = ? OR (key >= ? AND key < ?)",
+            (pub_name, prefix, prefix + "\U0010ffff"))
+        return {key: json.loads(value) for key, value in rows}
+
+    def _commit(self):
+        self._db.commit()
+
+    def _rollback(self):
+        self._db.rollback()
+
+
+class JSONKVStore(KVStore):
+    """
+    KVStore held in memory and only persisted as a whole, by snapshots
+    (`commit(snapshot=True)`); for small states or when no local disk is
+    kept between runs
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._data = {}
+
+    def _load(self):
+        self._data = self._initial_state()
+
+    def _get(self, key):
+        return self._data.get(key)
+
+    def _set(self, key, value):
+        self._data[key] = value
+
+    def _delete(self, key):
+        del self._data[key]
+
+    def _keys(self):
+        return list(self._data)
+
+    def _items(self):
+        return dict(self._data)
+
+    def _len(self):
+        return len(self._data)
+
+    def _prefixed(self, pub_name):
+        prefix = f"{pub_name}:"
+        return {
+            k: v for k, v in self._data.items() if k == pub_name or k.startswith(prefix)
+        }
+
+    def _commit(self):
+        pass
+
+    def _rollback(self):
+        for key, value in self._originals.items():
+            if value is None:
+                self._data.pop(key, None)
+            else:
+                self._data[key] = value
+
+
+kv_backends = {
+    "sqlite": SQLiteKVStore,
+    "json": JSONKVStore,
+}
+
+
+def open_kv_store(backend=kv_backend, **kwargs):
+    """
+    Create the kv store configured in constants.json ("kv_store"); nothing
+    is read until it is first used
+    """
+    return kv_backends[backend](**kwargs)
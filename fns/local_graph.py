@@ -0,0 +1,247 @@
+"""
+In-memory property graph
+
+Holds the vertices and edges of GraphPlans (see `fns.azure_fns.spawn_plan`)
+or of an exported plan (see `fns.graph_plan.export_plan`), with adjacency
+indexes by label and direction, and answers the `graph_get_*` queries of
+`fns.azure_fns` in the same (GraphSON) shapes as Cosmos, so `graph_xf_props`
+and `fns.rag_fns` work unchanged. Needs no service, so the retrieval path
+can run offline (e.g., in tests) or without a round trip per lookup.
+
+example:
+```python
+from fns.azure_fns import use_local_graph
+from fns.local_graph import LocalGraph
+
+use_local_graph(LocalGraph.from_export("exports/2023-12-29"))
+graph_get_connected("COSMyEnterprise:en:Taxpayers", "parent")  # local
+```
+"""
+import random
+
+from statistics import mean
+
+from .graph_plan import graphson_vertex, import_plan
+
+directions = ["out", "in", "both"]
+stats = {
+    "mean": mean,
+    "max": max,
+    "min": min,
+    "sum": sum,
+    "count": len,
+}
+
+
+class LocalGraph:
+    """
+    Directed property graph held in memory
+
+    - vertices: {id: {"label": "topic", "properties": {...}}}
+    - out_edges: {from_id: {label: [to_id, ...]}}
+    - in_edges: {to_id: {label: [from_id, ...]}}
+
+    Vertices get the partition property (`partition_key`: `partition`) the
+    graph db adds on upsert (see `fns.azure_fns.upsert_node`). Edges to
+    vertices that were never added are kept, as in a partial load, but
+    only vertices that exist are returned.
+    """
+
+    def __init__(self, partition="en", partition_key="lang"):
+        self.partition = partition
+        self.partition_key = partition_key
+        self.vertices = {}
+        self.edges = set()
+        self.out_edges = {}
+        self.in_edges = {}
+
+    def __len__(self):
+        return len(self.vertices) + len(self.edges)
+
+    def __repr__(self):
+        return f"LocalGraph(vertices={len(self.vertices)}, edges={len(self.edges)})"
+
+    @classmethod
+    def from_plan(cls, plan, **kwargs):
+        """
+        Build a graph from a GraphPlan
+        """
+        return cls(**kwargs).add_plan(plan)
+
+    @classmethod
+    def from_export(cls, directory, **kwargs):
+        """
+        Build a graph from a plan written by `fns.graph_plan.export_plan`
+        """
+        graph = cls(**kwargs)
+        plan, _ = import_plan(directory, graph.partition_key)
+        return graph.add_plan(plan)
+
+    # === WRITE ===
+
+    def add_vertex(self, vertex_id, label, properties=None):
+        """
+        Add a vertex, setting its properties on an existing one (as an
+        upsert does)
+        """
+        vertex = self.vertices.get(vertex_id)
+        if vertex is None:
+            vertex = self.vertices[vertex_id] = {
+                "label": label,
+                "properties": {self.partition_key: self.partition},
+            }
+        if properties:
+            vertex["properties"].update(properties)
+        return self
+
+    def add_edge(self, from_id, label, to_id):
+        """
+        Add an edge (from_id)-[label]->(to_id), once
+        """
+        edge = (from_id, label, to_id)
+        if edge in self.edges:
+            return self
+        self.edges.add(edge)
+        self.out_edges.setdefault(from_id, {}).setdefault(label, []).append(to_id)
+        self.in_edges.setdefault(to_id, {}).setdefault(label, []).append(from_id)
+        return self
+
+    def add_plan(self, plan):
+        """
+        Apply the vertices and edges of a GraphPlan (e.g., of a reload)
+        """
+        for vertex_id, vertex in plan.vertices.items():
+            self.add_vertex(vertex_id, vertex["label"], vertex["properties"])
+        for from_id, label, to_id in plan.edges:
+            self.add_edge(from_id, label, to_id)
+        return self
+
+    def drop_vertex(self, vertex_id):
+        """
+        Remove a vertex and its edges
+        """
+        self.vertices.pop(vertex_id, None)
+        for label, to_ids in self.out_edges.pop(vertex_id, {}).items():
+            for to_id in to_ids:
+                self.edges.discard((vertex_id, label, to_id))
+                self.in_edges[to_id][label].remove(vertex_id)
+        for label, from_ids in self.in_edges.pop(vertex_id, {}).items():
+            for from_id in from_ids:
+                self.edges.discard((from_id, label, vertex_id))
+                self.out_edges[from_id][label].remove(vertex_id)
+        return self
+
+    # === TRAVERSAL ===
+
+    def adjacent(self, vertex_id, direction="out", label=None):
+        """
+        Ids at the other end of a vertex's edges (with label, if given), one
+        per edge, like gremlin's out()/in()/both()
+        """
+        if direction not in directions:
+            raise ValueError(f"Unknown direction: {direction}")
+        indexes = {
+            "out": [self.out_edges],
+            "in": [self.in_edges],
+            "both": [self.out_edges, self.in_edges],
+        }[direction]
+        ids = []
+        for index in indexes:
+            by_label = index.get(vertex_id, {})
+            if label is None:
+                for labelled in by_label.values():
+                    ids.extend(labelled)
+            else:
+                ids.extend(by_label.get(label, []))
+        return ids
+
+    def degree(self, vertex_id, direction="both", label=None):
+        """
+        Number of edges of a vertex in a direction
+        """
+        return len(self.adjacent(vertex_id, direction, label))
+
+    def element(self, vertex_id):
+        """
+        A vertex in the GraphSON form the graph db returns (see
+        `fns.graph_plan.graphson_vertex`)
+        """
+        vertex = self.vertices[vertex_id]
+        return graphson_vertex(vertex_id, vertex["label"], vertex["properties"])
+
+    def existing(self, vertex_ids):
+        """
+        The ids that are vertices of the graph, in order, without repeats
+        """
+        return [x for x in dict.fromkeys(vertex_ids) if x in self.vertices]
+
+    # === GET (see the graph_get_* functions in fns.azure_fns) ===
+
+    def get_connected(self, node_id, relation, prop_tuple=None, direction="out"):
+        """
+        g.V(node_id).<direction>(relation)[.has(key, value)].tree()
+        """
+        if node_id not in self.vertices:
+            return [{}]
+        children = {}
+        for child_id in self.existing(self.adjacent(node_id, direction, relation)):
+            if prop_tuple:
+                key, value = prop_tuple
+                if self.vertices[child_id]["properties"].get(key) != value:
+                    continue
+            children[child_id] = {"key": self.element(child_id), "value": {}}
+        if not children:
+            return [{}]
+        return [{node_id: {"key": self.element(node_id), "value": children}}]
+
+    def get_in_common(self, node_ids):
+        """
+        g.V(node_ids).aggregate('provided').both()
+         .where(without('provided')).groupCount()
+        """
+        provided = self.existing(node_ids)
+        counts = {}
+        for node_id in provided:
+            for other_id in self.adjacent(node_id, "both"):
+                if other_id in self.vertices and other_id not in provided:
+                    counts[other_id] = counts.get(other_id, 0) + 1
+        return [counts]
+
+    def get_most_connected(self, node_ids, direction="both", pop=True):
+        """
+        The vertices of node_ids by degree (most connected first), as
+        [{"vertex", "degree"}], or [vertex] of the first with pop=True
+        """
+        ranked = sorted(
+            (
+                {"vertex": self.element(x), "degree": self.degree(x, direction)}
+                for x in self.existing(node_ids)
+            ),
+            key=lambda x: x["degree"],
+            reverse=True,
+        )
+        if pop:
+            return [x["vertex"] for x in ranked[:1]]
+        return ranked
+
+    def get_connections(self, node_ids, direction="both", stat=None):
+        """
+        The degree of each of node_ids, or [stat] of the degrees (see
+        `stats`)
+        """
+        degrees = [self.degree(x, direction) for x in self.existing(node_ids)]
+        if stat is None:
+            return degrees
+        if not degrees and stat != "count":
+            return []
+        return [stats[stat](degrees)]
+
+    def get_mean(self, sample=500, direction="in"):
+        """
+        [mean degree] of a random sample of vertices
+        """
+        vertex_ids = list(self.vertices)
+        if not vertex_ids:
+            return []
+        sampled = random.sample(vertex_ids, min(sample, len(vertex_ids)))
+        return [mean(self.degree(x, direction) for x in sampled)]
@@ -1,10 +1,21 @@
 """os module"""
+import hashlib
 import json
 import os
+import contextvars
+import queue
+import threading
 import zipfile
 import shutil
 
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
 from datetime import datetime
+from functools import partial
 
 from langchain.docstore.document import Document
 from langchain.vectorstores.azuresearch import AzureSearch
@@ -13,6 +24,7 @@ from .artifactory_fns import (
     ArtifactoryPath,
     artifactory_base_url,
     content_prefix,
+    download_artifact,
     downloads_dir,
     extract_xml_from_zip,
     get_artifactory_metadata,
@@ -21,18 +33,35 @@ from .artifactory_fns import (
 )
 
 from .azure_fns import (
-    VECTOR_STORE_API_KEY,
-    VECTOR_STORE_URL,
     # VECTOR_IDX_NAME,
     # SEARCH_API_VERSION,
     create_index,
     delete_index,
     fields,
+    index_exists,
+    read_file,
     vector_search,
+    vector_store_credentials,
+    write_file,
 )
 from .markdown_fns import chunk_markdown, clean_w_md_tables
-from .openai_fns import default_token_sequence_length, embedding_function
+from .metrics import (
+    StageReport,
+    current_report,
+    print_report,
+    reporting,
+    run_reported,
+    run_reported_remote,
+    stage,
+    summarize_reports,
+)
+from .openai_fns import (
+    default_token_sequence_length,
+    embedding_cache,
+    embedding_function,
+)
 from .soup_fns import html2md_clean
+from .store import chunk_ids, chunk_key, upload_documents
 from .utils import RELATIVE_PATH
 
 # load constants.json from the root directory as a dictionary
@@ -107,14 +136,17 @@ def process_page(
     if topic_product:
         metadata["product"] = topic_product
 
-    markdown = html2md_clean(html_content)
-    partitions = chunk_markdown(
-        markdown,
-        max_tokens=max_tokens,
-        min_tokens=min_tokens,
-        omit_headings=omit_headings,
-        debug=debug,
-    )
+    with stage("html2md", items=1, bytes=len(html_content)):
+        markdown = html2md_clean(html_content)
+    with stage("chunk_markdown", bytes=len(markdown)) as counts:
+        partitions = chunk_markdown(
+            markdown,
+            max_tokens=max_tokens,
+            min_tokens=min_tokens,
+            omit_headings=omit_headings,
+            debug=debug,
+        )
+        counts["items"] = len(partitions)
 
     topic_metadata = {
         "topic_id": topic_id,
@@ -125,6 +157,63 @@ def process_page(
     return list(map(lambda x: xf_chunk(x, topic_metadata), partitions))
 
 
+def process_page_reported(report_name, *args, **kwargs):
+    """
+    `process_page` for a process pool worker, where no report is active:
+    returns (chunks, report) with its stages timed into a new StageReport
+    """
+    return run_reported_remote(
+        StageReport(report_name), process_page, *args, **kwargs)
+
+
+def topic_files(zip_file, prefix=content_prefix):
+    """
+    The topic (HTML) members of a publication zip
+    """
+    # We only care about files in the content directory that are HTML
+    return [
+        file_info for file_info in zip_file.infolist()
+        if file_info.filename.startswith(prefix) and file_info.filename.endswith(".html")
+    ]
+
+
+def read_topic(zip_file, file_info):
+    """
+    Read a topic member from the zip file, returning (topic_id, html_content)
+    """
+    # The topic id is the part between the last / and the .html
+    topic_id = file_info.filename.split("/")[-1].split(".")[0]
+    html_content = zip_file.read(file_info).decode("utf-8")
+    return topic_id, html_content
+
+
+def iter_publication(
+    zip_file,
+    publication_metadata,
+    prefix=content_prefix,
+    max_tokens=default_token_sequence_length,
+    min_tokens=30,
+    omit_headings=None,
+    debug=True,
+):
+    """
+    Lazily read and chunk the topics in a publication, yielding the list of
+    chunks of one topic at a time
+    """
+    if not omit_headings:
+        omit_headings = headings_to_omit
+
+    for file_info in topic_files(zip_file, prefix):
+        yield process_page(
+            publication_metadata,
+            *read_topic(zip_file, file_info),
+            max_tokens=max_tokens,
+            min_tokens=min_tokens,
+            omit_headings=omit_headings,
+            debug=debug,
+        )
+
+
 def process_publication(
     zip_file,
     publication_metadata,
@@ -133,50 +222,313 @@ def process_publication(
     min_tokens=30,
     omit_headings=None,
     debug=True,
+    workers=1,
+    min_parallel_topics=32,
 ):
     """
     Read all the topics in a publication and split them into chunks
+
+    workers > 1 processes topics in a process pool (results keep topic
+    order). Publications with fewer than min_parallel_topics topics are
+    processed serially, since spawning workers would cost more than it saves.
     """
     if not omit_headings:
         omit_headings = headings_to_omit
+
+    files = topic_files(zip_file, prefix)
+    topics = len(files)
+
     chunks = []
-    topics = 0
-    for file_info in zip_file.infolist():
-        # We only care about files in the content directory that are HTML
-        if file_info.filename.startswith(prefix) and file_info.filename.endswith(
-            ".html"
+    if workers > 1 and topics >= max(min_parallel_topics, 2):
+        report = current_report.get()
+        page = partial(
+            process_page_reported,
+            report.name if report is not None else "topics",
+            publication_metadata,
+            max_tokens=max_tokens,
+            min_tokens=min_tokens,
+            omit_headings=omit_headings,
+            debug=debug,
+        )
+        topic_ids, html_contents = zip(
+            *[read_topic(zip_file, file_info) for file_info in files])
+        chunksize = max(1, topics // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for split_sections, page_report in pool.map(page, topic_ids, html_contents, chunksize=chunksize):
+                chunks.extend(split_sections)
+                # the workers timed their stages into their own reports
+                if report is not None:
+                    report.merge(page_report)
+    else:
+        for split_sections in iter_publication(
+            zip_file,
+            publication_metadata,
+            prefix=prefix,
+            max_tokens=max_tokens,
+            min_tokens=min_tokens,
+            omit_headings=omit_headings,
+            debug=debug,
         ):
-            # The topic id is the part between the last / and the .html
-            topic_id = file_info.filename.split("/")[-1].split(".")[0]
-            html_content = zip_file.read(file_info).decode("utf-8")
-            split_sections = process_page(
+            # Add the chunks to the list of all sections
+            chunks.extend(split_sections)
+
+    print(f"...Found {topics} topics:")
+
+    return chunks, topics
+
+
+def stream_publication(
+    zip_file,
+    publication_metadata,
+    upload,
+    batch_size=100,
+    queue_depth=8,
+    prefix=content_prefix,
+    max_tokens=default_token_sequence_length,
+    min_tokens=30,
+    omit_headings=None,
+    debug=True,
+):
+    """
+    Chunk the topics in a publication on a background thread while the
+    calling thread hands batches of at least batch_size chunks to `upload`
+
+    Topics travel through a queue holding at most queue_depth topics, so
+    parsing blocks (backpressure) when uploads fall behind and peak memory is
+    bounded by the queue depth rather than the size of the publication.
+    Batches only ever contain whole topics.
+
+    returns (chunk_count, topic_count)
+    """
+    topics_queue = queue.Queue(maxsize=queue_depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                topics_queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def produce():
+        try:
+            for split_sections in iter_publication(
+                zip_file,
                 publication_metadata,
-                topic_id,
-                html_content,
+                prefix=prefix,
                 max_tokens=max_tokens,
                 min_tokens=min_tokens,
                 omit_headings=omit_headings,
                 debug=debug,
-            )
-            # Add the chunks to the list of all sections
-            chunks.extend(split_sections)
-            topics += 1
+            ):
+                put(split_sections)
+                if stop.is_set():
+                    return
+            put(done)
+        except Exception as e:
+            put(e)
+
+    # run in a copy of this context so stages land in the active report
+    producer = threading.Thread(
+        target=contextvars.copy_context().run, args=(produce,), daemon=True)
+    producer.start()
+
+    batch = []
+    chunk_count = 0
+    topic_count = 0
+    try:
+        while True:
+            item = topics_queue.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            topic_count += 1
+            batch.extend(item)
+            if len(batch) >= batch_size:
+                upload(batch)
+                chunk_count += len(batch)
+                batch = []
+        if batch:
+            upload(batch)
+            chunk_count += len(batch)
+    finally:
+        stop.set()
+        producer.join()
+
+    print(f"...Found {topic_count} topics:")
+
+    return chunk_count, topic_count
+
+
+def check_exists(manifest, art_path, art_meta):
+    """
+    Check if we already have this version of the publication indexed
+    """
+    previous = manifest.get(art_path.stem)
+    # a publication with chunks that failed to upload has no sha256 recorded
+    if previous and previous.get("sha256") == art_meta["sha256"]:
+        print(f"Hashes match, skipping {art_path.name}")
+        return True
+    return False
 
-    print(f"...Found {topics} topics:")
 
-    return chunks, topics
+def manifest_path(index_name):
+    """
+    Where the manifest of indexed publications/chunks is kept for an index
+    """
+    return f"benchmarks/{index_name}-manifest.json"
 
 
-def check_exists(file_path, art_path, art_meta):
+def load_manifest(index_name):
     """
-    Check if we already have this version of the publication
+    Load the manifest of what is currently in the index:
+    ```json
+    {
+        "<publication>": {
+            "sha256": "<artifactory sha256, null if any chunk failed to upload>",
+            "chunks": {"<stable id>": {"hash": "<content hash>", "key": "<index key>"}}
+        }
+    }
+    ```
     """
-    if os.path.exists(file_path):
-        with open(file_path) as infile:
-            previous_metadata = json.load(infile)
-        if previous_metadata["sha256"] == art_meta["sha256"]:
-            print(f"Hashes match, skipping {art_path.name}")
-            return
+    try:
+        return json.loads(read_file(manifest_path(index_name)))
+    except Exception as e:
+        print(f"No manifest found for {index_name} ({e}), starting fresh")
+        return {}
+
+
+def save_manifest(index_name, manifest):
+    """
+    Persist the manifest of what is currently in the index
+    """
+    write_file(manifest_path(index_name), json.dumps(manifest, indent=2))
+
+
+# artifact fields that change whenever the zip changes, even when a chunk's
+# content does not
+volatile_metadata = [
+    "created_time",
+    "modified_time",
+    "created_by",
+    "modified_by",
+    "size",
+    "sha1",
+    "sha256",
+    "md5",
+]
+
+
+def chunk_hash(chunk):
+    """
+    Hash the content and (non-volatile) metadata of a chunk
+    """
+    metadata = {
+        k: v for k, v in chunk.metadata.items() if k not in volatile_metadata
+    }
+    payload = json.dumps(
+        [chunk.page_content, metadata], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def delete_chunks(vector_store, keys, batch_size=1000):
+    """
+    Delete documents from the index by key
+    """
+    for i in range(0, len(keys), batch_size):
+        batch = keys[i: i + batch_size]
+        with stage("delete", items=len(batch)):
+            vector_store.client.delete_documents(
+                documents=[{"id": key} for key in batch])
+    print(f"   🗑 Deleted {len(keys)} chunks from vector store 🗑")
+
+
+def upsert_changed(vector_store, chunks, previous, current):
+    """
+    Upsert the chunks whose content hash differs from the `previous`
+    manifest entries, recording every chunk's entry in `current`. `chunks`
+    must contain whole topics (chunk ids count the order within a topic).
+
+    returns (changed chunks, stable ids of the chunks that failed to upload)
+    """
+    changed_ids = []
+    changed = []
+    for stable_id, chunk in zip(chunk_ids(chunks), chunks):
+        digest = chunk_hash(chunk)
+        prior = previous.get(stable_id)
+        if prior and prior["hash"] == digest:
+            current[stable_id] = prior
+            continue
+        current[stable_id] = {"hash": digest}
+        changed_ids.append(stable_id)
+        changed.append(chunk)
+
+    failed_ids = []
+    if changed:
+        print(f"...🌩 Upserting {len(changed)} changed chunks of {len(chunks)} 🌩")
+        uploaded = upload_documents(
+            vector_store, changed, keys=[chunk_key(x) for x in changed_ids])
+        failed = set(uploaded["failed"])
+        for stable_id, key in zip(changed_ids, uploaded["keys"]):
+            if key in failed:
+                # keep what was there before, so the next run retries it
+                failed_ids.append(stable_id)
+                if stable_id in previous:
+                    current[stable_id] = previous[stable_id]
+                else:
+                    del current[stable_id]
+            else:
+                current[stable_id]["key"] = key
+
+    return changed, failed_ids
+
+
+def remove_stale(vector_store, previous, current):
+    """
+    Delete the chunks in the `previous` manifest entries that are no longer
+    produced (not in `current`)
+    """
+    removed = [
+        previous[x]["key"] for x in previous
+        if x not in current and previous[x].get("key")
+    ]
+    if removed:
+        delete_chunks(vector_store, removed)
+    return removed
+
+
+def sync_publication(vector_store, pub_meta, chunks, manifest):
+    """
+    Upsert only the new/changed chunks of a publication and delete the
+    chunks it no longer produces, then record the result in the manifest.
+    The sha256 is only recorded once every chunk was uploaded, so a
+    publication with failed chunks is not skipped (see `check_exists`) and
+    the next run retries them.
+    """
+    pub_name = pub_meta["publication_name"]
+    previous = manifest.get(pub_name, {}).get("chunks", {})
+    current = {}
+    changed, failed = upsert_changed(vector_store, chunks, previous, current)
+    remove_stale(vector_store, previous, current)
+    record_publication(manifest, pub_meta, current, failed)
+    return changed
+
+
+def record_publication(manifest, pub_meta, chunks, failed):
+    """
+    Record a publication's indexed chunks in the manifest, with its sha256
+    only if no chunk `failed` to upload
+    """
+    pub_name = pub_meta["publication_name"]
+    if failed:
+        print(f"🔥 {len(failed)} chunks of {pub_name} failed to upload, retrying them next run")
+    manifest[pub_name] = {
+        "sha256": None if failed else pub_meta["sha256"],
+        "chunks": chunks,
+    }
 
 
 #   d8                      d8
@@ -187,22 +539,19 @@ def check_exists(file_path, art_path, art_meta):
 #  "88_/  "88___/  \_88P   "88_/
 
 
-def test_product_payload(path="2023-12-29/COSMyEnterprise"):
+def read_fixture(zip_filename):
     """
-    Test the process_publication function
+    Open a local publication zip and read its metadata, filling in the
+    Artifactory fields with placeholders (no network)
+
+    returns (zip_file, pub_meta)
     """
-    cwd = os.getcwd()
-    path = os.path.join(cwd, "downloads", path)
-    print("path:", path)
     # get current time yyyy-mm-dd
     cur_time = datetime.now().strftime("%Y-%m-%d")
 
-    pub_name = path.split("/")[-1]
+    pub_name = os.path.basename(zip_filename)[: -len(".zip")]
 
-    # If we already have this version, skip it
-    # check_exists(json_filename, path, art_meta)
-
-    zip_file = zipfile.ZipFile(path + ".zip")
+    zip_file = zipfile.ZipFile(zip_filename)
     xml = extract_xml_from_zip(zip_file)
 
     pub_meta = get_publication_metadata(xml)
@@ -214,7 +563,7 @@ def test_product_payload(path="2023-12-29/COSMyEnterprise"):
             "created_by": "logan",
             "modified_by": "logan",
             "mime_type": "application/zip",
-            "size": 10000,
+            "size": os.path.getsize(zip_filename),
             "sha1": "sha1",
             "sha256": "sha256",
             "md5": "md5",
@@ -223,6 +572,22 @@ def test_product_payload(path="2023-12-29/COSMyEnterprise"):
             "repo": False,
         }
     )
+    return zip_file, pub_meta
+
+
+def test_product_payload(path="2023-12-29/COSMyEnterprise"):
+    """
+    Test the process_publication function
+    (see fns.benchmark for timing many publications)
+    """
+    cwd = os.getcwd()
+    path = os.path.join(cwd, "downloads", path)
+    print("path:", path)
+
+    # If we already have this version, skip it
+    # check_exists(json_filename, path, art_meta)
+
+    zip_file, pub_meta = read_fixture(path + ".zip")
     chunks, topics = process_publication(
         zip_file=zip_file,
         publication_metadata=pub_meta,
@@ -235,46 +600,86 @@ def test_product_payload(path="2023-12-29/COSMyEnterprise"):
 # test_product_payload()
 
 
-def download_publication(
-    download_subdir,
-    vector_store,
-    path,
-    max_tokens=default_token_sequence_length,
-    min_tokens=30,
-    omit_headings=None,
-    debug=True,
-    skip=False,
-):
+def fetch_publication(download_subdir, path, manifest=None):
     """
-    Download a publication and read its metadata
-    """
-    if not omit_headings:
-        omit_headings = headings_to_omit
+    Download a publication zip from Artifactory (I/O bound stage)
 
-    art_meta = get_artifactory_metadata(path)
+    returns (zip_filename, pub_name, art_meta) or None if the publication is
+    skipped (too small, or unchanged since the last indexed `manifest`)
+    """
+    with stage("artifactory_stat", items=1):
+        art_meta = get_artifactory_metadata(path)
     pub_name = path.stem
     zip_filename = os.path.join(download_subdir, f"{pub_name}.zip")
-    json_filename = os.path.join(download_subdir, f"{pub_name}.json")
-    xml_filename = os.path.join(download_subdir, f"{pub_name}.xml")
 
     # If we already have this version, skip it
-    # check_exists(json_filename, path, art_meta)
+    if manifest is not None and check_exists(manifest, path, art_meta):
+        return
 
     if art_meta["size"] < 10000:
         print(f"File too small, was {art_meta['size']}, skipping {path.name}")
         return
 
     print(f"Downloading {path.name} to {zip_filename}")
-    with path.open() as infile, open(zip_filename, "wb") as outfile:
-        outfile.write(infile.read())
+    with stage("download", items=1, bytes=art_meta["size"]):
+        download_artifact(path, zip_filename, sha256=art_meta["sha256"])
+
+    return zip_filename, pub_name, art_meta
+
+
+def parse_publication(
+    zip_filename,
+    pub_name,
+    art_meta,
+    max_tokens=default_token_sequence_length,
+    min_tokens=30,
+    omit_headings=None,
+    debug=True,
+    topic_workers=1,
+):
+    """
+    Read the publication metadata from its XML and split its topics into
+    chunks (CPU bound stage, safe to run in a process pool)
+
+    returns (pub_meta, chunks)
+    """
+    zip_file, pub_meta = read_publication(zip_filename, pub_name, art_meta)
+
+    with stage("topics") as counts:
+        chunks, topics = process_publication(
+            zip_file,
+            pub_meta,
+            max_tokens=max_tokens,
+            min_tokens=min_tokens,
+            omit_headings=omit_headings,
+            debug=debug,
+            workers=topic_workers,
+        )
+        counts["items"] = topics
+
+    pub_meta["topic_count"] = topics
+    pub_meta["document_count"] = len(chunks)
+
+    return pub_meta, chunks
+
+
+def read_publication(zip_filename, pub_name, art_meta):
+    """
+    Open a downloaded publication zip and read its metadata from its XML
+
+    returns (zip_file, pub_meta)
+    """
+    xml_filename = zip_filename[: -len(".zip")] + ".xml"
 
     zip_file = zipfile.ZipFile(zip_filename)
-    xml = extract_xml_from_zip(zip_file)
+    with stage("xml", items=1) as counts:
+        xml = extract_xml_from_zip(zip_file)
+        counts["bytes"] = len(xml)
 
-    with open(xml_filename, "w") as xmlfile:
-        xmlfile.write(xml)
+        with open(xml_filename, "w") as xmlfile:
+            xmlfile.write(xml)
 
-    pub_meta = get_publication_metadata(xml)
+        pub_meta = get_publication_metadata(xml)
     pub_meta["publication_name"] = pub_name
     pub_meta.update(art_meta)
 
@@ -285,28 +690,359 @@ def download_publication(
     #    print(f"skipping non O Series Cloud product: {pub_meta['product']}")
     #    return []
 
-    chunks, topics = process_publication(
+    return zip_file, pub_meta
+
+
+def index_publication(
+    download_subdir,
+    vector_store,
+    pub_meta,
+    chunks,
+    skip=False,
+    manifest=None,
+):
+    """
+    Upload the chunks of a publication to the vector store and record its
+    metadata next to the downloaded zip (I/O bound stage)
+
+    If a `manifest` is provided, only changed chunks are upserted and
+    removed ones deleted (see `sync_publication`)
+    """
+    chunk_count = pub_meta["document_count"]
+    topics = pub_meta["topic_count"]
+
+    if not skip and manifest is not None:
+        sync_publication(vector_store, pub_meta, chunks, manifest)
+    elif not skip:
+        print(f"...🌩 Adding {chunk_count} chunks ({topics} topics) to index 🌩")
+        uploaded = upload_documents(vector_store, chunks)
+        print(
+            f"   🌩 Added {len(uploaded['keys']) - len(uploaded['failed'])} chunks to vector store 🌩")
+
+    write_publication_json(download_subdir, pub_meta)
+
+    return chunks
+
+
+def write_publication_json(download_subdir, pub_meta):
+    """
+    Record the metadata of a processed publication next to its zip
+    """
+    pub_name = pub_meta["publication_name"]
+    json_filename = os.path.join(download_subdir, f"{pub_name}.json")
+    with open(json_filename, "w") as outfile:
+        json.dump(pub_meta, outfile, indent=4)
+
+
+def write_publication_report(download_subdir, report):
+    """
+    Record the per-stage timing report of a publication next to its zip
+    """
+    report_filename = os.path.join(
+        download_subdir, f"{report.name}.report.json")
+    with open(report_filename, "w") as outfile:
+        json.dump(report.to_dict(), outfile, indent=4)
+
+
+def stream_index_publication(
+    download_subdir,
+    vector_store,
+    zip_filename,
+    pub_name,
+    art_meta,
+    batch_size=100,
+    queue_depth=8,
+    max_tokens=default_token_sequence_length,
+    min_tokens=30,
+    omit_headings=None,
+    debug=True,
+    skip=False,
+    manifest=None,
+):
+    """
+    Parse and upload a downloaded publication as a stream (see
+    `stream_publication`): chunks are uploaded in batches while later topics
+    are still being parsed, instead of all at once at the end
+
+    returns the number of chunks produced
+    """
+    zip_file, pub_meta = read_publication(zip_filename, pub_name, art_meta)
+
+    previous = manifest.get(pub_name, {}).get("chunks", {}) if manifest is not None else {}
+    current = {}
+    failed = []
+
+    def upload(batch):
+        if skip:
+            return
+        if manifest is not None:
+            failed.extend(upsert_changed(vector_store, batch, previous, current)[1])
+        else:
+            uploaded = upload_documents(vector_store, batch)
+            print(
+                f"   🌩 Added {len(uploaded['keys']) - len(uploaded['failed'])} chunks to vector store 🌩")
+
+    chunk_count, topics = stream_publication(
         zip_file,
         pub_meta,
+        upload,
+        batch_size=batch_size,
+        queue_depth=queue_depth,
         max_tokens=max_tokens,
         min_tokens=min_tokens,
         omit_headings=omit_headings,
         debug=debug,
     )
 
-    chunk_count = len(chunks)
+    if manifest is not None and not skip:
+        remove_stale(vector_store, previous, current)
+        record_publication(manifest, pub_meta, current, failed)
+
     pub_meta["topic_count"] = topics
     pub_meta["document_count"] = chunk_count
+    write_publication_json(download_subdir, pub_meta)
 
-    if not skip:
-        print(f"...🌩 Adding {chunk_count} chunks ({topics} topics) to index 🌩")
-        ids = vector_store.add_documents(chunks)
-        print(f"   🌩 Added {len(ids)} chunks to vector store 🌩")
+    return chunk_count
 
-    with open(json_filename, "w") as outfile:
-        json.dump(pub_meta, outfile, indent=4)
 
-    return chunks
+def download_publication(
+    download_subdir,
+    vector_store,
+    path,
+    max_tokens=default_token_sequence_length,
+    min_tokens=30,
+    omit_headings=None,
+    debug=True,
+    skip=False,
+    manifest=None,
+    topic_workers=1,
+    batch_size=None,
+    queue_depth=8,
+    report=None,
+):
+    """
+    Download a publication and read its metadata
+
+    With a batch_size, the publication is streamed: chunks are uploaded in
+    batches while parsing continues (see `stream_index_publication`) and the
+    number of chunks is returned instead of the chunks themselves
+
+    Each stage is timed into `report` (a StageReport), which is written to
+    `<publication>.report.json` next to the publication's JSON
+    """
+    if not omit_headings:
+        omit_headings = headings_to_omit
+
+    if report is None:
+        report = StageReport(path.stem)
+
+    with reporting(report):
+        result = _download_publication(
+            download_subdir,
+            vector_store,
+            path,
+            max_tokens=max_tokens,
+            min_tokens=min_tokens,
+            omit_headings=omit_headings,
+            debug=debug,
+            skip=skip,
+            manifest=manifest,
+            topic_workers=topic_workers,
+            batch_size=batch_size,
+            queue_depth=queue_depth,
+        )
+
+    if report.stages:
+        write_publication_report(download_subdir, report)
+
+    return result
+
+
+def _download_publication(
+    download_subdir,
+    vector_store,
+    path,
+    max_tokens,
+    min_tokens,
+    omit_headings,
+    debug,
+    skip,
+    manifest,
+    topic_workers,
+    batch_size,
+    queue_depth,
+):
+    fetched = fetch_publication(download_subdir, path, manifest=manifest)
+    if not fetched:
+        return
+
+    if batch_size:
+        return stream_index_publication(
+            download_subdir,
+            vector_store,
+            *fetched,
+            batch_size=batch_size,
+            queue_depth=queue_depth,
+            max_tokens=max_tokens,
+            min_tokens=min_tokens,
+            omit_headings=omit_headings,
+            debug=debug,
+            skip=skip,
+            manifest=manifest,
+        )
+
+    pub_meta, chunks = parse_publication(
+        *fetched,
+        max_tokens=max_tokens,
+        min_tokens=min_tokens,
+        omit_headings=omit_headings,
+        debug=debug,
+        topic_workers=topic_workers,
+    )
+
+    return index_publication(
+        download_subdir,
+        vector_store,
+        pub_meta,
+        chunks,
+        skip=skip,
+        manifest=manifest,
+    )
+
+
+def ingest_publications(
+    download_subdir,
+    vector_store,
+    paths,
+    workers=None,
+    io_workers=4,
+    max_tokens=default_token_sequence_length,
+    min_tokens=30,
+    omit_headings=None,
+    debug=False,
+    skip=False,
+    manifest=None,
+):
+    """
+    Ingest many publications concurrently:
+        - downloads and uploads run in a bounded thread pool (io_workers)
+        - XML metadata, html2md_clean and chunk_markdown run in a process
+          pool (workers, defaults to the number of cpus)
+
+    Each publication moves through fetch -> parse -> index as soon as its
+    previous step finishes, so downloads, parsing and uploads overlap.
+
+    returns a list of per-publication results (in the order of `paths`):
+    ```json
+    [
+        {"publication": "...", "status": "ok", "chunks": 40, "report": {...}},
+        {"publication": "...", "status": "skipped", "report": {...}},
+        {"publication": "...", "status": "error", "stage": "parse", "error": "...", "report": {...}}
+    ]
+    ```
+    """
+    if not omit_headings:
+        omit_headings = headings_to_omit
+
+    parse_args = {
+        "max_tokens": max_tokens,
+        "min_tokens": min_tokens,
+        "omit_headings": omit_headings,
+        "debug": debug,
+    }
+    results = {}
+    reports = {path.stem: StageReport(path.stem) for path in paths}
+
+    with ThreadPoolExecutor(max_workers=io_workers) as io_pool, \
+            ProcessPoolExecutor(max_workers=workers) as cpu_pool:
+        pending = {
+            io_pool.submit(
+                run_reported,
+                reports[path.stem],
+                fetch_publication,
+                download_subdir,
+                path,
+                manifest,
+            ): ("fetch", path.stem)
+            for path in paths
+        }
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                step, pub_name = pending.pop(future)
+                report = reports[pub_name]
+                try:
+                    value = future.result()
+                except Exception as e:
+                    print(f"🔥 {pub_name} failed during {step}: {e}")
+                    results[pub_name] = {
+                        "publication": pub_name,
+                        "status": "error",
+                        "stage": step,
+                        "error": repr(e),
+                        "report": report.to_dict(),
+                    }
+                    continue
+
+                if step == "fetch":
+                    if not value:
+                        results[pub_name] = {
+                            "publication": pub_name,
+                            "status": "skipped",
+                            "report": report.to_dict(),
+                        }
+                        continue
+                    parse = cpu_pool.submit(
+                        run_reported_remote,
+                        report,
+                        parse_publication,
+                        *value,
+                        **parse_args,
+                    )
+                    pending[parse] = ("parse", pub_name)
+                elif step == "parse":
+                    # the worker timed its stages into a copy of the report
+                    (pub_meta, chunks), report = value
+                    reports[pub_name] = report
+                    index = io_pool.submit(
+                        run_reported,
+                        report,
+                        index_publication,
+                        download_subdir,
+                        vector_store,
+                        pub_meta,
+                        chunks,
+                        skip=skip,
+                        manifest=manifest,
+                    )
+                    pending[index] = ("index", pub_name)
+                else:
+                    write_publication_report(download_subdir, report)
+                    results[pub_name] = {
+                        "publication": pub_name,
+                        "status": "ok",
+                        "chunks": len(value),
+                        "report": report.to_dict(),
+                    }
+                    print(f"✅ {pub_name}: {len(value)} chunks ingested")
+
+    return [results[path.stem] for path in paths]
+
+
+def clean_download_dir(download_subdir):
+    """
+    Remove what earlier runs left in a download directory (publication
+    json, reports, extracted files), except the publication zips and
+    partial `.zip.part` downloads: `download_artifact` skips a zip that
+    still has the expected hash and resumes a partial one
+    """
+    if not os.path.exists(download_subdir):
+        return
+    for entry in os.scandir(download_subdir):
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path)
+        elif not entry.name.endswith((".zip", ".zip.part")):
+            os.remove(entry.path)
 
 
 def process_environment(
@@ -319,19 +1055,39 @@ def process_environment(
     min_tokens=30,
     omit_headings=None,
     debug=True,
+    workers=1,
+    io_workers=4,
+    incremental=False,
+    topic_workers=1,
+    batch_size=None,
 ):
     """
     Process all the publications in an Artifactory environment
+
+    workers > 1 ingests publications in parallel (see `ingest_publications`),
+    otherwise topic_workers > 1 parallelizes the topics within each
+    publication (see `process_publication`) and batch_size streams each
+    publication into the index in batches (see `stream_index_publication`).
+    topic_workers and batch_size cannot be combined with workers > 1.
+
+    incremental=True keeps the existing index and only re-indexes what
+    changed since the last run (see `sync_publication`), instead of deleting
+    and rebuilding the whole index. The index is rebuilt anyway when there
+    is no manifest of it (see `load_manifest`).
     """
+    if workers > 1 and (topic_workers > 1 or batch_size):
+        raise ValueError(
+            "topic_workers and batch_size only apply when workers=1")
+
     if not omit_headings:
         omit_headings = headings_to_omit
 
     print(f"Processing {index_name}...")
     download_subdir = os.path.join(downloads_dir, index_name)
 
-    # empty the download directory between executions to ensure we only have the desired files
-    if os.path.exists(download_subdir):
-        shutil.rmtree(download_subdir)
+    # empty the download directory between executions to ensure we only have
+    # the desired files, keeping downloads to skip or resume them
+    clean_download_dir(download_subdir)
 
     artifactory_url = f"{artifactory_base_url}/knowmgmt-gen-publish/publish-prod/"
     print("artifactory_url:", artifactory_url)
@@ -339,32 +1095,48 @@ def process_environment(
     artifactory_path = ArtifactoryPath(artifactory_url)
     print("artifactory_path:", artifactory_path)
 
-    try:
-        print(f"Deleting index {index_name}")
-        response = delete_index(index_name=index_name, api_version=api_version)
-        print("Deletion response:", response)
-    except Exception as e:
-        print("Deletion failed:", e)
-
-    # while response.status_code == 403:
-    #    print(f"Waiting for index {index_name} to be deleted...")
-    #    time.sleep(5)
-    #    response = delete_index(index_name=index_name)
-
-    print(
-        f"Recreating and populating index {index_name}, api_version: {api_version}")
-
-    create_index(
-        index_name=index_name,
-        api_version=api_version,
-        efConstruction=ef_construction,
-        efSearch=ef_search,
-        m=m,
-    )
+    # the manifest is written on every run (rebuilds included), so the next
+    # incremental run knows the key of every document in the index
+    manifest = load_manifest(index_name) if incremental else {}
+
+    if incremental and manifest and index_exists(index_name=index_name, api_version=api_version):
+        print(f"Incrementally updating index {index_name}")
+    else:
+        if incremental:
+            # without a manifest, the documents already in the index are
+            # unknown (e.g., indexed by an older version) and would be
+            # duplicated
+            print(f"No manifest or index for {index_name}, rebuilding it")
+        # nothing from a previous manifest survives a new index
+        manifest.clear()
+        try:
+            print(f"Deleting index {index_name}")
+            response = delete_index(
+                index_name=index_name, api_version=api_version)
+            print("Deletion response:", response)
+        except Exception as e:
+            print("Deletion failed:", e)
+
+        # while response.status_code == 403:
+        #    print(f"Waiting for index {index_name} to be deleted...")
+        #    time.sleep(5)
+        #    response = delete_index(index_name=index_name)
+
+        print(
+            f"Recreating and populating index {index_name}, api_version: {api_version}")
+
+        create_index(
+            index_name=index_name,
+            api_version=api_version,
+            efConstruction=ef_construction,
+            efSearch=ef_search,
+            m=m,
+        )
     # time.sleep(5)
+    vector_store_url, vector_store_api_key = vector_store_credentials()
     vector_store = AzureSearch(
-        azure_search_endpoint=VECTOR_STORE_URL,
-        azure_search_key=VECTOR_STORE_API_KEY,
+        azure_search_endpoint=vector_store_url,
+        azure_search_key=vector_store_api_key,
         index_name=index_name,
         embedding_function=embedding_function,
         # fields are required upon upsertion of documents
@@ -382,20 +1154,73 @@ def process_environment(
     if not os.path.exists(download_subdir):
         os.makedirs(download_subdir)
 
+    whitelist = [x.lower() for x in publication_whitelist]
+    paths = []
     for path in artifactory_path:
-        if path.stem.lower() not in [x.lower() for x in publication_whitelist]:
+        if path.stem.lower() not in whitelist:
             print(f"Skipping publication: {path.stem}")
             continue
-        print("path:", path)
-        download_publication(
+        paths.append(path)
+
+    if workers > 1:
+        results = ingest_publications(
             download_subdir,
             vector_store,
-            path,
+            paths,
+            workers=workers,
+            io_workers=io_workers,
             max_tokens=max_tokens,
             min_tokens=min_tokens,
             omit_headings=omit_headings,
             debug=debug,
+            manifest=manifest,
         )
+        reports = [r["report"] for r in results]
+        ingested = [r for r in results if r["status"] == "ok"]
+        skipped = [r for r in results if r["status"] == "skipped"]
+        failures = [r for r in results if r["status"] == "error"]
+        print(
+            f"Ingested {len(ingested)} of {len(results)} publications"
+            f" ({len(skipped)} skipped, {len(failures)} failed)")
+        for failure in failures:
+            print(
+                f"🔥 {failure['publication']} ({failure['stage']}): {failure['error']}")
+    else:
+        reports = []
+        for path in paths:
+            print("path:", path)
+            report = StageReport(path.stem)
+            reports.append(report)
+            download_publication(
+                download_subdir,
+                vector_store,
+                path,
+                max_tokens=max_tokens,
+                min_tokens=min_tokens,
+                omit_headings=omit_headings,
+                debug=debug,
+                manifest=manifest,
+                topic_workers=topic_workers,
+                batch_size=batch_size,
+                report=report,
+            )
+
+    # publications that are no longer published (or whitelisted)
+    current = [path.stem for path in paths]
+    for pub_name in [x for x in manifest if x not in current]:
+        print(f"Removing unpublished publication: {pub_name}")
+        keys = [
+            x["key"] for x in manifest[pub_name]["chunks"].values() if x.get("key")
+        ]
+        delete_chunks(vector_store, keys)
+        del manifest[pub_name]
+    save_manifest(index_name, manifest)
+    embedding_cache.flush()
+
+    summary = summarize_reports(index_name, reports)
+    with open(os.path.join(download_subdir, "ingestion-report.json"), "w") as outfile:
+        json.dump(summary, outfile, indent=4)
+    print_report(summary)
 
     print(f"\n\n\n=============== FINISHED {index_name} ===============")
 
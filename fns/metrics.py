@@ -0,0 +1,165 @@
+import contextvars
+import threading
+import time
+
+from contextlib import contextmanager
+
+# the report that `stage` records into for the current thread/task
+current_report = contextvars.ContextVar("current_report", default=None)
+
+
+class StageReport:
+    """
+    Accumulates wall time, call and item counts, bytes and tokens per stage
+    of an ingestion run (e.g., one publication)
+
+    Reports are picklable, so they can be sent to a process pool and
+    returned with the results.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {"name": self.name, "stages": self.stages}
+
+    def __setstate__(self, state):
+        self.name = state["name"]
+        self.stages = state["stages"]
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, items=0, bytes=0, tokens=0):
+        """
+        Add a measurement to a stage
+        """
+        with self._lock:
+            stage = self.stages.setdefault(name, {
+                "seconds": 0.0,
+                "calls": 0,
+                "items": 0,
+                "bytes": 0,
+                "tokens": 0,
+            })
+            stage["seconds"] += seconds
+            stage["calls"] += 1
+            stage["items"] += items
+            stage["bytes"] += bytes
+            stage["tokens"] += tokens
+
+    @contextmanager
+    def stage(self, name, items=0, bytes=0, tokens=0):
+        """
+        Time a block as a stage. The yielded dict of counts can be filled in
+        by the block once they are known.
+        """
+        counts = {"items": items, "bytes": bytes, "tokens": tokens}
+        start = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            self.record(name, time.perf_counter() - start, **counts)
+
+    def merge(self, other):
+        """
+        Add the stages of another report (or its `to_dict`) into this one
+        """
+        stages = other["stages"] if isinstance(other, dict) else other.stages
+        with self._lock:
+            for name, theirs in stages.items():
+                ours = self.stages.setdefault(name, {
+                    "seconds": 0.0,
+                    "calls": 0,
+                    "items": 0,
+                    "bytes": 0,
+                    "tokens": 0,
+                })
+                for key in ours:
+                    ours[key] += theirs[key]
+        return self
+
+    def to_dict(self):
+        """
+        Machine-readable report, with per-stage throughput (per second of
+        wall time spent in the stage)
+        """
+        stages = {}
+        for name, stage in self.stages.items():
+            seconds = stage["seconds"]
+            stages[name] = {
+                **stage,
+                "items_per_second": stage["items"] / seconds if seconds else None,
+                "bytes_per_second": stage["bytes"] / seconds if seconds else None,
+                "tokens_per_second": stage["tokens"] / seconds if seconds else None,
+            }
+        return {"name": self.name, "stages": stages}
+
+
+@contextmanager
+def reporting(report):
+    """
+    Make `report` the active report for `stage` within the block
+    """
+    token = current_report.set(report)
+    try:
+        yield report
+    finally:
+        current_report.reset(token)
+
+
+@contextmanager
+def stage(name, items=0, bytes=0, tokens=0):
+    """
+    Time a block as a stage of the active report (a no-op without one)
+    """
+    report = current_report.get()
+    if report is None:
+        yield {"items": items, "bytes": bytes, "tokens": tokens}
+        return
+    with report.stage(name, items=items, bytes=bytes, tokens=tokens) as counts:
+        yield counts
+
+
+def run_reported(report, fn, *args, **kwargs):
+    """
+    Call fn with `report` active (e.g., inside a thread pool worker)
+    """
+    with reporting(report):
+        return fn(*args, **kwargs)
+
+
+def run_reported_remote(report, fn, *args, **kwargs):
+    """
+    Call fn with `report` active and return (result, report), for process
+    pools where the caller only sees a copy of the report
+    """
+    with reporting(report):
+        return fn(*args, **kwargs), report
+
+
+def summarize_reports(name, reports):
+    """
+    Aggregate many reports (e.g., one per publication) into a summary
+    """
+    summary = StageReport(name)
+    for report in reports:
+        summary.merge(report)
+    return {**summary.to_dict(), "reports": len(reports)}
+
+
+def print_report(report):
+    """
+    Pretty print a report (`to_dict` or `summarize_reports` output)
+    """
+    print(f"\n⏱  {report['name']} ⏱")
+    for name, stage in sorted(report["stages"].items(), key=lambda x: -x[1]["seconds"]):
+        rate = stage["items_per_second"]
+        print(
+            f"{name:>14}: {stage['seconds']:9.2f}s"
+            f" | {stage['calls']:6} calls"
+            f" | {stage['items']:8} items"
+            f" | {stage['bytes']:12} bytes"
+            f" | {stage['tokens']:9} tokens"
+            + (f" | {rate:9.1f} items/s" if rate else "")
+        )
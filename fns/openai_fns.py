@@ -1,39 +1,92 @@
+import functools
+import json
 import os
+import random
+import time
 
 import openai
 import requests
 import tiktoken
 
-from .keyvault import get_secret
+from langchain.embeddings.base import Embeddings
 
-OPENAI_BASE_URL = (
-    f"https://{get_secret('azure-openai-instance-name')}.openai.azure.com/"
-)
-EMBEDDINGS_API_VERSION = get_secret("azure-openai-embedding-api-version")
+from .embedding_cache import EmbeddingCache
+from .keyvault import get_secret
+from .metrics import stage
+from .utils import RELATIVE_PATH
 
-OPENAI_EMBEDDING_DEPLOYMENT = get_secret(
-    "azure-openai-embedding-api-deployment-name")
-OPENAI_API_KEY = get_secret("azure-openai-api-key")
-OPENAI_INSTANCE = get_secret("azure-openai-instance-name")
-OPENAI_DEPLOYMENT = get_secret("azure-openai-deployment-name")
+with open(f"{RELATIVE_PATH}constants.json") as f:
+    config = json.load(f)
 
-# replaces OPENAI_DEPLOYMENT (GPT-4) for now
+# replaces the default deployment (GPT-4) for now
 GPT35 = "VERX-GTP35-TURBO-ET"
 
-OPENAI_API_VERSION = get_secret("azure-openai-client-api-version")
-
 openai.api_type = "azure"
-openai.api_base = OPENAI_BASE_URL
-openai.api_version = OPENAI_API_VERSION
-openai.api_key = OPENAI_API_KEY
+
+
+@functools.cache
+def openai_settings():
+    """
+    The Azure OpenAI instance, deployments, api versions and key, read from
+    the key vault on first use, so importing this module needs no network
+    (e.g., for `fns.benchmark`)
+    """
+    settings = {
+        "instance": get_secret("azure-openai-instance-name"),
+        "embedding_api_version": get_secret("azure-openai-embedding-api-version"),
+        "embedding_deployment": get_secret("azure-openai-embedding-api-deployment-name"),
+        "api_key": get_secret("azure-openai-api-key"),
+        "deployment": get_secret("azure-openai-deployment-name"),
+        "api_version": get_secret("azure-openai-client-api-version"),
+    }
+    openai.api_base = f"https://{settings['instance']}.openai.azure.com/"
+    openai.api_version = settings["api_version"]
+    openai.api_key = settings["api_key"]
+    return settings
+
+
+def embeddings_url():
+    """
+    The embeddings endpoint of the embedding deployment
+    """
+    settings = openai_settings()
+    return f"https://{settings['instance']}.openai.azure.com/openai/deployments/{settings['embedding_deployment']}/embeddings?api-version={settings['embedding_api_version']}"
+
+
+def chat_url(deployment=None, api_version=None):
+    """
+    The chat completions endpoint of a deployment (the default one if None)
+    """
+    settings = openai_settings()
+    return f"https://{settings['instance']}.openai.azure.com/openai/deployments/{deployment or settings['deployment']}/chat/completions?api-version={api_version or settings['api_version']}"
+
+
+def api_headers():
+    """
+    Request headers for the Azure OpenAI api
+    """
+    return {"Content-Type": "application/json", "api-key": openai_settings()["api_key"]}
 
 
 # embeddings leaderboard https://huggingface.co/spaces/mteb/leaderboard
 embedding_model = "text-embedding-ada-002"
 default_token_sequence_length = 512
+# max inputs per embeddings request accepted by the Azure OpenAI deployment
+embedding_batch_size = 16
+# max (summed) tokens packed into a single embeddings request
+embedding_batch_tokens = 8191 * 4
+# statuses that mean "slow down and try again"
+retry_statuses = [429, 503]
 
 tokenizer = tiktoken.encoding_for_model(embedding_model)
 
+# vectors are keyed by (model/deployment, text), see EmbeddingCache
+embedding_cache = EmbeddingCache(
+    config.get("embedding_cache_dir", "cache/embeddings"),
+    max_bytes=config.get("embedding_cache_max_mb", 1024) * 1024 * 1024,
+    namespace=lambda: f"{embedding_model}:{openai_settings()['embedding_deployment']}",
+)
+
 
 def count_tokens(
     string: str,
@@ -46,29 +99,142 @@ def count_tokens(
     return num_tokens
 
 
+def post_embeddings(url, headers, body, retries=5, backoff=1.0, timeout=60):
+    """
+    POST an embeddings request, retrying throttled (429/503) responses after
+    the service's Retry-After (or exponential backoff with jitter)
+
+    returns the response JSON, raises requests.HTTPError for other errors
+    """
+    for attempt in range(retries + 1):
+        response = requests.post(url, headers=headers, json=body, timeout=timeout)
+        if response.status_code not in retry_statuses or attempt == retries:
+            response.raise_for_status()
+            return response.json()
+        try:
+            wait = float(response.headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            wait = backoff * (2 ** attempt) * (1 + random.random())
+        print(
+            f"Embeddings request throttled ({response.status_code}), retrying in {wait:.1f}s")
+        time.sleep(wait)
+
+
 def get_embeddings(query):
     """uses openai api to generate embeddings for a query"""
-    URL = f"https://{OPENAI_INSTANCE}.openai.azure.com/openai/deployments/{OPENAI_EMBEDDING_DEPLOYMENT}/embeddings?api-version={EMBEDDINGS_API_VERSION}"
+    cached = embedding_cache.get(query) if isinstance(query, str) else None
+    if cached is not None:
+        return cached
 
-    headers = {"Content-Type": "application/json", "api-key": OPENAI_API_KEY}
+    URL = embeddings_url()
+
+    headers = api_headers()
 
     body = {
         "input": query
     }
 
-    response = requests.post(URL, headers=headers, json=body, timeout=20)
+    results = post_embeddings(URL, headers, body, timeout=20)
+
+    embedding = results["data"][0]["embedding"]
+
+    if isinstance(query, str):
+        embedding_cache.put(query, embedding)
+
+    return embedding
+
+
+def batch_texts(
+    texts: list[str],
+    max_items: int = embedding_batch_size,
+    max_tokens: int = embedding_batch_tokens,
+) -> list[list[int]]:
+    """
+    Packs texts (in order) into batches of indices that stay within
+    max_items inputs and max_tokens summed tokens per batch. A single text
+    larger than max_tokens gets a batch of its own.
+    """
+    batches = []
+    batch = []
+    batch_tokens = 0
+    for i, text in enumerate(texts):
+        tokens = count_tokens(text)
+        if batch and (len(batch) >= max_items or batch_tokens + tokens > max_tokens):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(i)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def get_embeddings_batch(
+    texts: list[str],
+    max_items: int = embedding_batch_size,
+    max_tokens: int = embedding_batch_tokens,
+) -> list[list[float]]:
+    """
+    uses openai api to generate embeddings for many texts, sending as many
+    inputs per request as the item and token limits allow. Results are
+    returned in the same order as `texts`. Texts already in the
+    `embedding_cache` are not sent.
+    """
+    URL = embeddings_url()
 
-    results = response.json()
+    headers = api_headers()
+
+    embeddings = embedding_cache.get_many(texts)
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    misses = [texts[i] for i in missing]
+
+    for batch in batch_texts(misses, max_items=max_items, max_tokens=max_tokens):
+        body = {
+            "input": [misses[i] for i in batch]
+        }
 
-    return results["data"][0]["embedding"]
+        with stage("embed", items=len(batch)) as counts:
+            results = post_embeddings(URL, headers, body)
+            counts["tokens"] = results.get("usage", {}).get("total_tokens", 0)
+
+        # the api does not guarantee the order of `data`, `index` does
+        for item in results["data"]:
+            embeddings[missing[batch[item["index"]]]] = item["embedding"]
+
+    if missing:
+        embedding_cache.put_many(misses, [embeddings[i] for i in missing])
+
+    return embeddings
+
+
+class BatchedEmbeddings(Embeddings):
+    """
+    langchain Embeddings backed by `get_embeddings_batch`, so vector stores
+    (e.g., AzureSearch) embed documents in batches instead of one request
+    per document
+    """
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return get_embeddings_batch(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        return get_embeddings(text)
+
+    def __call__(self, text: str) -> list[float]:
+        # for callers that expect a plain `str -> vector` function
+        return self.embed_query(text)
+
+
+embedding_function = BatchedEmbeddings()
 
 
 def gen_summary(text, title, heading, max_tokens=default_token_sequence_length):
     """generates a summary of the text using the GPT-4 model"""
 
-    URL = f"https://{OPENAI_INSTANCE}.openai.azure.com/openai/deployments/{OPENAI_DEPLOYMENT}/chat/completions?api-version={openai.api_version}"
+    URL = chat_url()
 
-    headers = {"Content-Type": "application/json", "api-key": OPENAI_API_KEY}
+    headers = api_headers()
 
     body = {
         "messages": [
@@ -101,9 +267,9 @@ def gen_summary(text, title, heading, max_tokens=default_token_sequence_length):
 
 def summarize(text, max_tokens=default_token_sequence_length):
     """generates a summary of the text using the GPT-4 model"""
-    URL = f"https://{OPENAI_INSTANCE}.openai.azure.com/openai/deployments/{OPENAI_DEPLOYMENT}/chat/completions?api-version={openai.api_version}"
+    URL = chat_url()
 
-    headers = {"Content-Type": "application/json", "api-key": OPENAI_API_KEY}
+    headers = api_headers()
 
     body = {
         "messages": [
@@ -131,8 +297,8 @@ def summarize(text, max_tokens=default_token_sequence_length):
 def messages_prompt(
     messages: list[dict[str, str]],
     max_tokens=default_token_sequence_length,
-    deployment=OPENAI_DEPLOYMENT,
-    api_version=OPENAI_API_VERSION,
+    deployment=None,
+    api_version=None,
 ):
     """
     Basic wrapper for the openai's chat completion api. Input some messages with the following structure:
@@ -150,12 +316,9 @@ def messages_prompt(
     response = messages_prompt(messages)
     """
 
-    URL = f"https://{OPENAI_INSTANCE}.openai.azure.com/openai/deployments/{deployment}/chat/completions?api-version={api_version}"
+    URL = chat_url(deployment, api_version)
 
-    headers = {
-        "Content-Type": "application/json",
-        "api-key": OPENAI_API_KEY
-    }
+    headers = api_headers()
 
     # pretty print messages
     # print("messages_prompt messages:", json.dumps(messages, indent=2))
@@ -184,9 +347,9 @@ def text_generation(
     max_tokens=default_token_sequence_length
 ):
     """generates a summary of the text using the GPT-4 model"""
-    URL = f"https://{OPENAI_INSTANCE}.openai.azure.com/openai/deployments/{OPENAI_DEPLOYMENT}/chat/completions?api-version={openai.api_version}"
+    URL = chat_url()
 
-    headers = {"Content-Type": "application/json", "api-key": OPENAI_API_KEY}
+    headers = api_headers()
 
     body = {
         "messages": [
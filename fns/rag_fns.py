@@ -1,4 +1,5 @@
 import json
+from concurrent.futures import ThreadPoolExecutor
 from glom import glom
 from .openai_fns import (
     get_embeddings,
@@ -6,7 +7,6 @@ from .openai_fns import (
 )
 from .regex_fns import (
     generate_links,
-    no_special_chars
 )
 from .azure_fns import (
     search_kb,
@@ -45,25 +45,27 @@ def xf_related(payload: list[dict], spec: str = "0.*.value.*.key"):
 def get_community(query, lang="en"):
     results = search_kb(query)
     kb_payload = results["value"]
-    buffer = []
-    related = []
-    cleaned = []
-    for item in kb_payload:
+
+    def lookup(item):
+        """
+        Graph context for a search result: returns (clean, chunk_id, related)
+        """
         payload = pluck(item, ["metadata", "title",
-                        "content", "product", "heading", "@search.score"])
+                               "content", "product", "heading", "@search.score"])
         metadata = json.loads(payload["metadata"])
         url = metadata["community_url"]
-        cleaned.append({
+        clean = {
             "url": url,
             **omit(payload, ["metadata"]),
-        })
+        }
         modified_by = metadata["modified_by"]
         created_by = metadata["created_by"]
         title = payload["title"]
         content = payload["content"].strip()
         product = payload["product"]
         search_score = payload["@search.score"]
-        heading = no_special_chars(payload["heading"])
+        # stored in the graph exactly as ingested (bound, not escaped)
+        heading = payload["heading"]
         link = {
             heading: url
         }
@@ -96,12 +98,11 @@ def get_community(query, lang="en"):
             ))
         chunk_links = []
         if chunk_id:
-            buffer.append(chunk_id)
             chunk_links = xf_related(graph_get_connected(
                 chunk_id,
                 "related"
             ))
-        related.append({
+        return clean, chunk_id, {
             "url": url,
             "node_id": node_id,
             "heading": heading,
@@ -112,7 +113,15 @@ def get_community(query, lang="en"):
             "chunk_links": chunk_links,
             "related_articles": related_articles,
             "page_chunks": page_chunks,
-        })
+        }
+
+    # the graph lookups of every result overlap on the gremlin pool
+    with ThreadPoolExecutor(max_workers=max(1, len(kb_payload))) as pool:
+        looked_up = list(pool.map(lookup, kb_payload))
+    cleaned = [clean for clean, _, _ in looked_up]
+    buffer = [chunk_id for _, chunk_id, _ in looked_up if chunk_id]
+    related = [x for _, _, x in looked_up]
+
     # get the first two node ids from the related payload
 
     def get_specific_if_possible(x):
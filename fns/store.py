@@ -1,14 +1,31 @@
+import base64
+import json
+import random
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from azure.core.exceptions import HttpResponseError
 from langchain.vectorstores.azuresearch import AzureSearch
 
 from .azure_fns import (
-    VECTOR_STORE_API_KEY,
-    VECTOR_STORE_URL,
     create_index,
     fields,
     vector_search,
+    vector_store_credentials,
 )
+from .metrics import current_report, run_reported, stage
 from .openai_fns import embedding_function
 
+# Azure Search limits for a single indexing request
+max_batch_documents = 1000
+# 16 MB per request, with headroom for the request envelope
+max_batch_bytes = 15 * 1024 * 1024
+# batches in flight at once
+upload_concurrency = 4
+# statuses that mean "slow down and try again"
+retry_statuses = [429, 503]
+
 
 def create(
     index_name: str,
@@ -27,9 +44,10 @@ def create(
         m=m,
     )
 
+    vector_store_url, vector_store_api_key = vector_store_credentials()
     index = AzureSearch(
-        azure_search_endpoint=VECTOR_STORE_URL,
-        azure_search_key=VECTOR_STORE_API_KEY,
+        azure_search_endpoint=vector_store_url,
+        azure_search_key=vector_store_api_key,
         index_name=index_name,
         embedding_function=embed_fn,
         # fields are required upon upsertion of documents
@@ -46,9 +64,211 @@ def create(
     return index
 
 
+def chunk_key(stable_id):
+    """
+    Encode a stable chunk id into a valid Azure Search document key
+    (letters, digits, dashes, underscores and equal signs only)
+    """
+    return base64.urlsafe_b64encode(stable_id.encode("utf-8")).decode("ascii")
+
+
+def chunk_ids(chunks):
+    """
+    Stable ids for chunks, derived from publication, topic and chunk order
+    within the topic: `<publication>:<topic_id>:<order>`
+    """
+    orders = {}
+    ids = []
+    for chunk in chunks:
+        topic = (chunk.metadata["publication_name"], chunk.metadata["topic_id"])
+        order = orders.get(topic, 0)
+        orders[topic] = order + 1
+        ids.append(f"{topic[0]}:{topic[1]}:{order}")
+    return ids
+
+
+def to_search_documents(store, chunks, keys=None):
+    """
+    Embed (in batches) and shape langchain Documents into Azure Search
+    documents, the same way AzureSearch.add_texts does: id, content,
+    content_vector, metadata (as JSON) plus any metadata that matches an
+    index field (e.g., product, tax_process)
+
+    Without keys, documents are keyed by their stable chunk id (see
+    `chunk_ids`, chunks must then contain whole topics), so uploading a
+    chunk again replaces it instead of adding a copy
+    """
+    texts = [chunk.page_content for chunk in chunks]
+    embed = store.embedding_function
+    if hasattr(embed, "embed_documents"):
+        vectors = embed.embed_documents(texts)
+    else:
+        vectors = [embed(text) for text in texts]
+    field_names = [field.name for field in store.fields]
+    if keys is None:
+        keys = [chunk_key(x) for x in chunk_ids(chunks)]
+    return [
+        {
+            **{k: v for k, v in chunk.metadata.items() if k in field_names},
+            "id": key,
+            "content": text,
+            "content_vector": vector,
+            "metadata": json.dumps(chunk.metadata),
+        }
+        for key, text, vector, chunk in zip(keys, texts, vectors, chunks)
+    ]
+
+
+def split_batches(
+    documents,
+    max_documents=max_batch_documents,
+    max_bytes=max_batch_bytes,
+):
+    """
+    Split documents into batches within the request document count and
+    (serialized) size limits
+
+    returns a list of (batch, bytes)
+    """
+    batches = []
+    batch = []
+    batch_bytes = 0
+    for document in documents:
+        size = len(json.dumps(document).encode("utf-8"))
+        if batch and (len(batch) >= max_documents or batch_bytes + size > max_bytes):
+            batches.append((batch, batch_bytes))
+            batch = []
+            batch_bytes = 0
+        batch.append(document)
+        batch_bytes += size
+    if batch:
+        batches.append((batch, batch_bytes))
+    return batches
+
+
+def retry_after(error, attempt, backoff):
+    """
+    Seconds to wait before retrying: the service's Retry-After header if
+    present, otherwise exponential backoff with jitter
+    """
+    response = getattr(error, "response", None)
+    header = response.headers.get("Retry-After") if response is not None else None
+    if header:
+        try:
+            return float(header)
+        except ValueError:
+            pass
+    return backoff * (2 ** attempt) * (1 + random.random())
+
+
+def upload_batch(client, batch, retries=5, backoff=1.0):
+    """
+    Upload a batch of documents, retrying throttled requests (and throttled
+    documents within a partially failed batch) with backoff
+
+    returns the keys of documents that still failed: those that failed for
+    good on any attempt (e.g., 400) and those still throttled after the last
+    """
+    pending = batch
+    # documents that failed with a status that is not worth retrying
+    rejected = []
+    for attempt in range(retries + 1):
+        try:
+            results = client.upload_documents(documents=pending)
+        except HttpResponseError as e:
+            if e.status_code == 413 and len(pending) > 1:
+                # too large after all: split it in two
+                half = len(pending) // 2
+                return rejected + \
+                    upload_batch(client, pending[:half], retries, backoff) + \
+                    upload_batch(client, pending[half:], retries, backoff)
+            if e.status_code not in retry_statuses or attempt == retries:
+                raise
+            time.sleep(retry_after(e, attempt, backoff))
+            continue
+        failed = {x.key: x for x in results if not x.succeeded}
+        retryable = [
+            doc for doc in pending
+            if doc["id"] in failed and failed[doc["id"]].status_code in retry_statuses
+        ]
+        if not retryable or attempt == retries:
+            return rejected + list(failed)
+        rejected += [
+            key for key, x in failed.items() if x.status_code not in retry_statuses
+        ]
+        pending = retryable
+        time.sleep(backoff * (2 ** attempt) * (1 + random.random()))
+    return rejected + [doc["id"] for doc in pending]
+
+
+def upload_documents(
+    store,
+    chunks,
+    keys=None,
+    concurrency=upload_concurrency,
+    max_documents=max_batch_documents,
+    max_bytes=max_batch_bytes,
+    retries=5,
+    backoff=1.0,
+):
+    """
+    Upload langchain Documents to an AzureSearch vector store:
+        - embeds them in batches (see `to_search_documents`)
+        - splits them into batches within the service's request limits
+        - sends up to `concurrency` batches at once
+        - retries throttled (429/503) batches with backoff
+
+    returns:
+    ```json
+    {
+        "keys": ["<key per chunk, in order>"],
+        "failed": ["<keys that could not be uploaded>"],
+        "batches": [{"documents": 1000, "bytes": 123, "seconds": 1.2, "failed": 0}]
+    }
+    ```
+    """
+    documents = to_search_documents(store, chunks, keys=keys)
+    batches = split_batches(
+        documents, max_documents=max_documents, max_bytes=max_bytes)
+
+    def send(batch, size):
+        with stage("upload", items=len(batch), bytes=size):
+            start = time.perf_counter()
+            try:
+                failed = upload_batch(store.client, batch, retries, backoff)
+            except HttpResponseError as e:
+                print(f"🔥 Batch of {len(batch)} documents failed: {e}")
+                failed = [doc["id"] for doc in batch]
+            seconds = time.perf_counter() - start
+        return {
+            "documents": len(batch),
+            "bytes": size,
+            "seconds": seconds,
+            "failed": failed,
+        }
+
+    # batches are timed into the caller's active report
+    report = current_report.get()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        reports = list(pool.map(
+            lambda x: run_reported(report, send, *x), batches))
+
+    failed = [key for report in reports for key in report["failed"]]
+    for i, report in enumerate(reports):
+        print(
+            f"   📦 batch {i}: {report['documents']} docs, {report['bytes']} bytes in {report['seconds']:.2f}s"
+            + (f", {len(report['failed'])} failed" if report["failed"] else ""))
+    return {
+        "keys": [doc["id"] for doc in documents],
+        "failed": failed,
+        "batches": [{**x, "failed": len(x["failed"])} for x in reports],
+    }
+
+
 def hydrate(store, chunks):
     """
     Hydrate a vector store with the given chunks
     """
-    ids = store.add_documents(chunks)
-    print(f"Added {len(ids)} documents to {store.index_name}")
+    uploaded = upload_documents(store, chunks)
+    print(
+        f"Added {len(uploaded['keys']) - len(uploaded['failed'])} documents to {store.index_name}")
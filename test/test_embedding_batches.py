@@ -0,0 +1,39 @@
+import pytest
+
+# needs the openai dependencies installed (and tiktoken's encoding cached)
+openai_fns = pytest.importorskip("fns.openai_fns")
+
+
+@pytest.fixture(autouse=True)
+def word_tokens(monkeypatch):
+    """
+    Count a token per word, so batches don't depend on the tokenizer
+    """
+    monkeypatch.setattr(openai_fns, "count_tokens", lambda text: len(text.split()))
+
+
+def test_batches_keep_order():
+    texts = ["a", "b c", "d", "e f g"]
+    batches = openai_fns.batch_texts(texts, max_items=16, max_tokens=100)
+    assert batches == [[0, 1, 2, 3]]
+    assert openai_fns.batch_texts([], max_items=16, max_tokens=100) == []
+
+
+def test_count_limit():
+    texts = [f"text {i}" for i in range(5)]
+    assert openai_fns.batch_texts(texts, max_items=2, max_tokens=100) == [
+        [0, 1], [2, 3], [4]]
+
+
+def test_token_limit():
+    texts = ["a b", "c d", "e", "f g h"]
+    assert openai_fns.batch_texts(texts, max_items=16, max_tokens=4) == [
+        [0, 1], [2, 3]]
+    assert openai_fns.batch_texts(texts, max_items=16, max_tokens=3) == [
+        [0], [1, 2], [3]]
+
+
+def test_text_over_the_token_limit_is_sent_alone():
+    texts = ["a", "b c d e f", "g"]
+    assert openai_fns.batch_texts(texts, max_items=16, max_tokens=3) == [
+        [0], [1], [2]]
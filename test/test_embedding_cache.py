@@ -0,0 +1,96 @@
+import json
+
+from fns.embedding_cache import EmbeddingCache
+
+
+def cache_in(tmp_path, slots=10, dims=2, **kwargs):
+    return EmbeddingCache(str(tmp_path), max_bytes=slots * dims * 4, **kwargs)
+
+
+def entries_on_disk(tmp_path):
+    with open(tmp_path / "index.json", encoding="utf-8") as f:
+        return json.load(f)["entries"]
+
+
+def test_hit_and_miss(tmp_path):
+    cache = cache_in(tmp_path)
+    assert cache.get("a") is None
+    cache.put("a", [0.5, 1.0])
+    assert cache.get("a") == [0.5, 1.0]
+    assert cache.get_many(["a", "b"]) == [[0.5, 1.0], None]
+    assert cache.stats() == {
+        "hits": 2,
+        "misses": 2,
+        "hit_rate": 0.5,
+        "evictions": 0,
+        "entries": 1,
+        "capacity": 10,
+    }
+
+
+def test_put_replaces_in_place(tmp_path):
+    cache = cache_in(tmp_path)
+    cache.put("a", [0.5, 1.0])
+    cache.put("a", [2.0, 3.0])
+    assert cache.get("a") == [2.0, 3.0]
+    assert cache.stats()["entries"] == 1
+
+
+def test_lru_eviction_reuses_slots(tmp_path):
+    cache = cache_in(tmp_path)
+    texts = [f"text {i}" for i in range(10)]
+    cache.put_many(texts, [[float(i), 0.0] for i in range(10)])
+    slot = {text: cache._entries[cache.key(text)][0] for text in texts}
+    # text 0 is now more recently used than text 1
+    cache.get("text 0")
+
+    cache.put("new", [10.0, 0.0])
+
+    assert cache.stats()["evictions"] == 1
+    assert cache.get("text 1") is None
+    assert cache.get("text 0") == [0.0, 0.0]
+    assert cache.get("new") == [10.0, 0.0]
+    # the evicted slot was reused, and the index on disk was written
+    # without the evicted entry before its slot was overwritten
+    assert cache._entries[cache.key("new")][0] == slot["text 1"]
+    assert cache.key("text 1") not in entries_on_disk(tmp_path)
+
+
+def test_reload_from_disk(tmp_path):
+    cache = cache_in(tmp_path)
+    cache.put_many(["a", "b"], [[0.5, 1.0], [1.5, 2.0]])
+    cache.flush()
+
+    reloaded = cache_in(tmp_path)
+    assert reloaded.get_many(["a", "b", "c"]) == [[0.5, 1.0], [1.5, 2.0], None]
+    reloaded.put("c", [2.5, 3.0])
+    # new vectors take free slots, not those of reloaded entries
+    assert reloaded.get_many(["a", "b", "c"]) == [[0.5, 1.0], [1.5, 2.0], [2.5, 3.0]]
+    assert reloaded.stats()["capacity"] == 10
+
+
+def test_flush_every(tmp_path):
+    cache = cache_in(tmp_path, flush_every=2)
+    cache.put("a", [0.5, 1.0])
+    assert not (tmp_path / "index.json").exists()
+    cache.put("b", [0.5, 1.0])
+    assert set(entries_on_disk(tmp_path)) == {cache.key("a"), cache.key("b")}
+
+
+def test_namespaces_are_isolated(tmp_path):
+    first = cache_in(tmp_path, namespace="model-a")
+    first.put("a", [0.5, 1.0])
+    first.flush()
+
+    second = cache_in(tmp_path, namespace=lambda: "model-b")
+    assert second.get("a") is None
+    assert first.key("a") != second.key("a")
+    assert cache_in(tmp_path, namespace="model-a").get("a") == [0.5, 1.0]
+
+
+def test_dimension_mismatch_is_ignored(tmp_path):
+    cache = cache_in(tmp_path)
+    cache.put("a", [0.5, 1.0])
+    cache.put("b", [0.5, 1.0, 1.5])
+    assert cache.get("b") is None
+    assert cache.stats()["entries"] == 1
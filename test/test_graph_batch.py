@@ -0,0 +1,55 @@
+import pytest
+
+# needs the gremlin dependencies installed (not a live service)
+graph = pytest.importorskip("fns.graph")
+
+
+def test_as_statement():
+    assert graph.as_statement("g.V(_id).drop()") == "__.V(_id).drop()"
+    assert graph.as_statement("__.V(_id)") == "__.V(_id)"
+
+
+def test_rebind():
+    query, bindings = graph.rebind(
+        "g.V(_k1).property(_k1, _k10)", {"_k1": "a", "_k10": "b"}, "_3")
+    assert query == "g.V(_k1_3).property(_k1_3, _k10_3)"
+    assert bindings == {"_k1_3": "a", "_k10_3": "b"}
+
+
+def test_compose_batch():
+    single = ("g.V(_id).drop()", {"_id": "a"})
+    assert graph.compose_batch([single]) == single
+
+    query, bindings = graph.compose_batch([
+        ("g.V(_id).drop()", {"_id": "a"}),
+        ("g.V(_id).drop()", {"_id": "b"}),
+    ])
+    assert query == (
+        "g.inject(0)"
+        ".sideEffect(__.V(_id_0).drop())"
+        ".sideEffect(__.V(_id_1).drop())"
+    )
+    assert bindings == {"_id_0": "a", "_id_1": "b"}
+
+
+def test_compose_batch_text_only_depends_on_shape():
+    first, _ = graph.compose_batch([
+        ("g.V(_id)", {"_id": "a"}),
+        ("g.V(_id)", {"_id": "b"}),
+    ])
+    second, _ = graph.compose_batch([
+        ("g.V(_id)", {"_id": "c"}),
+        ("g.V(_id)", {"_id": "d"}),
+    ])
+    assert first == second
+
+
+def test_batch_queries():
+    queries = [("g.V(_id)", {"_id": str(i)}) for i in range(5)]
+    assert graph.batch_queries(queries, max_statements=2) == [[0, 1], [2, 3], [4]]
+
+    size = len("g.inject(0)") + 2 * (graph.query_size(queries[0]) + len(".sideEffect()"))
+    assert graph.batch_queries(queries, max_chars=size) == [[0, 1], [2, 3], [4]]
+
+    # a query longer than max_chars is sent alone
+    assert graph.batch_queries(queries[:2], max_chars=1) == [[0], [1]]
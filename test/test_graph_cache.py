@@ -0,0 +1,135 @@
+import pytest
+
+from fns import graph_cache as graph_cache_module
+from fns.graph_cache import GraphCache, id_key, vertex_ids
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(graph_cache_module.time, "monotonic", clock)
+    return clock
+
+
+def vertex(vertex_id):
+    return {"id": vertex_id, "label": "chunk", "type": "vertex", "properties": {}}
+
+
+def test_vertex_ids():
+    tree = [{"T": {"key": vertex("T"), "value": {
+        "C": {"key": vertex("C"), "value": {}},
+    }}}]
+    assert sorted(vertex_ids(tree)) == ["C", "T"]
+    assert vertex_ids([{"T": 3}]) == []
+
+
+def test_id_key():
+    assert id_key(["b", "a", "b"]) == id_key(["a", "b"]) == ("a", "b")
+
+
+def test_get_put():
+    cache = GraphCache()
+    assert cache.get("k") is None
+    cache.put("k", [1])
+    assert cache.get("k") == [1]
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["hit_rate"] == 0.5
+
+
+def test_none_is_not_cached():
+    cache = GraphCache()
+    cache.put("k", None)
+    assert len(cache) == 0
+
+
+def test_ttl(clock):
+    cache = GraphCache(ttl=10)
+    cache.put("k", [1])
+    clock.now = 9
+    assert cache.get("k") == [1]
+    clock.now = 11
+    assert cache.get("k") is None
+    assert cache.stats()["expirations"] == 1
+    assert len(cache) == 0
+
+
+def test_lru_eviction():
+    cache = GraphCache(max_entries=2)
+    cache.put("a", [1], ids=["A"])
+    cache.put("b", [2], ids=["B"])
+    # a is now the most recently used
+    cache.get("a")
+    cache.put("c", [3], ids=["C"])
+    assert cache.get("b") is None
+    assert cache.get("a") == [1]
+    assert cache.get("c") == [3]
+    assert cache.stats()["evictions"] == 1
+    # the evicted entry is no longer indexed by its ids
+    assert "B" not in cache._by_id
+
+
+def test_invalidate_by_id():
+    cache = GraphCache()
+    cache.put("connected", [1], ids=["T", "C"])
+    cache.put("in_common", [2], ids=["C", "D"])
+    cache.put("other", [3], ids=["X"])
+    cache.invalidate(["C"])
+    assert cache.get("connected") is None
+    assert cache.get("in_common") is None
+    assert cache.get("other") == [3]
+    assert cache.stats()["invalidations"] == 2
+    assert set(cache._by_id) == {"X"}
+
+
+def test_put_after_invalidation_is_dropped():
+    cache = GraphCache()
+    generation = cache.generation
+    # a write lands while the read is in flight
+    cache.invalidate(["T"])
+    cache.put("k", [1], ids=["T"], generation=generation)
+    assert cache.get("k") is None
+
+
+def test_fetch():
+    cache = GraphCache()
+    calls = []
+
+    def query():
+        calls.append(1)
+        return [{"T": {"key": vertex("T"), "value": {}}}]
+
+    first = cache.fetch("k", query, lambda x: vertex_ids(x))
+    assert cache.fetch("k", query, lambda x: vertex_ids(x)) is first
+    assert len(calls) == 1
+    cache.invalidate(["T"])
+    cache.fetch("k", query, lambda x: vertex_ids(x))
+    assert len(calls) == 2
+
+
+def test_fetch_does_not_cache_failures():
+    cache = GraphCache()
+    assert cache.fetch("k", lambda: None, lambda x: list(x)) is None
+    assert len(cache) == 0
+
+
+def test_clear():
+    cache = GraphCache()
+    cache.put("k", [1], ids=["T"])
+    cache.clear()
+    assert len(cache) == 0
+    assert cache._by_id == {}
+
+
+def test_disabled():
+    cache = GraphCache(max_entries=0)
+    cache.put("k", [1])
+    assert cache.get("k") is None
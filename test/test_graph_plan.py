@@ -0,0 +1,106 @@
+import json
+
+from fns.graph_plan import GraphPlan, export_plan, import_plan
+
+
+def sample_plan():
+    plan = GraphPlan()
+    plan.add_vertex("Pub", "publication", {"title": "Pub"})
+    plan.add_vertex("Pub:en:1", "topic", {"title": "One"})
+    plan.add_vertex("Pub:en:1:0", "chunk", {"heading": "Intro", "order": 0})
+    plan.add_edge("Pub", "parent", "Pub:en:1")
+    plan.add_edge("Pub:en:1", "parent", "Pub:en:1:0")
+    plan.add_edge("Pub:en:1:0", "child", "Pub:en:1")
+    plan.set_manifest("Pub", ["Pub:en:1"])
+    return plan
+
+
+def test_add_vertex_merges_properties():
+    plan = GraphPlan()
+    plan.add_vertex("Pub:en:2", None, {"title": "stub"})
+    plan.add_vertex("Pub:en:2", "topic", {"title": "Two", "md": "..."})
+    assert plan.vertices["Pub:en:2"] == {
+        "label": "topic",
+        "properties": {"title": "Two", "md": "..."},
+    }
+
+
+def test_add_edge_is_idempotent():
+    plan = GraphPlan().add_edge("a", "parent", "b").add_edge("a", "parent", "b")
+    assert plan.edges == {("a", "parent", "b")}
+    assert len(plan) == 1
+
+
+def test_merge():
+    plan = sample_plan()
+    other = GraphPlan()
+    other.add_vertex("Pub:en:1", "topic", {"md": "# One"})
+    other.add_vertex("Pub:en:2", "topic", {"title": "Two"})
+    other.add_edge("Pub", "parent", "Pub:en:2")
+    other.set_manifest("Pub", ["Pub:en:2"])
+
+    plan.merge(other).merge(None)
+
+    assert plan.vertices["Pub:en:1"]["properties"] == {"title": "One", "md": "# One"}
+    assert "Pub:en:2" in plan.vertices
+    assert ("Pub", "parent", "Pub:en:2") in plan.edges
+    assert plan.manifests == {"Pub": {"Pub:en:1", "Pub:en:2"}}
+
+
+def test_dict_round_trip():
+    plan = sample_plan()
+    restored = GraphPlan.from_dict(plan.to_dict())
+    assert restored.vertices == plan.vertices
+    assert restored.edges == plan.edges
+    assert restored.manifests == plan.manifests
+
+
+def test_export_import_round_trip(tmp_path):
+    plan = sample_plan()
+    paths = export_plan(plan, tmp_path / "export", extra={"kv": {"Pub": {"sha256": "abc"}}})
+
+    assert set(paths) == {"vertices", "edges", "plan"}
+    with open(paths["vertices"], encoding="utf-8") as f:
+        assert len(f.readlines()) == len(plan.vertices)
+
+    restored, extra = import_plan(tmp_path / "export")
+    assert restored.vertices == plan.vertices
+    assert restored.edges == plan.edges
+    assert restored.manifests == plan.manifests
+    assert extra == {"kv": {"Pub": {"sha256": "abc"}}}
+
+
+def test_export_is_graphson(tmp_path):
+    paths = export_plan(sample_plan(), tmp_path)
+    with open(paths["vertices"], encoding="utf-8") as f:
+        vertices = [json.loads(line) for line in f]
+    with open(paths["edges"], encoding="utf-8") as f:
+        edges = [json.loads(line) for line in f]
+
+    assert vertices[2] == {
+        "id": "Pub:en:1:0",
+        "label": "chunk",
+        "type": "vertex",
+        "properties": {
+            "lang": [{"id": "Pub:en:1:0|lang", "value": "en"}],
+            "heading": [{"id": "Pub:en:1:0|heading", "value": "Intro"}],
+            "order": [{"id": "Pub:en:1:0|order", "value": 0}],
+        },
+    }
+    assert edges[0] == {
+        "id": "Pub|parent|Pub:en:1",
+        "label": "parent",
+        "type": "edge",
+        "outV": "Pub",
+        "inV": "Pub:en:1",
+        "outVLabel": "publication",
+        "inVLabel": "topic",
+    }
+
+
+def test_export_leaves_out_unknown_vertex_labels(tmp_path):
+    plan = GraphPlan().add_edge("Pub:en:1", "related", "Other:en:9")
+    paths = export_plan(plan, tmp_path)
+    with open(paths["edges"], encoding="utf-8") as f:
+        [edge] = [json.loads(line) for line in f]
+    assert "outVLabel" not in edge and "inVLabel" not in edge
@@ -0,0 +1,141 @@
+from concurrent.futures import Future
+
+import pytest
+
+# needs the gremlin dependencies installed (not a live service)
+graph = pytest.importorskip("fns.graph")
+
+
+def server_error(status):
+    return graph.GremlinServerError({
+        "code": 500,
+        "message": "Request failed",
+        "attributes": {"x-ms-status-code": status, "x-ms-retry-after-ms": "0"},
+    })
+
+
+def throttled():
+    return server_error(429)
+
+
+class ResultSet:
+    """
+    Pages of a scripted response, raising the exception in it (if any)
+    after the pages before it
+    """
+
+    status_attributes = {}
+
+    def __init__(self, response):
+        self.response = response
+
+    def __iter__(self):
+        for page in self.response:
+            if isinstance(page, Exception):
+                raise page
+            yield page
+
+    def all(self):
+        future = Future()
+        future.set_result([x for page in self for x in page])
+        return future
+
+
+class FakeClient:
+    """
+    Answers each submitted query with the next scripted response: a list
+    of pages, or an exception raised after the pages before it
+    """
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.queries = []
+
+    def submitAsync(self, query, bindings=None):
+        self.queries.append((query, bindings))
+        future = Future()
+        future.set_result(ResultSet(self.responses.pop(0)))
+        return future
+
+
+def test_iter_descendants_streams_pages():
+    client = FakeClient([[["a", "b"], ["c"]]])
+    pages = graph.iter_descendants(["root"], client=client)
+    assert next(pages) == ["a", "b"]
+    # the second page is only read when asked for
+    assert next(pages) == ["c"]
+    assert list(pages) == []
+    [(query, bindings)] = client.queries
+    assert query == "g.V(_id0).repeat(out(_relation).simplePath()).emit().dedup().id()"
+    assert bindings == {"_id0": "root", "_relation": "parent"}
+
+
+def test_iter_descendants_retries_without_repeating_pages():
+    client = FakeClient([
+        [["a", "b"], throttled()],
+        [["a", "b"], ["c"]],
+    ])
+    assert list(graph.iter_descendants(["root"], client=client)) == [["a", "b"], ["c"]]
+    assert len(client.queries) == 2
+
+
+def test_iter_descendants_batches_roots():
+    client = FakeClient([[["a", "b"]], [["b", "c"]]])
+    assert graph.descendant_ids(["r1", "r2", "r3"], client=client, batch_size=2) == [
+        "a", "b", "c"]
+    assert [bindings for _, bindings in client.queries] == [
+        {"_id0": "r1", "_id1": "r2", "_relation": "parent"},
+        {"_id0": "r3", "_relation": "parent"},
+    ]
+
+
+def test_iter_descendants_raises_when_retries_run_out():
+    client = FakeClient([[throttled()]] * 6)
+    with pytest.raises(RuntimeError):
+        graph.descendant_ids(["root"], client=client, max_depth=2)
+    assert "times(_depth)" in client.queries[0][0]
+
+
+def test_reconcile_drops_descendants_before_their_topics():
+    client = FakeClient([
+        # topic children of the publication
+        [["Pub:en:1", "Pub:en:2", "Pub:en:3"]],
+        # descendants of the stale topics, shallowest first
+        [["Pub:en:2:0", "Pub:en:3:0"], ["Pub:en:2:0:0"]],
+        # drops
+        [[]], [[]], [[]],
+    ])
+    reconciled = graph.reconcile(
+        {"Pub": {"Pub:en:1"}, "Empty": set()}, client=client, batch_size=2)
+    assert reconciled == {
+        "stale": {"Pub": ["Pub:en:2", "Pub:en:3"]},
+        "targets": ["Pub:en:2:0:0", "Pub:en:3:0", "Pub:en:2:0", "Pub:en:2", "Pub:en:3"],
+        "failed": [],
+    }
+    drops = [bindings for query, bindings in client.queries if query.endswith(".drop()")]
+    assert drops == [
+        {"_id0": "Pub:en:2:0:0", "_id1": "Pub:en:3:0"},
+        {"_id0": "Pub:en:2:0"},
+        {"_id0": "Pub:en:2", "_id1": "Pub:en:3"},
+    ]
+    assert not client.responses
+
+
+def test_reconcile_keeps_topics_when_a_descendant_drop_fails():
+    client = FakeClient([
+        [["Pub:en:1", "Pub:en:2"]],
+        [["Pub:en:2:0"]],
+        [server_error(400)],
+    ])
+    reconciled = graph.reconcile({"Pub": {"Pub:en:1"}}, client=client)
+    assert [x["status"] for x in reconciled["failed"]] == [400]
+    assert "Pub:en:2" not in reconciled["targets"]
+    assert not any(
+        bindings == {"_id0": "Pub:en:2"}
+        for query, bindings in client.queries if query.endswith(".drop()"))
+
+
+def test_reconcile_without_stale_topics():
+    client = FakeClient([[["Pub:en:1"]]])
+    assert graph.reconcile({"Pub": {"Pub:en:1"}}, client=client) == {
+        "stale": {}, "targets": [], "failed": []}
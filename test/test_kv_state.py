@@ -0,0 +1,110 @@
+import gzip
+import json
+
+import pytest
+
+# needs the service dependencies installed (not a live service)
+kv_state = pytest.importorskip("fns.kv_state")
+
+
+@pytest.fixture(autouse=True)
+def local_files(monkeypatch):
+    """
+    Read and write snapshots on the local filesystem, whatever isLocal is
+    """
+    def read_file(path, binary=False):
+        with open(path, "rb" if binary else "r") as f:
+            return f.read()
+
+    def write_file(path, data):
+        with open(path, "wb" if isinstance(data, bytes) else "w") as f:
+            f.write(data)
+
+    monkeypatch.setattr(kv_state, "read_file", read_file)
+    monkeypatch.setattr(kv_state, "write_file", write_file)
+
+
+@pytest.fixture(params=["sqlite", "json"])
+def open_store(request, tmp_path):
+    def open_store():
+        kwargs = {
+            "snapshot_path": str(tmp_path / "kv.json.gz"),
+            "legacy_path": str(tmp_path / "kv.json"),
+        }
+        if request.param == "sqlite":
+            kwargs["path"] = str(tmp_path / "kv.sqlite3")
+        return kv_state.open_kv_store(request.param, **kwargs)
+
+    return open_store
+
+
+def test_read_write(open_store):
+    kv = open_store()
+    assert len(kv) == 0
+    kv["Pub"] = {"sha256": "abc"}
+    kv["Pub:en:1"] = {"size": 1}
+    assert kv["Pub"] == {"sha256": "abc"}
+    assert sorted(kv) == ["Pub", "Pub:en:1"]
+    del kv["Pub:en:1"]
+    assert "Pub:en:1" not in kv
+    with pytest.raises(KeyError):
+        del kv["Pub:en:1"]
+    assert kv.changes() == {"Pub": {"sha256": "abc"}, "Pub:en:1": None}
+
+
+def test_commit_and_rollback(open_store):
+    kv = open_store()
+    kv["Pub"] = {"sha256": "abc"}
+    kv["Pub:en:1"] = {"size": 1}
+    kv.commit(snapshot=True)
+    assert kv.changes() == {}
+
+    kv["Pub"] = {"sha256": "def"}
+    kv["Pub"] = {"sha256": "ghi"}
+    kv["Pub:en:2"] = {"size": 2}
+    del kv["Pub:en:1"]
+    kv.rollback()
+
+    assert kv.changes() == {}
+    assert dict(kv) == {"Pub": {"sha256": "abc"}, "Pub:en:1": {"size": 1}}
+    # what was committed survives in a new store
+    assert dict(open_store()) == {"Pub": {"sha256": "abc"}, "Pub:en:1": {"size": 1}}
+
+
+def test_apply(open_store):
+    kv = open_store()
+    kv["Pub:en:1"] = {"size": 1}
+    kv.commit()
+    kv.apply({"Pub:en:1": None, "Pub:en:2": {"size": 2}, "Pub:en:3": None})
+    assert dict(kv) == {"Pub:en:2": {"size": 2}}
+
+
+def test_publication_prefix_scan(open_store):
+    kv = open_store()
+    for key in ["Pub", "Pub:en:1", "Pub:en:2", "Pub2", "Pub2:en:1", "Pu", "Other:en:1"]:
+        kv[key] = {"key": key}
+    assert sorted(kv.publication("Pub")) == ["Pub", "Pub:en:1", "Pub:en:2"]
+    assert kv.publication("Missing") == {}
+
+
+def test_seeded_from_snapshot(open_store, tmp_path):
+    with open(tmp_path / "kv.json.gz", "wb") as f:
+        f.write(gzip.compress(json.dumps({"Pub": {"sha256": "abc"}}).encode("utf-8")))
+    with open(tmp_path / "kv.json", "w") as f:
+        json.dump({"Legacy": {}}, f)
+    assert dict(open_store()) == {"Pub": {"sha256": "abc"}}
+
+
+def test_seeded_from_legacy_json(open_store, tmp_path):
+    with open(tmp_path / "kv.json", "w") as f:
+        json.dump({"Pub": {"sha256": "abc"}, "Pub:en:1": {"size": 1}}, f)
+    kv = open_store()
+    assert kv.publication("Pub") == {"Pub": {"sha256": "abc"}, "Pub:en:1": {"size": 1}}
+
+    kv["Pub:en:2"] = {"size": 2}
+    size = kv.commit(snapshot=True)
+    with open(tmp_path / "kv.json.gz", "rb") as f:
+        data = f.read()
+    assert size == len(data)
+    assert json.loads(gzip.decompress(data)) == {
+        "Pub": {"sha256": "abc"}, "Pub:en:1": {"size": 1}, "Pub:en:2": {"size": 2}}
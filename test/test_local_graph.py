@@ -0,0 +1,156 @@
+import pytest
+
+from fns.graph_plan import GraphPlan, export_plan
+from fns.local_graph import LocalGraph
+
+
+@pytest.fixture
+def graph():
+    plan = GraphPlan()
+    plan.add_vertex("Pub", "publication", {"title": "Pub"})
+    plan.add_vertex("Pub:en:1", "topic", {"title": "One"})
+    plan.add_vertex("Pub:en:2", "topic", {"title": "Two"})
+    plan.add_vertex("Pub:en:1:0", "chunk", {"heading": "Intro", "order": 0})
+    plan.add_vertex("Pub:en:1:1", "chunk", {"heading": "Setup", "order": 1})
+    for from_id, label, to_id in [
+        ("Pub", "parent", "Pub:en:1"),
+        ("Pub", "parent", "Pub:en:2"),
+        ("Pub:en:1", "parent", "Pub:en:1:0"),
+        ("Pub:en:1", "parent", "Pub:en:1:1"),
+        ("Pub:en:1:0", "child", "Pub:en:1"),
+        ("Pub:en:1:1", "child", "Pub:en:1"),
+        ("Pub:en:1:1", "related", "Pub:en:2"),
+        # to a topic of a publication that was not loaded
+        ("Pub:en:1:1", "related", "Other:en:9"),
+    ]:
+        plan.add_edge(from_id, label, to_id)
+    return LocalGraph.from_plan(plan)
+
+
+def test_element_shape(graph):
+    assert graph.element("Pub:en:1:0") == {
+        "id": "Pub:en:1:0",
+        "label": "chunk",
+        "type": "vertex",
+        "properties": {
+            "lang": [{"id": "Pub:en:1:0|lang", "value": "en"}],
+            "heading": [{"id": "Pub:en:1:0|heading", "value": "Intro"}],
+            "order": [{"id": "Pub:en:1:0|order", "value": 0}],
+        },
+    }
+
+
+def test_get_connected_tree(graph):
+    [tree] = graph.get_connected("Pub:en:1", "parent")
+    assert list(tree) == ["Pub:en:1"]
+    assert tree["Pub:en:1"]["key"]["id"] == "Pub:en:1"
+    children = tree["Pub:en:1"]["value"]
+    assert set(children) == {"Pub:en:1:0", "Pub:en:1:1"}
+    assert children["Pub:en:1:0"] == {"key": graph.element("Pub:en:1:0"), "value": {}}
+
+
+def test_get_connected_filters(graph):
+    [tree] = graph.get_connected("Pub:en:1", "parent", ("heading", "Setup"))
+    assert list(tree["Pub:en:1"]["value"]) == ["Pub:en:1:1"]
+
+    [tree] = graph.get_connected("Pub:en:1", "child", direction="in")
+    assert set(tree["Pub:en:1"]["value"]) == {"Pub:en:1:0", "Pub:en:1:1"}
+
+    # missing vertices (and edges to them) are left out
+    [tree] = graph.get_connected("Pub:en:1:1", "related")
+    assert list(tree["Pub:en:1:1"]["value"]) == ["Pub:en:2"]
+
+    assert graph.get_connected("Pub:en:1", "parent", ("heading", "None")) == [{}]
+    assert graph.get_connected("Nope", "parent") == [{}]
+
+
+def test_get_in_common(graph):
+    assert graph.get_in_common(["Pub:en:1:0", "Pub:en:1:1"]) == [
+        {"Pub:en:1": 4, "Pub:en:2": 1}
+    ]
+
+
+def test_get_most_connected(graph):
+    ranked = graph.get_most_connected(["Pub:en:2", "Pub:en:1", "Nope"], "in", pop=False)
+    assert [(x["vertex"]["id"], x["degree"]) for x in ranked] == [
+        ("Pub:en:1", 3),
+        ("Pub:en:2", 2),
+    ]
+    assert graph.get_most_connected(["Pub:en:2", "Pub:en:1"], "in") == [
+        graph.element("Pub:en:1")
+    ]
+    assert graph.get_most_connected([], "in") == []
+
+
+def test_get_connections(graph):
+    assert graph.get_connections(["Pub", "Pub:en:2"], "out") == [2, 0]
+    assert graph.get_connections(["Pub", "Pub:en:2"], "both", "sum") == [4]
+    assert graph.get_connections(["Pub", "Pub:en:2"], "both", "mean") == [2]
+    assert graph.get_connections([], "both", "count") == [0]
+    assert graph.get_connections([], "both", "mean") == []
+
+
+def test_get_mean(graph):
+    assert graph.get_mean(sample=100, direction="out") == [8 / 5]
+    assert LocalGraph().get_mean() == []
+
+
+def test_add_vertex_updates_properties(graph):
+    graph.add_vertex("Pub:en:2", "topic", {"title": "Two (updated)"})
+    assert graph.vertices["Pub:en:2"]["properties"] == {
+        "lang": "en",
+        "title": "Two (updated)",
+    }
+
+
+def test_drop_vertex(graph):
+    graph.drop_vertex("Pub:en:1:1")
+    assert "Pub:en:1:1" not in graph.vertices
+    assert not any("Pub:en:1:1" in (f, t) for f, _, t in graph.edges)
+    assert graph.adjacent("Pub:en:1", "out", "parent") == ["Pub:en:1:0"]
+    assert graph.adjacent("Pub:en:2", "in") == ["Pub"]
+    assert len(graph) == 4 + 4
+
+
+def test_adjacent_rejects_unknown_direction(graph):
+    with pytest.raises(ValueError):
+        graph.adjacent("Pub", "sideways")
+
+
+def test_from_export(graph, tmp_path):
+    plan = GraphPlan()
+    for vertex_id, vertex in graph.vertices.items():
+        plan.add_vertex(vertex_id, vertex["label"], vertex["properties"])
+    for edge in graph.edges:
+        plan.add_edge(*edge)
+    export_plan(plan, tmp_path)
+
+    restored = LocalGraph.from_export(tmp_path)
+    assert restored.vertices == graph.vertices
+    assert restored.edges == graph.edges
+    assert restored.get_connected("Pub:en:1", "parent") == graph.get_connected(
+        "Pub:en:1", "parent")
+
+
+def test_graph_get_functions_use_local_graph(graph):
+    # needs the service dependencies installed (not a live service)
+    azure_fns = pytest.importorskip("fns.azure_fns")
+    azure_fns.use_local_graph(graph)
+    try:
+        chunks = azure_fns.graph_xf_props(
+            azure_fns.graph_get_connected("Pub:en:1", "parent"))
+        assert sorted(chunks, key=lambda x: x["order"]) == [
+            {"id": "Pub:en:1:0", "label": "chunk", "type": "vertex",
+             "heading": "Intro", "order": 0},
+            {"id": "Pub:en:1:1", "label": "chunk", "type": "vertex",
+             "heading": "Setup", "order": 1},
+        ]
+        [chunk] = azure_fns.graph_xf_props(
+            azure_fns.graph_get_chunk_by_parent("Pub:en:1", "Setup"))
+        assert chunk["id"] == "Pub:en:1:1"
+        assert azure_fns.graph_get_most_connected(
+            ["Pub:en:1", "Pub:en:2"], "in", pop=False) == {"Pub:en:1": 3, "Pub:en:2": 2}
+        assert azure_fns.graph_get_in_common(["Pub:en:1:0", "Pub:en:1:1"])[0] == {
+            "Pub:en:1": 4, "Pub:en:2": 1}
+    finally:
+        azure_fns.use_local_graph(None)
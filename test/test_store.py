@@ -0,0 +1,100 @@
+from types import SimpleNamespace
+
+import pytest
+
+# needs the search dependencies installed (not a live service)
+store = pytest.importorskip("fns.store")
+
+
+class FakeClient:
+    """
+    Answers upload_documents from a {key: [status per attempt]} script (the
+    last status repeats), raising 413 for requests over max_documents
+    """
+
+    def __init__(self, statuses, max_documents=None):
+        self.statuses = statuses
+        self.max_documents = max_documents
+        self.attempts = {}
+        self.requests = []
+
+    def upload_documents(self, documents):
+        self.requests.append([doc["id"] for doc in documents])
+        if self.max_documents and len(documents) > self.max_documents:
+            error = store.HttpResponseError(message="Request Entity Too Large")
+            error.status_code = 413
+            raise error
+        results = []
+        for doc in documents:
+            key = doc["id"]
+            script = self.statuses.get(key, [200])
+            attempt = self.attempts.get(key, 0)
+            self.attempts[key] = attempt + 1
+            status = script[min(attempt, len(script) - 1)]
+            results.append(SimpleNamespace(
+                key=key, succeeded=status < 300, status_code=status))
+        return results
+
+
+def documents(*keys):
+    return [{"id": key, "content": key} for key in keys]
+
+
+def test_upload_batch():
+    client = FakeClient({})
+    assert store.upload_batch(client, documents("a", "b"), backoff=0) == []
+    assert client.requests == [["a", "b"]]
+
+
+def test_upload_batch_keeps_permanent_failures_across_retries():
+    client = FakeClient({"a": [400], "b": [429, 200]})
+    failed = store.upload_batch(client, documents("a", "b", "c"), backoff=0)
+    assert failed == ["a"]
+    # only the throttled document is sent again
+    assert client.requests == [["a", "b", "c"], ["b"]]
+
+
+def test_upload_batch_gives_up_after_retries():
+    client = FakeClient({"a": [400], "b": [429], "c": [503, 400]})
+    failed = store.upload_batch(
+        client, documents("a", "b", "c"), retries=2, backoff=0)
+    assert sorted(failed) == ["a", "b", "c"]
+    assert client.requests == [["a", "b", "c"], ["b", "c"], ["b"]]
+
+
+def test_upload_batch_splits_too_large_requests():
+    client = FakeClient({"a": [400], "d": [429, 200]}, max_documents=2)
+    failed = store.upload_batch(client, documents("a", "b", "c", "d"), backoff=0)
+    assert failed == ["a"]
+    assert client.requests == [
+        ["a", "b", "c", "d"],
+        ["a", "b"],
+        ["c", "d"],
+        ["d"],
+    ]
+
+
+def test_upload_batch_keeps_failures_from_before_a_split():
+    class Client(FakeClient):
+        def upload_documents(self, documents):
+            # the retry is the request that turns out too large
+            self.max_documents = 1 if self.requests else None
+            return super().upload_documents(documents)
+
+    client = Client({"a": [400], "b": [429, 200], "c": [429, 200]})
+    failed = store.upload_batch(client, documents("a", "b", "c"), backoff=0)
+    assert failed == ["a"]
+    assert client.requests == [["a", "b", "c"], ["b", "c"], ["b"], ["c"]]
+
+
+def test_split_batches():
+    docs = documents("a", "b", "c")
+    size = len(store.json.dumps(docs[0]).encode("utf-8"))
+    assert [
+        [doc["id"] for doc in batch]
+        for batch, _ in store.split_batches(docs, max_documents=2)
+    ] == [["a", "b"], ["c"]]
+    assert [
+        (len(batch), batch_bytes)
+        for batch, batch_bytes in store.split_batches(docs, max_bytes=2 * size)
+    ] == [(2, 2 * size), (1, size)]